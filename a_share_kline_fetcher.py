@@ -23,6 +23,15 @@ import sqlite3
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from config import LONGBRIDGE_CONFIG
+from bar_aggregator import init_bar_tables, update_bars
+from indicator_engine import init_indicator_tables, update_indicators
+from returns_engine import init_returns_table, update_returns
+from stock_search import rebuild_search_index
+from lazy_query import LazyQuery
+from query_cache import init_version_table, bump_data_version, STOCK_INFO_VERSION_KEY
+from data_exporter import (
+    stream_query_to_csv, stream_query_to_columnar, export_groups_parallel, DEFAULT_CHUNK_ROWS
+)
 
 # 完整网络修复补丁
 import urllib3
@@ -175,6 +184,16 @@ class AShareKlineFetcher:
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_symbol_date ON kline_data(symbol, date)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_date ON kline_data(date)")
             
+            # 创建周线/月线/季线聚合表
+            init_bar_tables(conn, "kline")
+            
+            # 创建技术指标表和收益率派生表
+            init_indicator_tables(conn, "kline")
+            init_returns_table(conn, "kline")
+            
+            # 创建数据版本表（用于查询缓存失效）
+            init_version_table(conn)
+            
             conn.commit()
             conn.close()
             logger.info("数据库初始化完成")
@@ -384,6 +403,15 @@ class AShareKlineFetcher:
                     row['low'], row['close'], row['volume'], row['amount']
                 ))
             
+            # 增量更新受影响周期的周线/月线/季线，并递推技术指标和收益率/净值
+            for symbol, first_date in df.groupby('symbol')['date'].min().items():
+                update_bars(conn, "kline", symbol, first_date)
+                update_indicators(conn, "kline", symbol, first_date)
+                update_returns(conn, "kline", symbol, first_date)
+            
+            # 递增数据版本号，使查询缓存失效
+            bump_data_version(conn, df['symbol'].unique())
+            
             conn.commit()
             conn.close()
             
@@ -405,7 +433,21 @@ class AShareKlineFetcher:
                     datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 ))
             
+            # 搜索索引与股票信息、版本号在同一事务中提交，读到新版本号时索引一定已重建
+            # （FTS5 trigram 分词需要 SQLite 3.34+，不支持时回滚到保存点，只更新股票信息）
+            conn.execute("SAVEPOINT search_index")
+            try:
+                rebuild_search_index(conn)
+                conn.execute("RELEASE search_index")
+            except sqlite3.OperationalError as e:
+                conn.execute("ROLLBACK TO search_index")
+                conn.execute("RELEASE search_index")
+                logger.warning(f"搜索索引未更新: {e}")
+            
+            bump_data_version(conn, [STOCK_INFO_VERSION_KEY])
+            
             conn.commit()
+            
             conn.close()
             
         except Exception as e:
@@ -562,8 +604,18 @@ class AShareKlineFetcher:
         except Exception as e:
             logger.error(f"生成汇总报告失败: {e}")
     
-    def export_to_csv(self, output_dir: str = None, split_by_symbol: bool = False):
-        """导出数据到CSV文件"""
+    def export_to_csv(self, output_dir: str = None, split_by_symbol: bool = False,
+                      compression: str = None, chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                      workers: int = None):
+        """导出数据到CSV文件
+        
+        Args:
+            output_dir: 输出目录
+            split_by_symbol: 是否按股票分别导出
+            compression: 压缩方式，None / "gzip" / "zstd"
+            chunk_rows: 每批读取的行数（决定内存上限）
+            workers: 按股票导出时的进程数，默认CPU核数，1 为串行
+        """
         if output_dir is None:
             output_dir = os.path.join(self.data_dir, "csv_export")
         
@@ -573,68 +625,70 @@ class AShareKlineFetcher:
             conn = sqlite3.connect(self.db_path)
             
             if split_by_symbol:
-                # 按股票分别导出
-                cursor = conn.cursor()
-                cursor.execute("SELECT DISTINCT symbol FROM kline_data ORDER BY symbol")
-                symbols = [row[0] for row in cursor.fetchall()]
-                
-                logger.info(f"开始导出 {len(symbols)} 只股票的CSV文件...")
-                
-                for i, symbol in enumerate(symbols):
-                    if i % 100 == 0:
-                        logger.info(f"导出进度: {i}/{len(symbols)}")
-                    
-                    df = pd.read_sql_query(
-                        "SELECT * FROM kline_data WHERE symbol = ? ORDER BY date",
-                        conn, params=(symbol,)
-                    )
-                    
-                    # 清理文件名中的特殊字符
-                    safe_symbol = symbol.replace('.', '_')
-                    filename = os.path.join(output_dir, f"{safe_symbol}.csv")
-                    df.to_csv(filename, index=False, encoding='utf-8-sig')
+                # 按股票分别导出，进程池并行，每个进程使用独立的只读连接
+                export_groups_parallel(
+                    self.db_path, "kline_data", "symbol", output_dir,
+                    workers=workers, compression=compression, chunk_rows=chunk_rows
+                )
                 
                 logger.info(f"CSV文件导出完成，保存在: {output_dir}")
             else:
-                # 导出全部数据到单个文件
+                # 流式导出全部数据到单个文件，内存占用由chunk_rows决定
                 logger.info("导出全部数据到单个CSV文件...")
-                df = pd.read_sql_query(
-                    "SELECT * FROM kline_data ORDER BY symbol, date",
-                    conn
-                )
-                
                 filename = os.path.join(output_dir, f"all_a_share_klines_{datetime.now().strftime('%Y%m%d')}.csv")
-                df.to_csv(filename, index=False, encoding='utf-8-sig')
+                stats = stream_query_to_csv(
+                    conn, "SELECT * FROM kline_data ORDER BY symbol, date", filename,
+                    chunk_rows=chunk_rows, compression=compression
+                )
                 
-                logger.info(f"CSV文件已保存到: {filename}")
+                logger.info(f"CSV文件已保存到: {stats['path']}")
             
             conn.close()
             
         except Exception as e:
             logger.error(f"导出CSV文件失败: {e}")
     
-    def query_stock_data(self, symbol: str, start_date: str = None, end_date: str = None) -> pd.DataFrame:
-        """查询指定股票的K线数据"""
+    def export_to_columnar(self, output_dir: str = None, file_format: str = "parquet",
+                           compression: str = "zstd") -> Optional[str]:
+        """导出全部K线数据为Parquet或Feather文件（带类型列，流式写入）
+        
+        Args:
+            output_dir: 输出目录
+            file_format: "parquet" 或 "feather"
+            compression: 压缩方式，如 "zstd" / "snappy" / "lz4"，None 不压缩
+        Returns:
+            输出文件路径
+        """
+        if output_dir is None:
+            output_dir = os.path.join(self.data_dir, "columnar_export")
+        
+        os.makedirs(output_dir, exist_ok=True)
+        
         try:
             conn = sqlite3.connect(self.db_path)
+            filename = os.path.join(output_dir, f"all_a_share_klines_{datetime.now().strftime('%Y%m%d')}")
+            stats = stream_query_to_columnar(
+                conn, "SELECT * FROM kline_data ORDER BY symbol, date", filename,
+                file_format=file_format, compression=compression
+            )
+            conn.close()
             
-            query = "SELECT * FROM kline_data WHERE symbol = ?"
-            params = [symbol]
-            
-            if start_date:
-                query += " AND date >= ?"
-                params.append(start_date)
-            
-            if end_date:
-                query += " AND date <= ?"
-                params.append(end_date)
-            
-            query += " ORDER BY date"
+            logger.info(f"{file_format}文件已保存到: {stats['path']}")
+            return stats['path']
             
-            df = pd.read_sql_query(query, conn, params=params)
-            conn.close()
+        except Exception as e:
+            logger.error(f"导出{file_format}文件失败: {e}")
+            return None
+    
+    def query_stock_data(self, symbol: str, start_date: str = None, end_date: str = None,
+                         columns: List[str] = None) -> pd.DataFrame:
+        """查询指定股票的K线数据（columns 指定时只读取这些列，date 保持字符串）"""
+        try:
+            query = LazyQuery(self.db_path).symbols(symbol).between(start_date, end_date)
+            if columns:
+                query = query.select(columns)
             
-            return df
+            return query.to_pandas(parse_dates=False)
             
         except Exception as e:
             logger.error(f"查询股票数据失败: {e}")
@@ -670,6 +724,11 @@ def main():
         if export_choice == 'y':
             split_choice = input("是否按股票分别导出？(y/n): ").lower().strip()
             fetcher.export_to_csv(split_by_symbol=(split_choice == 'y'))
+        
+        # 询问是否导出列式文件
+        columnar_choice = input("是否导出为Parquet文件？(y/n): ").lower().strip()
+        if columnar_choice == 'y':
+            fetcher.export_to_columnar(file_format="parquet")
             
     except KeyboardInterrupt:
         print("\n⏹️ 用户中断下载")
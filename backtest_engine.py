@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+向量化回测引擎
+在按日期对齐的收盘价/成交量面板上进行 信号 -> 持仓 -> 收益 的整表运算：
+- 信号在当日收盘后产生，按当日收盘价调仓，持有到下一交易日（持仓 = 权重.shift(1)），
+  最短持有一个交易日，满足A股T+1
+- 涨停时不能买入、跌停时不能卖出、停牌不能交易，受限时沿用上一日实际持仓
+  （买卖方向取决于实际持仓，需逐日推进），其余股票按剩余仓位重新分配
+- 收益率按前向填充后的收盘价计算，停牌期间的涨跌计入复牌当日
+- 佣金双边收取，印花税只在卖出时收取
+- 参数扫描使用进程池并行，结果与 index_data 中的指数对比
+"""
+
+import os
+import time
+import logging
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TRADING_DAYS_PER_YEAR = 252
+
+# 默认交易成本
+DEFAULT_COMMISSION = 0.00025   # 佣金（双边）
+DEFAULT_STAMP_DUTY = 0.0005    # 印花税（卖出）
+DEFAULT_SLIPPAGE = 0.0         # 滑点（双边）
+
+# 涨跌幅限制制度的起始日期
+PRICE_LIMIT_START = pd.Timestamp("1996-12-16")
+CHINEXT_20PCT_START = pd.Timestamp("2020-08-24")
+
+# 判断涨跌停时的容差（数据为前复权价格，无法按分位取整比较）
+LIMIT_TOLERANCE = 0.002
+
+
+def price_limit_ratios(symbols: List[str], dates: pd.DatetimeIndex,
+                       names: Dict[str, str] = None) -> np.ndarray:
+    """每只股票每个交易日的涨跌幅限制比例（日期 × 股票），无限制为inf
+
+    主板10%，创业板（2020-08-24起）和科创板20%，北交所30%，ST股票5%。
+    ST按当前股票名称判断。
+    """
+    names = names or {}
+    dates = pd.DatetimeIndex(dates)
+    ratios = np.empty((len(dates), len(symbols)))
+
+    for j, symbol in enumerate(symbols):
+        if symbol.startswith("bj"):
+            ratio = np.full(len(dates), 0.30)
+        elif symbol.startswith("sh688"):
+            ratio = np.full(len(dates), 0.20)
+        elif symbol.startswith("sz30"):
+            ratio = np.where(dates >= CHINEXT_20PCT_START, 0.20, 0.10)
+        elif "ST" in (names.get(symbol) or "").upper():
+            ratio = np.full(len(dates), 0.05)
+        else:
+            ratio = np.full(len(dates), 0.10)
+        ratios[:, j] = ratio
+
+    ratios[dates < PRICE_LIMIT_START] = np.inf
+    return ratios
+
+
+def load_panel(query, symbols: List[str], start_date: str = None, end_date: str = None,
+               fields=("close", "volume"), compact: bool = False) -> Dict[str, pd.DataFrame]:
+    """通过 KlineDataQuery.query_panel 读取回测面板
+
+    Args:
+        compact: 价格使用 float32 存储（全市场回测时内存减半，收益率计算仍为 float64）
+
+    Returns:
+        {字段: DataFrame(index=date, columns=symbol)}，另含 'names': {symbol: name}
+    """
+    wide = query.query_panel(symbols, start_date, end_date, fields=list(fields), compact=compact)
+    if wide.empty:
+        return {}
+
+    panel = {field: wide[field] for field in fields}
+    panel["names"] = query.get_stock_names(list(panel["close"].columns))
+    return panel
+
+
+def load_benchmark(query, index_name: str, dates: pd.DatetimeIndex) -> pd.Series:
+    """读取与回测日期对齐的指数收盘价"""
+    index_df = query.query_index_data(index_name, dates.min().strftime("%Y-%m-%d"),
+                                      dates.max().strftime("%Y-%m-%d"))
+    if index_df.empty:
+        return pd.Series(dtype=float)
+    return index_df.set_index("date")["close"].reindex(dates)
+
+
+def signal_to_weights(signal: pd.DataFrame, max_gross: float = 1.0) -> np.ndarray:
+    """信号 -> 目标权重：非负信号按行归一化，总仓位不超过 max_gross（A股不可做空）"""
+    values = np.nan_to_num(np.clip(signal.to_numpy(dtype=np.float64), 0, None))
+    total = values.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total > 0, values / total * max_gross, 0.0)
+
+
+def apply_trade_limits(target: np.ndarray, tradable: np.ndarray, limit_up: np.ndarray,
+                       limit_down: np.ndarray, max_gross: float = 1.0) -> np.ndarray:
+    """按成交限制把目标权重转换为实际持仓（日期 × 股票）
+
+    停牌、涨停买入、跌停卖出的股票沿用上一日实际持仓；买卖方向由上一日实际持仓判断，
+    因此逐日推进。受限持仓占用的仓位先扣除，其余股票的目标权重按剩余仓位等比缩减，
+    总仓位不超过 max_gross。
+    """
+    positions = np.zeros_like(target)
+    previous = np.zeros(target.shape[1])
+
+    for t in range(len(target)):
+        wanted = target[t]
+        fixed = ~tradable[t] | (limit_up[t] & (wanted > previous)) | (limit_down[t] & (wanted < previous))
+
+        while True:
+            row = np.where(fixed, previous, wanted)
+            budget = max(max_gross - row[fixed].sum(), 0.0)
+            free_total = row[~fixed].sum()
+            if free_total > budget:
+                row[~fixed] *= budget / free_total
+            # 缩减后变为卖出的跌停股票不能卖出，改为沿用持仓后重新分配
+            newly_fixed = ~fixed & limit_down[t] & (row < previous)
+            if not newly_fixed.any():
+                break
+            fixed |= newly_fixed
+
+        positions[t] = row
+        previous = row
+
+    return positions
+
+
+def run_backtest(panel: Dict[str, pd.DataFrame], signal: pd.DataFrame,
+                 commission: float = DEFAULT_COMMISSION, stamp_duty: float = DEFAULT_STAMP_DUTY,
+                 slippage: float = DEFAULT_SLIPPAGE, price_limits: bool = True,
+                 benchmark: pd.Series = None, max_gross: float = 1.0) -> dict:
+    """向量化回测
+
+    Args:
+        panel: load_panel 返回的面板（至少包含 close）
+        signal: 与 panel['close'] 同形状的信号，>0 表示持有，数值越大权重越高
+        commission: 佣金费率（双边）
+        stamp_duty: 印花税费率（卖出）
+        slippage: 滑点（双边，按成交额比例）
+        price_limits: 是否执行涨跌停、停牌成交限制
+        benchmark: 与面板日期对齐的指数收盘价
+        max_gross: 总仓位上限
+    Returns:
+        {'returns', 'nav', 'turnover', 'positions', 'benchmark_nav', 'stats'}
+    """
+    close_df = panel["close"]
+    signal = signal.reindex(index=close_df.index, columns=close_df.columns)
+    close = close_df.to_numpy(dtype=np.float64)
+    # 停牌日沿用最后成交价：停牌期间收益为0，复牌日收益相对最后成交价计算（只有上市前为NaN）
+    last_close = close_df.ffill().to_numpy(dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.vstack([np.full((1, close.shape[1]), np.nan), last_close[1:] / last_close[:-1] - 1])
+
+    target = signal_to_weights(signal, max_gross)
+
+    if price_limits:
+        # 停牌（无收盘价或无成交量）时无法交易
+        tradable = ~np.isnan(close)
+        if "volume" in panel:
+            volume = panel["volume"].reindex(index=close_df.index, columns=close_df.columns).to_numpy()
+            tradable &= np.nan_to_num(volume) > 0
+
+        limits = price_limit_ratios(list(close_df.columns), close_df.index, panel.get("names"))
+        limit_up = np.nan_to_num(returns) >= limits - LIMIT_TOLERANCE
+        limit_down = np.nan_to_num(returns) <= -limits + LIMIT_TOLERANCE
+
+        # 涨跌停相对最后成交价判断：涨停日不能加仓，跌停日不能减仓
+        positions = apply_trade_limits(target, tradable, limit_up, limit_down, max_gross)
+    else:
+        positions = target
+
+    # 持仓 = 前一日收盘后的权重，赚取当日收益
+    held = np.vstack([np.zeros((1, positions.shape[1])), positions[:-1]])
+    gross = np.nansum(held * np.nan_to_num(returns), axis=1)
+
+    trades = np.diff(positions, axis=0, prepend=0.0)
+    buys = np.clip(trades, 0, None).sum(axis=1)
+    sells = np.clip(-trades, 0, None).sum(axis=1)
+    costs = (buys + sells) * (commission + slippage) + sells * stamp_duty
+
+    daily = pd.Series(gross - costs, index=close_df.index, name="returns")
+    nav = (1 + daily).cumprod().rename("nav")
+    turnover = pd.Series(buys + sells, index=close_df.index, name="turnover")
+
+    benchmark_nav = None
+    if benchmark is not None and not benchmark.dropna().empty:
+        bench = benchmark.reindex(close_df.index).ffill()
+        benchmark_nav = (bench / bench.dropna().iloc[0]).rename("benchmark_nav")
+
+    return {
+        "returns": daily,
+        "nav": nav,
+        "turnover": turnover,
+        "positions": pd.DataFrame(positions, index=close_df.index, columns=close_df.columns),
+        "benchmark_nav": benchmark_nav,
+        "stats": performance_stats(daily, turnover, benchmark_nav),
+    }
+
+
+def performance_stats(returns: pd.Series, turnover: pd.Series = None,
+                      benchmark_nav: pd.Series = None) -> dict:
+    """绩效指标：总收益、年化收益、年化波动、夏普、最大回撤、胜率、换手、相对基准超额/Beta"""
+    values = returns.to_numpy(dtype=np.float64)
+    nav = np.cumprod(1 + values)
+    years = len(values) / TRADING_DAYS_PER_YEAR
+
+    drawdown = nav / np.maximum.accumulate(nav) - 1 if len(nav) else np.array([0.0])
+    volatility = values.std(ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR) if len(values) > 1 else np.nan
+    active = values[values != 0]
+
+    stats = {
+        "total_return": nav[-1] - 1 if len(nav) else 0.0,
+        "annual_return": nav[-1] ** (1 / years) - 1 if years > 0 and nav[-1] > 0 else np.nan,
+        "annual_volatility": volatility,
+        "sharpe": values.mean() / values.std(ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR)
+        if len(values) > 1 and values.std(ddof=1) > 0 else np.nan,
+        "max_drawdown": drawdown.min(),
+        "win_rate": (active > 0).mean() if len(active) else np.nan,
+        "avg_turnover": turnover.mean() if turnover is not None else np.nan,
+    }
+
+    if benchmark_nav is not None:
+        bench = benchmark_nav.dropna()
+        bench_returns = benchmark_nav.pct_change(fill_method=None).to_numpy()
+        if len(bench) > 1:
+            bench_annual = (bench.iloc[-1] / bench.iloc[0]) ** (1 / years) - 1 if years > 0 else np.nan
+            stats["benchmark_return"] = bench.iloc[-1] / bench.iloc[0] - 1
+            stats["excess_annual_return"] = stats["annual_return"] - bench_annual
+
+            valid = ~np.isnan(bench_returns)
+            if valid.sum() > 1 and np.var(bench_returns[valid]) > 0:
+                stats["beta"] = np.cov(values[valid], bench_returns[valid])[0, 1] / np.var(bench_returns[valid], ddof=1)
+
+    return stats
+
+
+# ==================== 内置策略（模块级函数，可在进程池中序列化） ====================
+
+def ma_cross(panel: Dict[str, pd.DataFrame], fast: int = 5, slow: int = 20) -> pd.DataFrame:
+    """均线多头：快线在慢线之上时持有"""
+    close = panel["close"]
+    return (close.rolling(fast).mean() > close.rolling(slow).mean()).astype(float)
+
+
+def momentum(panel: Dict[str, pd.DataFrame], lookback: int = 20, top_n: int = 10) -> pd.DataFrame:
+    """截面动量：持有过去 lookback 日涨幅最大的 top_n 只股票"""
+    change = panel["close"].pct_change(lookback, fill_method=None)
+    rank = change.rank(axis=1, ascending=False)
+    return (rank <= top_n).astype(float)
+
+
+def breakout(panel: Dict[str, pd.DataFrame], window: int = 20, volume_ratio: float = 2.0) -> pd.DataFrame:
+    """放量突破：收盘价创 window 日新高且成交量超过均量 volume_ratio 倍时持有，跌破均线离场"""
+    close, volume = panel["close"], panel["volume"]
+    entry = (close >= close.rolling(window).max()) & (volume > volume_ratio * volume.rolling(window).mean())
+    exit_ = close < close.rolling(window).mean()
+    state = pd.DataFrame(np.where(entry, 1.0, np.where(exit_, 0.0, np.nan)),
+                         index=close.index, columns=close.columns)
+    return state.ffill().fillna(0.0)
+
+
+STRATEGIES: Dict[str, Callable] = {
+    "ma_cross": ma_cross,
+    "momentum": momentum,
+    "breakout": breakout,
+}
+
+
+# ==================== 参数扫描 ====================
+
+_worker_panel = None
+_worker_benchmark = None
+
+
+def _init_sweep_worker(panel: dict, benchmark: Optional[pd.Series]):
+    """工作进程初始化：每个进程只接收一次面板数据"""
+    global _worker_panel, _worker_benchmark
+    _worker_panel = panel
+    _worker_benchmark = benchmark
+
+
+def _run_sweep_task(task: tuple) -> dict:
+    strategy, params, cost_kwargs = task
+    signal = strategy(_worker_panel, **params)
+    result = run_backtest(_worker_panel, signal, benchmark=_worker_benchmark, **cost_kwargs)
+    return {**params, **result["stats"]}
+
+
+def parameter_sweep(panel: Dict[str, pd.DataFrame], strategy: Callable, param_grid: Dict[str, list],
+                    benchmark: pd.Series = None, workers: int = None, **cost_kwargs) -> pd.DataFrame:
+    """参数网格扫描（进程池并行）
+
+    Args:
+        panel: 回测面板
+        strategy: 模块级策略函数 strategy(panel, **params) -> 信号
+        param_grid: {参数名: 候选值列表}
+        benchmark: 基准指数收盘价
+        workers: 进程数，默认CPU核数；1 表示在当前进程串行执行
+        cost_kwargs: 传给 run_backtest 的交易成本参数
+    Returns:
+        每组参数一行的绩效表，按夏普比率降序
+    """
+    names = list(param_grid)
+    tasks = [(strategy, dict(zip(names, values)), cost_kwargs)
+             for values in itertools.product(*(param_grid[n] for n in names))]
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks)) or 1
+    start_time = time.time()
+    logger.info(f"开始参数扫描: {len(tasks)} 组参数 (进程数: {workers})")
+
+    if workers <= 1:
+        _init_sweep_worker(panel, benchmark)
+        results = list(map(_run_sweep_task, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker,
+                                 initargs=(panel, benchmark)) as executor:
+            results = list(executor.map(_run_sweep_task, tasks))
+
+    logger.info(f"参数扫描完成，用时 {time.time() - start_time:.1f} 秒")
+    return pd.DataFrame(results).sort_values("sharpe", ascending=False, ignore_index=True)
+
+
+def main():
+    """主函数 - 交互式回测"""
+    from kline_data_query import KlineDataQuery
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    print("🚀 向量化回测")
+    print("=" * 50)
+
+    query = KlineDataQuery()
+
+    symbols = input("请输入股票代码，用逗号分隔 (如 sh600519,sz000001): ").strip()
+    symbols = [s.strip() for s in symbols.split(",") if s.strip()] or ["sh600519", "sz000001"]
+    start_date = input("开始日期 (YYYY-MM-DD，回车默认2010-01-01): ").strip() or "2010-01-01"
+    index_name = input("基准指数 (回车默认沪深300): ").strip() or "沪深300"
+
+    panel = load_panel(query, symbols, start_date)
+    if not panel:
+        print("❌ 没有找到数据")
+        return
+
+    benchmark = load_benchmark(query, index_name, panel["close"].index)
+
+    result = run_backtest(panel, ma_cross(panel, 5, 20), benchmark=benchmark)
+    print("\n📊 均线策略 (5/20) 绩效:")
+    for key, value in result["stats"].items():
+        print(f"  {key}: {value:.4f}")
+
+    sweep = parameter_sweep(panel, ma_cross, {"fast": [5, 10, 20], "slow": [30, 60, 120]},
+                            benchmark=benchmark)
+    print("\n📈 参数扫描结果:")
+    print(sweep.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
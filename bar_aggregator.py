@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多周期K线聚合工具
+将日线数据(kline_data / index_data)聚合为周线、月线、季线并物化存储，
+新数据入库时只重算受影响的周期
+"""
+
+import os
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 周期起始日的SQL表达式（date列为 YYYY-MM-DD 文本）
+TIMEFRAMES = {
+    "weekly": "date(date, 'weekday 0', '-6 days')",
+    "monthly": "strftime('%Y-%m-01', date)",
+    "quarterly": ("strftime('%Y', date) || '-' || "
+                  "printf('%02d', ((CAST(strftime('%m', date) AS INTEGER) - 1) / 3) * 3 + 1) || '-01'"),
+}
+
+# 日线数据源 -> 聚合表
+BAR_SOURCES = {
+    "kline": {"table": "kline_data", "key": "symbol", "bar_table": "kline_bars"},
+    "index": {"table": "index_data", "key": "index_name", "bar_table": "index_bars"},
+}
+
+
+def period_start(date_str: str, timeframe: str) -> str:
+    """计算日期所在周期的起始日（与TIMEFRAMES中的SQL表达式一致）"""
+    d = datetime.strptime(date_str[:10], "%Y-%m-%d")
+
+    if timeframe == "weekly":
+        d = d - timedelta(days=d.weekday())
+    elif timeframe == "monthly":
+        d = d.replace(day=1)
+    elif timeframe == "quarterly":
+        d = d.replace(month=(d.month - 1) // 3 * 3 + 1, day=1)
+    else:
+        raise ValueError(f"不支持的周期: {timeframe}")
+
+    return d.strftime("%Y-%m-%d")
+
+
+def init_bar_tables(conn: sqlite3.Connection, source: str = "kline"):
+    """创建多周期聚合表"""
+    spec = BAR_SOURCES[source]
+
+    # date 为该周期最后一个交易日，便于与日线数据共用查询和绘图逻辑
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {spec['bar_table']} (
+            {spec['key']} TEXT,
+            timeframe TEXT,
+            period TEXT,
+            date TEXT,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume INTEGER,
+            amount REAL,
+            bar_count INTEGER,
+            PRIMARY KEY ({spec['key']}, timeframe, period)
+        )
+    """)
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{spec['bar_table']}_date
+        ON {spec['bar_table']}({spec['key']}, timeframe, date)
+    """)
+
+
+def update_bars(conn: sqlite3.Connection, source: str = "kline", key_value: str = None,
+                since_date: str = None, timeframes: Optional[List[str]] = None) -> int:
+    """重算受影响周期的聚合K线
+
+    Args:
+        conn: 数据库连接（调用方负责提交）
+        source: "kline" 或 "index"
+        key_value: 股票代码/指数名称，None 表示全部
+        since_date: 新数据的最早日期，None 表示全部历史
+        timeframes: 需要更新的周期，默认全部
+    Returns:
+        写入的聚合K线条数
+    """
+    spec = BAR_SOURCES[source]
+    key = spec["key"]
+    written = 0
+
+    for timeframe in timeframes or list(TIMEFRAMES):
+        expr = TIMEFRAMES[timeframe]
+
+        where = "1 = 1"
+        delete_where = "1 = 1"
+        params = []
+        if key_value is not None:
+            where += f" AND {key} = ?"
+            delete_where += f" AND {key} = ?"
+            params.append(key_value)
+        if since_date:
+            where += " AND date >= ?"
+            delete_where += " AND period >= ?"
+            params.append(period_start(since_date, timeframe))
+
+        # 先删除受影响周期，再从日线重新聚合
+        conn.execute(
+            f"DELETE FROM {spec['bar_table']} WHERE timeframe = ? AND {delete_where}",
+            [timeframe] + params
+        )
+
+        cursor = conn.execute(f"""
+            INSERT OR REPLACE INTO {spec['bar_table']}
+            ({key}, timeframe, period, date, open, high, low, close, volume, amount, bar_count)
+            SELECT {key}, ?, period, MAX(date), MAX(first_open), MAX(high), MIN(low),
+                   MAX(last_close), SUM(volume), SUM(amount), COUNT(*)
+            FROM (
+                SELECT {key}, date, high, low, volume, amount, {expr} AS period,
+                       FIRST_VALUE(open) OVER w AS first_open,
+                       LAST_VALUE(close) OVER w AS last_close
+                FROM {spec['table']}
+                WHERE {where}
+                WINDOW w AS (
+                    PARTITION BY {key}, {expr} ORDER BY date
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                )
+            )
+            GROUP BY {key}, period
+        """, [timeframe] + params)
+        written += max(cursor.rowcount, 0)
+
+    return written
+
+
+def rebuild_all_bars(db_path: str, source: str = "kline") -> int:
+    """全量重建某个数据库的多周期聚合表（用于已有数据库的首次回填）"""
+    conn = sqlite3.connect(db_path)
+    try:
+        init_bar_tables(conn, source)
+        written = update_bars(conn, source)
+        conn.commit()
+    finally:
+        conn.close()
+
+    logger.info(f"{db_path}: 已重建 {written} 条多周期K线")
+    return written
+
+
+def main():
+    """主函数 - 为已有数据库回填周线/月线/季线"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    print("🚀 多周期K线聚合工具")
+    print("=" * 50)
+
+    targets = [
+        ("output/kline_data/a_share_klines.db", "kline"),
+        ("output/index_data/major_indices.db", "index"),
+    ]
+
+    for db_path, source in targets:
+        if not os.path.exists(db_path):
+            print(f"⚠️ 数据库不存在，跳过: {db_path}")
+            continue
+
+        print(f"🔄 正在聚合: {db_path}")
+        written = rebuild_all_bars(db_path, source)
+        print(f"✅ 完成: {written:,} 条周/月/季K线")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图表载荷基准测试
+比较 /api/chart 的 JSON 模式（tolist + fig.to_json）与二进制模式（类型化数组）
+在 5 只股票 + 1 个指数、35 年日线（不降采样）下的服务端CPU耗时和传输字节数。
+使用随机游走生成的模拟数据，不依赖本地数据库。
+"""
+
+import gzip
+import time
+
+import numpy as np
+import pandas as pd
+from flask import jsonify
+
+from lazy_query import compact_frame
+from web_chart_app import app_instance
+
+# 模拟数据：5 只股票，1990-12-19 至 2025-12-31 的交易日
+STOCK_COUNT = 5
+START_DATE = "1990-12-19"
+END_DATE = "2025-12-31"
+
+# 每种模式重复次数（取平均）
+REPEAT = 3
+
+
+def make_bars(dates: pd.DatetimeIndex, seed: int, start_price: float) -> pd.DataFrame:
+    """随机游走生成OHLCV"""
+    rng = np.random.default_rng(seed)
+    close = start_price * np.exp(np.cumsum(rng.normal(0.0003, 0.02, len(dates))))
+    open_ = close * (1 + rng.normal(0, 0.005, len(dates)))
+    spread = np.abs(rng.normal(0, 0.01, len(dates)))
+    volume = rng.integers(1_000_000, 50_000_000, len(dates))
+    return pd.DataFrame({
+        "date": dates,
+        "open": open_.round(2),
+        "high": (np.maximum(open_, close) * (1 + spread)).round(2),
+        "low": (np.minimum(open_, close) * (1 - spread)).round(2),
+        "close": close.round(2),
+        "volume": volume,
+        "amount": (volume * close).round(0),
+        "nav": close / close[0],
+    })
+
+
+def make_datasets():
+    """生成与 WebChartApp 缓存中相同结构的股票/指数数据"""
+    dates = pd.bdate_range(START_DATE, END_DATE)
+    stocks = []
+    for i in range(STOCK_COUNT):
+        df = make_bars(dates, seed=i, start_price=10 + i * 5)
+        df.insert(1, "symbol", f"sh60000{i}")
+        df.insert(2, "name", f"模拟股票{i}")
+        stocks.append(compact_frame(df))
+
+    index_df = make_bars(dates, seed=99, start_price=1000)
+    index_df.insert(1, "index_name", "模拟指数")
+    return stocks, index_df.drop(columns="amount")
+
+
+def measure(stocks, index_df, binary: bool, normalize: bool):
+    """返回 (平均CPU毫秒, 响应字节数, gzip后字节数)"""
+    with app_instance.app.app_context():
+        start = time.process_time()
+        for _ in range(REPEAT):
+            chart = app_instance.create_chart_json(stocks, index_df, normalize, binary=binary)
+            body = jsonify({"success": True, "chart": chart}).get_data()
+        cpu_ms = (time.process_time() - start) / REPEAT * 1000
+
+    return cpu_ms, len(body), len(gzip.compress(body))
+
+
+def main():
+    """主函数 - 运行基准测试并打印对比表"""
+    print("🚀 图表载荷基准测试")
+    print("=" * 50)
+
+    stocks, index_df = make_datasets()
+    print(f"📊 {STOCK_COUNT} 只股票 + 1 个指数，每条 {len(index_df):,} 根日线")
+
+    for normalize in (False, True):
+        print(f"\n{'标准化对比' if normalize else '价格走势'}:")
+        print(f"{'模式':<8}{'CPU(ms)':>10}{'字节':>14}{'gzip字节':>14}")
+
+        results = {}
+        for binary in (False, True):
+            results[binary] = measure(stocks, index_df, binary, normalize)
+            cpu_ms, size, gz_size = results[binary]
+            print(f"{'二进制' if binary else 'JSON':<8}{cpu_ms:>10.0f}{size:>14,}{gz_size:>14,}")
+
+        json_result, binary_result = results[False], results[True]
+        print(f"二进制/JSON: CPU {binary_result[0] / json_result[0]:.0%}，"
+              f"字节 {binary_result[1] / json_result[1]:.0%}，gzip {binary_result[2] / json_result[2]:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图表降采样
+Largest-Triangle-Three-Buckets (LTTB) 算法：把序列分成等宽的桶，每个桶保留与
+上一个保留点、下一个桶均值构成三角形面积最大的点，保留首尾点。
+相比等间隔抽样，LTTB 能保留尖峰和拐点，折线形状几乎不变。
+"""
+
+import numpy as np
+
+
+def lttb_indices(x, y, threshold: int) -> np.ndarray:
+    """LTTB 降采样，返回保留点的位置（升序）
+
+    Args:
+        x: 横坐标（单调递增，日期需先转为数值）
+        y: 纵坐标，NaN 按前一个有效值参与计算
+        threshold: 目标点数，不小于序列长度或小于3时不降采样
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # NaN 只影响选点，用前一个有效值代替（开头的 NaN 视为0）
+    missing = np.isnan(y)
+    if missing.any():
+        last_valid = np.maximum.accumulate(np.where(missing, 0, np.arange(n)))
+        y = np.nan_to_num(y[last_valid])
+
+    # 首尾点固定保留，中间 n-2 个点分成 threshold-2 个桶
+    edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    # 各桶均值一次算出；第 i 个桶的"下一个桶"为第 i+1 个桶，最后一个桶之后为末尾点
+    counts = np.append(np.diff(edges), 1)
+    avg_x = np.add.reduceat(x, edges) / counts
+    avg_y = np.add.reduceat(y, edges) / counts
+
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        xs, ys = x[start:end], y[start:end]
+        area = np.abs((x[a] - avg_x[i + 1]) * (ys - y[a]) - (x[a] - xs) * (avg_y[i + 1] - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
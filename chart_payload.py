@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图表二进制载荷
+把图表中的 numpy 数组编码为 Plotly.js（2.28+）可直接解码的类型化数组:
+    {"dtype": "f4", "bdata": "<base64>", "shape": "n, m"}
+数值不再逐个转成Python对象和十进制文本，体积和序列化耗时都明显下降。
+日期轴的横坐标以毫秒时间戳（f8）传输。
+"""
+
+import base64
+
+import numpy as np
+
+# numpy 类型 -> Plotly.js 类型化数组的 dtype（Plotly.js 不支持 64 位整数）
+TYPED_ARRAY_DTYPES = {
+    np.dtype("float64"): "f8",
+    np.dtype("float32"): "f4",
+    np.dtype("int32"): "i4",
+    np.dtype("uint32"): "u4",
+    np.dtype("int16"): "i2",
+    np.dtype("uint16"): "u2",
+    np.dtype("int8"): "i1",
+    np.dtype("uint8"): "u1",
+}
+
+
+def datetime_to_ms(values) -> np.ndarray:
+    """datetime64 数组转为毫秒时间戳（float64，日期轴可直接使用）"""
+    return np.asarray(values).astype("datetime64[ms]").astype(np.int64).astype(np.float64)
+
+
+def typed_array(values: np.ndarray) -> dict:
+    """把数值数组编码为 Plotly.js 类型化数组，64位整数转为 float64"""
+    values = np.asarray(values)
+    if values.dtype not in TYPED_ARRAY_DTYPES:
+        values = values.astype(np.float64)
+
+    spec = {
+        "dtype": TYPED_ARRAY_DTYPES[values.dtype],
+        "bdata": base64.b64encode(np.ascontiguousarray(values).tobytes()).decode("ascii"),
+    }
+    if values.ndim > 1:
+        spec["shape"] = ", ".join(str(n) for n in values.shape)
+    return spec
+
+
+def encode_typed_arrays(obj):
+    """递归地把图表字典中的数值 numpy 数组替换为类型化数组（其他对象原样返回）"""
+    if isinstance(obj, dict):
+        return {key: encode_typed_arrays(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [encode_typed_arrays(value) for value in obj]
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in "fiu":
+        return typed_array(obj)
+    return obj
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+相关性与Beta计算引擎
+在按日期对齐的收益率面板上分块计算：
+- 全市场股票两两相关系数矩阵（按缺失值成对剔除）
+- 每只股票相对指数的滚动Beta和滚动相关系数
+只保留 block_size 大小的中间结果，结果矩阵写入磁盘上的 .npy（memmap），
+按 窗口 + 日期 + 数据版本号 缓存
+"""
+
+import os
+import json
+import hashlib
+import sqlite3
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from query_cache import GLOBAL_VERSION_KEY
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "output/correlation_cache"
+
+DEFAULT_BLOCK_SIZE = 512
+
+# 单条SQL的参数个数上限
+MAX_SQL_PARAMS = 900
+
+
+def get_data_version(db_path: str) -> int:
+    """读取数据库的全局数据版本号（没有版本表时为0）"""
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute("SELECT version FROM data_version WHERE key = ?",
+                           (GLOBAL_VERSION_KEY,)).fetchone()
+        return row[0] if row else 0
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        conn.close()
+
+
+def trading_dates(conn: sqlite3.Connection, end_date: str = None, count: int = None,
+                  start_date: str = None) -> List[str]:
+    """读取 kline_data 中的交易日（升序）
+
+    指定 count 时返回截至 end_date 的最近 count 个交易日。
+    """
+    query = "SELECT DISTINCT date FROM kline_data WHERE 1 = 1"
+    params = []
+    if start_date:
+        query += " AND date >= ?"
+        params.append(start_date)
+    if end_date:
+        query += " AND date <= ?"
+        params.append(end_date)
+    query += " ORDER BY date DESC"
+    if count:
+        query += " LIMIT ?"
+        params.append(count)
+
+    return [r[0] for r in reversed(conn.execute(query, params).fetchall())]
+
+
+def load_close_panel(conn: sqlite3.Connection, dates: Sequence[str],
+                     symbols: Sequence[str] = None, dtype=np.float64) -> Tuple[List[str], np.ndarray]:
+    """读取收盘价面板 (len(dates) × len(symbols))，缺失为NaN
+
+    symbols 为 None 时读取区间内出现过的全部股票。
+    """
+    if not dates:
+        return [], np.empty((0, 0), dtype=dtype)
+
+    if symbols is None:
+        symbols = [r[0] for r in conn.execute(
+            "SELECT DISTINCT symbol FROM kline_data WHERE date >= ? AND date <= ? ORDER BY symbol",
+            (dates[0], dates[-1])
+        )]
+    symbols = list(symbols)
+
+    date_pos = {d: i for i, d in enumerate(dates)}
+    symbol_pos = {s: j for j, s in enumerate(symbols)}
+    panel = np.full((len(dates), len(symbols)), np.nan, dtype=dtype)
+
+    for i in range(0, len(symbols), MAX_SQL_PARAMS):
+        chunk = symbols[i:i + MAX_SQL_PARAMS]
+        rows = conn.execute(
+            f"SELECT symbol, date, close FROM kline_data "
+            f"WHERE date >= ? AND date <= ? AND symbol IN ({', '.join('?' for _ in chunk)})",
+            [dates[0], dates[-1]] + chunk
+        ).fetchall()
+        if not rows:
+            continue
+
+        sym, date, close = zip(*rows)
+        rows_idx = np.array([date_pos.get(d, -1) for d in date])
+        cols_idx = np.array([symbol_pos[s] for s in sym])
+        keep = rows_idx >= 0
+        panel[rows_idx[keep], cols_idx[keep]] = np.array(close, dtype=dtype)[keep]
+
+    return symbols, panel
+
+
+def load_index_close(index_db_path: str, index_name: str, dates: Sequence[str]) -> np.ndarray:
+    """读取与 dates 对齐的指数收盘价，缺失为NaN"""
+    conn = sqlite3.connect(index_db_path)
+    try:
+        rows = conn.execute(
+            "SELECT date, close FROM index_data WHERE index_name = ? AND date >= ? AND date <= ?",
+            (index_name, dates[0], dates[-1])
+        ).fetchall()
+    finally:
+        conn.close()
+
+    closes = dict(rows)
+    return np.array([closes.get(d, np.nan) for d in dates], dtype=np.float64)
+
+
+def to_returns(close: np.ndarray) -> np.ndarray:
+    """收盘价 -> 简单收益率（首行丢弃；任一端缺失则为NaN）"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return close[1:] / close[:-1] - 1
+
+
+def blocked_correlation(returns: np.ndarray, out: np.ndarray = None,
+                        block_size: int = DEFAULT_BLOCK_SIZE, min_periods: int = 20,
+                        dtype=np.float64) -> np.ndarray:
+    """分块计算成对剔除缺失值的相关系数矩阵
+
+    对每一对列块用掩码矩阵乘法求出 共同样本数/和/平方和/交叉积，
+    中间结果只有 block_size × block_size 大小；矩阵对称，只计算上三角块。
+
+    Args:
+        returns: T × N 收益率，缺失为NaN
+        out: N × N 输出数组（可为 np.memmap），默认新建 float32 数组
+        block_size: 列块大小
+        min_periods: 共同样本数少于该值时结果为NaN
+        dtype: 块内计算精度（np.float32 可减半内存和计算量）
+    """
+    n_cols = returns.shape[1]
+    if out is None:
+        out = np.empty((n_cols, n_cols), dtype=np.float32)
+
+    blocks = []
+    for start in range(0, n_cols, block_size):
+        block = returns[:, start:start + block_size]
+        valid = (~np.isnan(block)).astype(dtype)
+        values = np.where(valid > 0, block, 0).astype(dtype)
+        blocks.append((start, valid, values, values * values))
+
+    for bi, (si, vi, xi, xxi) in enumerate(blocks):
+        for sj, vj, xj, xxj in blocks[bi:]:
+            n = vi.T @ vj
+            sx = xi.T @ vj
+            sy = vi.T @ xj
+            with np.errstate(divide="ignore", invalid="ignore"):
+                cov = xi.T @ xj - sx * sy / n
+                var_x = xxi.T @ vj - sx * sx / n
+                var_y = vi.T @ xxj - sy * sy / n
+                corr = cov / np.sqrt(var_x * var_y)
+            corr[(n < min_periods) | ~np.isfinite(corr)] = np.nan
+            np.clip(corr, -1, 1, out=corr)
+
+            out[si:si + corr.shape[0], sj:sj + corr.shape[1]] = corr
+            if sj != si:
+                out[sj:sj + corr.shape[1], si:si + corr.shape[0]] = corr.T
+
+    return out
+
+
+def rolling_beta_corr(returns: np.ndarray, market: np.ndarray, window: int,
+                      min_periods: int = None, block_size: int = DEFAULT_BLOCK_SIZE,
+                      beta_out: np.ndarray = None, corr_out: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """滚动Beta与相关系数（累积和差分，按列分块）
+
+    Args:
+        returns: T × N 股票收益率
+        market: 长度T的指数收益率
+        window: 滚动窗口（交易日）
+        min_periods: 窗口内共同样本数下限，默认 window // 2
+    Returns:
+        (beta, corr)，均为 T × N float32
+    """
+    min_periods = min_periods or window // 2
+    n_rows, n_cols = returns.shape
+    beta_out = np.empty((n_rows, n_cols), dtype=np.float32) if beta_out is None else beta_out
+    corr_out = np.empty((n_rows, n_cols), dtype=np.float32) if corr_out is None else corr_out
+
+    market = market.astype(np.float64)[:, None]
+
+    def window_sum(x):
+        # 前缀和相减得到每个截止日的窗口和
+        csum = np.cumsum(x, axis=0)
+        csum[window:] = csum[window:] - csum[:-window]
+        return csum
+
+    for start in range(0, n_cols, block_size):
+        r = returns[:, start:start + block_size].astype(np.float64)
+        valid = ~np.isnan(r) & ~np.isnan(market)
+        r = np.where(valid, r, 0.0)
+        m = np.where(valid, market, 0.0)
+
+        n = window_sum(valid.astype(np.float64))
+        sm = window_sum(m)
+        sr = window_sum(r)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = window_sum(r * m) - sr * sm / n
+            var_m = window_sum(m * m) - sm * sm / n
+            var_r = window_sum(r * r) - sr * sr / n
+            beta = cov / var_m
+            corr = cov / np.sqrt(var_m * var_r)
+
+        too_few = n < min_periods
+        beta[too_few] = np.nan
+        corr[too_few | ~np.isfinite(corr)] = np.nan
+
+        beta_out[:, start:start + r.shape[1]] = beta
+        corr_out[:, start:start + r.shape[1]] = np.clip(corr, -1, 1)
+
+    return beta_out, corr_out
+
+
+class ArrayCache:
+    """磁盘数组缓存：每个结果一个 .json 元数据 + 若干 .npy 数组，读取时使用memmap"""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _base(self, kind: str, parts: Sequence) -> str:
+        name = "_".join([kind] + [str(p).replace(os.sep, "-") for p in parts])
+        return os.path.join(self.cache_dir, name)
+
+    def load(self, kind: str, parts: Sequence, version) -> Optional[Tuple[dict, Dict[str, np.ndarray]]]:
+        """读取缓存；不存在或版本号不一致时返回None"""
+        base = self._base(kind, parts)
+        try:
+            with open(base + ".json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != version:
+                return None
+            arrays = {name: np.load(f"{base}.{name}.npy", mmap_mode="r") for name in meta["arrays"]}
+            return meta, arrays
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def create(self, kind: str, parts: Sequence, name: str, shape: tuple,
+               dtype=np.float32) -> np.ndarray:
+        """在缓存目录中创建可直接写入的 .npy memmap（临时文件，commit后生效）"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return np.lib.format.open_memmap(f"{self._base(kind, parts)}.{name}.npy.tmp",
+                                         mode="w+", dtype=dtype, shape=shape)
+
+    def commit(self, kind: str, parts: Sequence, version, meta: dict,
+               arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """落盘 create() 创建的数组并写入元数据，返回只读memmap"""
+        base = self._base(kind, parts)
+        for name, array in arrays.items():
+            array.flush()
+            os.replace(f"{base}.{name}.npy.tmp", f"{base}.{name}.npy")
+
+        meta = dict(meta, version=version, arrays=list(arrays))
+        with open(base + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(base + ".json.tmp", base + ".json")
+
+        return {name: np.load(f"{base}.{name}.npy", mmap_mode="r") for name in arrays}
+
+
+def correlation_matrix(db_path: str, end_date: str = None, window: int = 250,
+                       symbols: Sequence[str] = None, min_periods: int = None,
+                       block_size: int = DEFAULT_BLOCK_SIZE, dtype=np.float64,
+                       cache_dir: str = DEFAULT_CACHE_DIR) -> Tuple[List[str], np.ndarray]:
+    """截至 end_date 的 window 日收益率相关系数矩阵
+
+    Returns:
+        (股票代码列表, N × N float32 只读memmap)
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        dates = trading_dates(conn, end_date, window + 1)
+        if len(dates) < 2:
+            return [], np.empty((0, 0), dtype=np.float32)
+
+        min_periods = min_periods or window // 2
+        cache = ArrayCache(cache_dir)
+        version = get_data_version(db_path)
+        parts = [window, dates[-1], min_periods, _symbols_digest(symbols)]
+
+        cached = cache.load("corr", parts, version)
+        if cached:
+            meta, arrays = cached
+            return meta["symbols"], arrays["corr"]
+
+        symbols, close = load_close_panel(conn, dates, symbols, dtype)
+    finally:
+        conn.close()
+
+    returns = to_returns(close)
+    out = cache.create("corr", parts, "corr", (len(symbols), len(symbols)))
+    blocked_correlation(returns, out, block_size, min_periods, dtype)
+
+    arrays = cache.commit("corr", parts, version, {"symbols": symbols, "end_date": dates[-1]}, {"corr": out})
+    logger.info(f"相关系数矩阵: {len(symbols)} 只股票, 窗口 {window}, 截至 {dates[-1]}")
+    return symbols, arrays["corr"]
+
+
+def rolling_beta(db_path: str, index_db_path: str, index_name: str = "沪深300",
+                 window: int = 250, start_date: str = None, end_date: str = None,
+                 symbols: Sequence[str] = None, min_periods: int = None,
+                 block_size: int = DEFAULT_BLOCK_SIZE,
+                 cache_dir: str = DEFAULT_CACHE_DIR) -> dict:
+    """全部（或指定）股票相对指数的滚动Beta和相关系数
+
+    收益率面板按 MAX_SQL_PARAMS 只股票分批读取和计算，内存占用与股票数无关。
+
+    Returns:
+        {'dates': [...], 'symbols': [...], 'beta': T × N, 'corr': T × N}（float32 只读memmap）
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        out_dates = trading_dates(conn, end_date, start_date=start_date)
+        if not out_dates:
+            return {"dates": [], "symbols": [], "beta": np.empty((0, 0)), "corr": np.empty((0, 0))}
+
+        # 向前多取 window 个交易日作为第一个窗口的样本
+        dates = trading_dates(conn, out_dates[0], window + 1)[:-1] + out_dates
+
+        min_periods = min_periods or window // 2
+        cache = ArrayCache(cache_dir)
+        version = [get_data_version(db_path), get_data_version(index_db_path)]
+        parts = [index_name, window, out_dates[0], out_dates[-1], min_periods, _symbols_digest(symbols)]
+
+        cached = cache.load("beta", parts, version)
+        if cached:
+            meta, arrays = cached
+            return {"dates": meta["dates"], "symbols": meta["symbols"], **arrays}
+
+        if symbols is None:
+            symbols = [r[0] for r in conn.execute(
+                "SELECT DISTINCT symbol FROM kline_data WHERE date >= ? AND date <= ? ORDER BY symbol",
+                (out_dates[0], out_dates[-1])
+            )]
+        symbols = list(symbols)
+
+        market = to_returns(load_index_close(index_db_path, index_name, dates))
+        offset = len(dates) - 1 - len(out_dates)
+
+        beta = cache.create("beta", parts, "beta", (len(out_dates), len(symbols)))
+        corr = cache.create("beta", parts, "corr", (len(out_dates), len(symbols)))
+        for i in range(0, len(symbols), MAX_SQL_PARAMS):
+            chunk = symbols[i:i + MAX_SQL_PARAMS]
+            _, close = load_close_panel(conn, dates, chunk)
+            chunk_beta, chunk_corr = rolling_beta_corr(to_returns(close), market, window,
+                                                       min_periods, block_size)
+            beta[:, i:i + len(chunk)] = chunk_beta[offset:]
+            corr[:, i:i + len(chunk)] = chunk_corr[offset:]
+    finally:
+        conn.close()
+
+    arrays = cache.commit("beta", parts, version,
+                          {"dates": out_dates, "symbols": symbols, "index_name": index_name},
+                          {"beta": beta, "corr": corr})
+    logger.info(f"滚动Beta: {len(symbols)} 只股票 × {len(out_dates)} 个交易日, 相对 {index_name}")
+    return {"dates": out_dates, "symbols": symbols, **arrays}
+
+
+def _symbols_digest(symbols: Optional[Sequence[str]]) -> str:
+    """股票列表在缓存文件名中的标识（全市场为 all）"""
+    if symbols is None:
+        return "all"
+    return hashlib.md5(",".join(symbols).encode("utf-8")).hexdigest()[:12]
+
+
+def main():
+    """主函数 - 计算全市场相关系数矩阵和相对沪深300的Beta"""
+    import time
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    db_path = "output/kline_data/a_share_klines.db"
+    index_db_path = "output/index_data/major_indices.db"
+
+    print("🚀 相关性与Beta计算")
+    print("=" * 50)
+
+    start_time = time.time()
+    symbols, corr = correlation_matrix(db_path, window=250)
+    print(f"✅ 相关系数矩阵: {len(symbols)} × {len(symbols)}，耗时 {time.time() - start_time:.1f} 秒")
+
+    start_time = time.time()
+    result = rolling_beta(db_path, index_db_path, "沪深300", window=250,
+                          start_date=(np.datetime64('today') - np.timedelta64(365, 'D')).astype(str))
+    print(f"✅ 滚动Beta: {len(result['symbols'])} 只股票 × {len(result['dates'])} 日，"
+          f"耗时 {time.time() - start_time:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据导出工具
+以流式分块方式将SQLite查询结果写入CSV/Parquet/Feather，内存占用与数据总量无关；
+按股票/指数分文件导出时使用进程池并行写出；支持将列式文件重新导入数据库
+"""
+
+import io
+import os
+import csv
+import gzip
+import sys
+import time
+import sqlite3
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from urllib.request import pathname2url
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+from bar_aggregator import BAR_SOURCES, init_bar_tables, update_bars
+from indicator_engine import init_indicator_tables, update_indicators
+from returns_engine import init_returns_table, update_returns
+from query_cache import bump_data_version
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# 默认每批读取的行数（K线一行约200字节，5万行约10MB）
+DEFAULT_CHUNK_ROWS = 50000
+
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# 列式格式: 文件后缀
+COLUMNAR_FORMATS = {"parquet": ".parquet", "feather": ".feather"}
+
+# 列类型（未列出的列按字符串处理）
+COLUMN_TYPES = {
+    "id": "int64",
+    "date": "date32",
+    "open": "float64",
+    "high": "float64",
+    "low": "float64",
+    "close": "float64",
+    "volume": "int64",
+    "amount": "float64",
+}
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    """获取当前进程的峰值内存占用(MB)"""
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 单位为字节，Linux 单位为KB
+    if sys.platform == "darwin":
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def open_text_output(path: str, compression: str = None):
+    """按压缩方式打开文本输出流（UTF-8-BOM，兼容Excel）"""
+    if compression is None:
+        return open(path, "w", encoding="utf-8-sig", newline="")
+
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8-sig", newline="")
+
+    if compression == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise ImportError("zstd压缩需要安装 zstandard: pip install zstandard")
+        raw = open(path, "wb")
+        stream = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+    raise ValueError(f"不支持的压缩方式: {compression}")
+
+
+def _write_cursor_csv(cursor: sqlite3.Cursor, output_path: str, chunk_rows: int,
+                      compression: str = None, on_chunk=None) -> int:
+    """将游标结果分批写入CSV，返回写出的行数"""
+    columns = [desc[0] for desc in cursor.description]
+    total_rows = 0
+
+    with open_text_output(output_path, compression) as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+
+            writer.writerows(rows)
+            total_rows += len(rows)
+
+            if on_chunk is not None:
+                on_chunk(total_rows)
+
+    return total_rows
+
+
+def stream_query_to_csv(conn: sqlite3.Connection, query: str, output_path: str,
+                        params: Sequence = (), chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                        compression: str = None, progress_every: int = 1000000) -> Dict:
+    """流式执行查询并写入CSV
+
+    逐批 fetchmany(chunk_rows) 后立即写出，内存上限由 chunk_rows 决定。
+
+    Args:
+        conn: 数据库连接
+        query: SELECT语句
+        output_path: 输出文件路径（压缩时自动追加 .gz/.zst 后缀）
+        params: 查询参数
+        chunk_rows: 每批读取行数，即内存上限
+        compression: None / "gzip" / "zstd"
+        progress_every: 每写出多少行打印一次进度
+    Returns:
+        导出统计: path, rows, seconds, rows_per_sec, peak_rss_mb
+    """
+    suffix = COMPRESSION_SUFFIXES.get(compression, "")
+    if suffix and not output_path.endswith(suffix):
+        output_path += suffix
+
+    start_time = time.time()
+    next_report = [progress_every]
+
+    def report(total_rows):
+        if progress_every and total_rows >= next_report[0]:
+            elapsed = time.time() - start_time
+            logger.info(f"  已导出 {total_rows:,} 行 ({total_rows / max(elapsed, 1e-9):,.0f} 行/秒)")
+            next_report[0] += progress_every
+
+    cursor = conn.execute(query, params)
+    total_rows = _write_cursor_csv(cursor, output_path, chunk_rows, compression, report)
+    cursor.close()
+
+    seconds = time.time() - start_time
+    stats = {
+        "path": output_path,
+        "rows": total_rows,
+        "seconds": seconds,
+        "rows_per_sec": total_rows / seconds if seconds > 0 else float(total_rows),
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+    peak = f"{stats['peak_rss_mb']:.1f} MB" if stats["peak_rss_mb"] is not None else "N/A"
+    logger.info(
+        f"导出完成: {output_path} - {total_rows:,} 行, 用时 {seconds:.1f} 秒, "
+        f"{stats['rows_per_sec']:,.0f} 行/秒, 峰值内存 {peak}"
+    )
+
+    return stats
+
+
+# 进程池工作进程持有的只读连接
+_worker_conn = None
+
+
+def _init_export_worker(db_path: str):
+    """工作进程初始化：打开只读数据库连接"""
+    global _worker_conn
+    uri = f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro"
+    _worker_conn = sqlite3.connect(uri, uri=True)
+
+
+def _export_group(task: tuple) -> tuple:
+    """导出单个股票/指数到独立文件（在工作进程中执行）"""
+    table, key_column, key_value, output_path, compression, chunk_rows = task
+
+    cursor = _worker_conn.execute(
+        f"SELECT * FROM {table} WHERE {key_column} = ? ORDER BY date", (key_value,)
+    )
+    rows = _write_cursor_csv(cursor, output_path, chunk_rows, compression)
+    cursor.close()
+
+    return key_value, rows, output_path
+
+
+def export_groups_parallel(db_path: str, table: str, key_column: str, output_dir: str,
+                           workers: int = None, compression: str = None,
+                           chunk_rows: int = DEFAULT_CHUNK_ROWS, progress_every: int = 100) -> Dict:
+    """按分组键（股票代码/指数名称）并行导出为独立CSV文件
+
+    每个工作进程持有自己的只读连接，父进程汇总进度。任务按分组键排序，
+    结果按同样顺序返回，文件名与内容与串行导出一致。
+
+    Args:
+        db_path: 数据库路径
+        table: 数据表，如 "kline_data" / "index_data"
+        key_column: 分组列，如 "symbol" / "index_name"
+        output_dir: 输出目录
+        workers: 进程数，默认CPU核数；1 表示在当前进程串行执行
+        compression: None / "gzip" / "zstd"
+        chunk_rows: 每批读取行数
+        progress_every: 每完成多少个文件打印一次进度
+    Returns:
+        导出统计: files, rows, seconds, files_per_sec, results(按分组键排序)
+    """
+    global _worker_conn
+    os.makedirs(output_dir, exist_ok=True)
+    suffix = ".csv" + COMPRESSION_SUFFIXES.get(compression, "")
+
+    conn = sqlite3.connect(db_path)
+    keys = [row[0] for row in conn.execute(
+        f"SELECT DISTINCT {key_column} FROM {table} ORDER BY {key_column}"
+    )]
+    conn.close()
+
+    tasks = [
+        (table, key_column, key, os.path.join(output_dir, key.replace('.', '_') + suffix),
+         compression, chunk_rows)
+        for key in keys
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    start_time = time.time()
+    results: List[tuple] = []
+
+    logger.info(f"开始导出 {len(tasks)} 个文件 (进程数: {workers})...")
+
+    def collect(result_iter):
+        for result in result_iter:
+            results.append(result)
+            if progress_every and len(results) % progress_every == 0:
+                logger.info(f"导出进度: {len(results)}/{len(tasks)}")
+
+    if workers <= 1:
+        # 串行导出在当前进程打开连接，结束后关闭并清空，避免每次导出遗留一个连接
+        _init_export_worker(db_path)
+        try:
+            collect(map(_export_group, tasks))
+        finally:
+            _worker_conn.close()
+            _worker_conn = None
+    else:
+        chunksize = max(1, len(tasks) // (workers * 8))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_export_worker,
+                                 initargs=(db_path,)) as executor:
+            collect(executor.map(_export_group, tasks, chunksize=chunksize))
+
+    seconds = time.time() - start_time
+    total_rows = sum(rows for _, rows, _ in results)
+
+    logger.info(
+        f"导出完成: {len(results)} 个文件, {total_rows:,} 行, 用时 {seconds:.1f} 秒 "
+        f"({len(results) / max(seconds, 1e-9):.1f} 文件/秒)"
+    )
+
+    return {
+        "files": len(results),
+        "rows": total_rows,
+        "seconds": seconds,
+        "files_per_sec": len(results) / seconds if seconds > 0 else float(len(results)),
+        "results": results,
+    }
+
+
+def _require_pyarrow():
+    if not PYARROW_AVAILABLE:
+        raise ImportError("Parquet/Feather导出需要安装 pyarrow: pip install pyarrow")
+
+
+def _arrow_schema(columns: List[str]):
+    """根据列名生成Arrow schema"""
+    types = {"int64": pa.int64(), "float64": pa.float64(), "date32": pa.date32()}
+    return pa.schema([(col, types.get(COLUMN_TYPES.get(col), pa.string())) for col in columns])
+
+
+def _rows_to_batch(rows: list, schema):
+    """将fetchmany结果按列转换为带类型的RecordBatch"""
+    arrays = []
+    for i, field in enumerate(schema):
+        values = [row[i] for row in rows]
+        if field.type == pa.date32():
+            # YYYY-MM-DD 文本 -> datetime64[D] -> date32
+            arrays.append(pa.array(np.array(values, dtype="datetime64[D]"), type=pa.date32()))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def stream_query_to_columnar(conn: sqlite3.Connection, query: str, output_path: str,
+                             params: Sequence = (), file_format: str = "parquet",
+                             compression: Optional[str] = "zstd",
+                             chunk_rows: int = DEFAULT_CHUNK_ROWS * 4) -> Dict:
+    """流式执行查询并写入Parquet或Feather(Arrow IPC)文件
+
+    Args:
+        file_format: "parquet" 或 "feather"
+        compression: parquet 支持 snappy/zstd/gzip/brotli/lz4/None；
+                     feather 支持 zstd/lz4/None
+        chunk_rows: 每批读取行数，对应Parquet的row group大小
+    Returns:
+        导出统计: path, rows, seconds, rows_per_sec, peak_rss_mb
+    """
+    _require_pyarrow()
+    if file_format not in COLUMNAR_FORMATS:
+        raise ValueError(f"不支持的文件格式: {file_format}")
+
+    suffix = COLUMNAR_FORMATS[file_format]
+    if not output_path.endswith(suffix):
+        output_path += suffix
+
+    start_time = time.time()
+    total_rows = 0
+
+    cursor = conn.execute(query, params)
+    schema = _arrow_schema([desc[0] for desc in cursor.description])
+
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(output_path, schema, compression=compression or "none")
+        write_batch = writer.write_batch
+    else:
+        sink = pa.OSFile(output_path, "wb")
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        writer = pa.ipc.new_file(sink, schema, options=options)
+        write_batch = writer.write_batch
+
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+
+            write_batch(_rows_to_batch(rows, schema))
+            total_rows += len(rows)
+    finally:
+        writer.close()
+        if file_format == "feather":
+            sink.close()
+        cursor.close()
+
+    seconds = time.time() - start_time
+    stats = {
+        "path": output_path,
+        "rows": total_rows,
+        "seconds": seconds,
+        "rows_per_sec": total_rows / seconds if seconds > 0 else float(total_rows),
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+    logger.info(
+        f"导出完成: {output_path} - {total_rows:,} 行, 用时 {seconds:.1f} 秒, "
+        f"{stats['rows_per_sec']:,.0f} 行/秒, 文件大小 {os.path.getsize(output_path) / 1024 / 1024:.1f} MB"
+    )
+
+    return stats
+
+
+def _iter_columnar_batches(path: str, columns: Optional[List[str]] = None,
+                           batch_rows: int = DEFAULT_CHUNK_ROWS):
+    """逐批读取Parquet/Feather文件"""
+    _require_pyarrow()
+
+    if path.endswith(COLUMNAR_FORMATS["parquet"]):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_rows, columns=columns)
+    else:
+        with pa.memory_map(path, "r") as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                yield batch.select(columns) if columns else batch
+
+
+def read_columnar(path: str, columns: Optional[List[str]] = None, symbols: Optional[List[str]] = None,
+                  start_date: str = None, end_date: str = None) -> pd.DataFrame:
+    """读取导出的Parquet/Feather文件为DataFrame（供研究笔记本直接加载整个面板）
+
+    symbol / index_name 转为 category，date 转为 datetime64。
+    """
+    _require_pyarrow()
+
+    if path.endswith(COLUMNAR_FORMATS["parquet"]):
+        filters = []
+        if symbols:
+            filters.append(("symbol", "in", list(symbols)))
+        if start_date:
+            filters.append(("date", ">=", pd.Timestamp(start_date).date()))
+        if end_date:
+            filters.append(("date", "<=", pd.Timestamp(end_date).date()))
+        table = pq.read_table(path, columns=columns, filters=filters or None)
+        df = table.to_pandas()
+    else:
+        df = pd.read_feather(path, columns=columns)
+        if symbols:
+            df = df[df["symbol"].isin(symbols)]
+        if start_date:
+            df = df[df["date"] >= pd.Timestamp(start_date).date()]
+        if end_date:
+            df = df[df["date"] <= pd.Timestamp(end_date).date()]
+
+    if "date" in df.columns:
+        df["date"] = pd.to_datetime(df["date"])
+    for col in ("symbol", "index_name", "market"):
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+
+    return df.reset_index(drop=True)
+
+
+def import_columnar_to_db(path: str, db_path: str, table: str = "kline_data",
+                          batch_rows: int = DEFAULT_CHUNK_ROWS) -> int:
+    """将Parquet/Feather文件重新导入数据库（INSERT OR REPLACE），并更新多周期K线
+
+    目标表需已存在（先运行一次对应的数据获取脚本初始化数据库）。
+    """
+    _require_pyarrow()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        table_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        if not table_columns:
+            raise ValueError(f"数据表不存在: {table}，请先初始化数据库")
+
+        source = next((name for name, spec in BAR_SOURCES.items() if spec["table"] == table), None)
+        key_column = BAR_SOURCES[source]["key"] if source is not None else None
+        total_rows = 0
+        min_date = None
+        imported_keys = set()
+
+        for batch in _iter_columnar_batches(path, batch_rows=batch_rows):
+            columns = [c for c in batch.schema.names if c in table_columns and c != "id"]
+            data = batch.select(columns).to_pydict()
+
+            if "date" in data:
+                data["date"] = [d.strftime("%Y-%m-%d") if d is not None else None for d in data["date"]]
+                batch_min = min((d for d in data["date"] if d), default=None)
+                if batch_min and (min_date is None or batch_min < min_date):
+                    min_date = batch_min
+
+            if key_column in data:
+                imported_keys.update(data[key_column])
+
+            placeholders = ", ".join("?" for _ in columns)
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})",
+                zip(*(data[c] for c in columns))
+            )
+            total_rows += batch.num_rows
+
+        if source is not None and total_rows:
+            init_bar_tables(conn, source)
+            update_bars(conn, source, since_date=min_date)
+            init_indicator_tables(conn, source)
+            init_returns_table(conn, source)
+            for key_value in imported_keys:
+                update_indicators(conn, source, key_value, min_date)
+                update_returns(conn, source, key_value, min_date)
+            bump_data_version(conn, imported_keys)
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    logger.info(f"导入完成: {path} -> {db_path}:{table}, {total_rows:,} 行")
+    return total_rows
+
+
+def main():
+    """主函数 - 交互式导出/导入"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    print("📤 数据导出/导入工具")
+    print("=" * 50)
+
+    kline_db = "output/kline_data/a_share_klines.db"
+    index_db = "output/index_data/major_indices.db"
+
+    print("1. 导出全部K线数据 (Parquet/Feather)")
+    print("2. 导出全部指数数据 (Parquet/Feather)")
+    print("3. 从Parquet/Feather文件导入K线数据")
+    print("4. 从Parquet/Feather文件导入指数数据")
+
+    choice = input("\n请选择 [1-4]: ").strip()
+
+    if choice in ("1", "2"):
+        file_format = input("文件格式 (parquet/feather, 默认parquet): ").strip().lower() or "parquet"
+        compression = input("压缩方式 (zstd/snappy/lz4/gzip/none, 默认zstd): ").strip().lower() or "zstd"
+        compression = None if compression == "none" else compression
+
+        if choice == "1":
+            db_path, query = kline_db, "SELECT * FROM kline_data ORDER BY symbol, date"
+            output_path = f"output/kline_data/all_a_share_klines_{time.strftime('%Y%m%d')}"
+        else:
+            db_path, query = index_db, "SELECT * FROM index_data ORDER BY index_name, date"
+            output_path = "output/index_data/all_indices_data"
+
+        conn = sqlite3.connect(db_path)
+        stats = stream_query_to_columnar(conn, query, output_path, file_format=file_format,
+                                         compression=compression)
+        conn.close()
+        print(f"✅ 已导出 {stats['rows']:,} 行到: {stats['path']}")
+
+    elif choice in ("3", "4"):
+        path = input("请输入文件路径: ").strip()
+        if choice == "3":
+            rows = import_columnar_to_db(path, kline_db, "kline_data")
+        else:
+            rows = import_columnar_to_db(path, index_db, "index_data")
+        print(f"✅ 已导入 {rows:,} 行")
+
+    else:
+        print("❌ 无效选择")
+
+
+if __name__ == "__main__":
+    main()
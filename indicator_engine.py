@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+技术指标计算引擎
+对 kline_data / index_data 的日线收盘价向量化计算 MA/EMA/MACD/RSI/布林带并存入数据库；
+每个股票/指数保存一行递推状态（EMA、MACD的DEA、RSI平均涨跌幅），
+追加新K线时只需按状态递推，无需重算全部历史
+"""
+
+import os
+import sqlite3
+import logging
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from bar_aggregator import BAR_SOURCES, TIMEFRAMES
+
+logger = logging.getLogger(__name__)
+
+# 指标参数
+MA_WINDOWS = (5, 10, 20, 60)
+EMA_SPANS = (12, 26)
+MACD_SIGNAL = 9
+RSI_PERIOD = 14
+BOLL_WINDOW = 20
+BOLL_WIDTH = 2
+
+# 指标表列
+INDICATOR_COLUMNS = (
+    [f"ma{w}" for w in MA_WINDOWS]
+    + [f"ema{s}" for s in EMA_SPANS]
+    + ["macd_dif", "macd_dea", "macd_hist", f"rsi{RSI_PERIOD}", "boll_mid", "boll_upper", "boll_lower"]
+)
+
+# 对外的指标名称 -> 指标列；overlay 为与价格同轴的叠加线，其余为副图指标
+INDICATORS = {
+    **{f"ma{w}": {"columns": [f"ma{w}"], "overlay": True} for w in MA_WINDOWS},
+    **{f"ema{s}": {"columns": [f"ema{s}"], "overlay": True} for s in EMA_SPANS},
+    "boll": {"columns": ["boll_mid", "boll_upper", "boll_lower"], "overlay": True},
+    "macd": {"columns": ["macd_dif", "macd_dea", "macd_hist"], "overlay": False},
+    f"rsi{RSI_PERIOD}": {"columns": [f"rsi{RSI_PERIOD}"], "overlay": False},
+}
+
+# 滚动窗口指标递推时需要的历史收盘价数量
+HISTORY_WINDOW = max(max(MA_WINDOWS), BOLL_WINDOW)
+
+# 数据源 -> 指标表/状态表
+INDICATOR_TABLES = {
+    "kline": {"table": "kline_indicators", "state_table": "kline_indicator_state"},
+    "index": {"table": "index_indicators", "state_table": "index_indicator_state"},
+}
+
+# 递推状态字段
+STATE_COLUMNS = ["last_date", "last_close", "bar_count"] + [f"ema{s}" for s in EMA_SPANS] + \
+    ["macd_dea", "rsi_avg_gain", "rsi_avg_loss"]
+
+
+def init_indicator_tables(conn: sqlite3.Connection, source: str = "kline"):
+    """创建指标表和递推状态表"""
+    key = BAR_SOURCES[source]["key"]
+    tables = INDICATOR_TABLES[source]
+
+    columns = ",\n            ".join(f"{name} REAL" for name in INDICATOR_COLUMNS)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {tables['table']} (
+            {key} TEXT,
+            date TEXT,
+            {columns},
+            PRIMARY KEY ({key}, date)
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {tables['state_table']} (
+            {key} TEXT PRIMARY KEY,
+            last_date TEXT,
+            last_close REAL,
+            bar_count INTEGER,
+            {", ".join(f"{name} REAL" for name in STATE_COLUMNS[3:])}
+        )
+    """)
+
+
+def _ema_alpha(span: int) -> float:
+    return 2.0 / (span + 1)
+
+
+def compute_indicators(close) -> tuple:
+    """全量向量化计算指标
+
+    EMA 以第一根K线收盘价为初值（与通达信等行情软件一致），
+    RSI 使用 Wilder 平滑（alpha=1/N），前 N 根K线不输出。
+    收盘价缺失（NULL）的K线沿用上一个收盘价，与 advance_indicators 的递推一致。
+
+    Args:
+        close: 按日期排序的收盘价序列
+    Returns:
+        (指标DataFrame, 最后一根K线的递推状态dict)
+    """
+    s = pd.Series(np.asarray(close, dtype=np.float64)).ffill()
+    result = {}
+
+    for window in MA_WINDOWS:
+        result[f"ma{window}"] = s.rolling(window).mean()
+
+    emas = {span: s.ewm(alpha=_ema_alpha(span), adjust=False).mean() for span in EMA_SPANS}
+    for span, ema in emas.items():
+        result[f"ema{span}"] = ema
+
+    dif = emas[EMA_SPANS[0]] - emas[EMA_SPANS[1]]
+    dea = dif.ewm(alpha=_ema_alpha(MACD_SIGNAL), adjust=False).mean()
+    result["macd_dif"] = dif
+    result["macd_dea"] = dea
+    result["macd_hist"] = 2 * (dif - dea)
+
+    change = s.diff().fillna(0.0)
+    avg_gain = change.clip(lower=0).ewm(alpha=1.0 / RSI_PERIOD, adjust=False).mean()
+    avg_loss = (-change.clip(upper=0)).ewm(alpha=1.0 / RSI_PERIOD, adjust=False).mean()
+    rsi = _rsi(avg_gain.to_numpy(), avg_loss.to_numpy())
+    rsi[:RSI_PERIOD] = np.nan
+    result[f"rsi{RSI_PERIOD}"] = rsi
+
+    mid = s.rolling(BOLL_WINDOW).mean()
+    width = s.rolling(BOLL_WINDOW).std() * BOLL_WIDTH
+    result["boll_mid"] = mid
+    result["boll_upper"] = mid + width
+    result["boll_lower"] = mid - width
+
+    frame = pd.DataFrame(result, columns=INDICATOR_COLUMNS)
+
+    state = None
+    if len(s):
+        state = {
+            "last_close": float(s.iloc[-1]),
+            "bar_count": len(s),
+            **{f"ema{span}": float(ema.iloc[-1]) for span, ema in emas.items()},
+            "macd_dea": float(dea.iloc[-1]),
+            "rsi_avg_gain": float(avg_gain.iloc[-1]),
+            "rsi_avg_loss": float(avg_loss.iloc[-1]),
+        }
+    return frame, state
+
+
+def _rsi(avg_gain: np.ndarray, avg_loss: np.ndarray) -> np.ndarray:
+    total = avg_gain + avg_loss
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(total > 0, 100.0 * avg_gain / total, 50.0)
+
+
+def advance_indicators(state: dict, history: np.ndarray, new_close: np.ndarray) -> tuple:
+    """根据递推状态计算新增K线的指标（每根K线O(1)）
+
+    Args:
+        state: 上一根K线的递推状态
+        history: 上一根K线及之前的最近 HISTORY_WINDOW 个收盘价（用于MA/布林带）
+        new_close: 新增K线收盘价，缺失值沿用上一个收盘价（否则NaN会写入递推状态）
+    Returns:
+        (新增K线的指标DataFrame, 更新后的状态)
+    """
+    n = len(new_close)
+    new_close = pd.Series(np.concatenate([[state["last_close"]], new_close])).ffill().to_numpy()[1:]
+    state = dict(state)
+    out = {name: np.empty(n) for name in INDICATOR_COLUMNS}
+    ema_alpha = {span: _ema_alpha(span) for span in EMA_SPANS}
+    signal_alpha = _ema_alpha(MACD_SIGNAL)
+    rsi_alpha = 1.0 / RSI_PERIOD
+
+    for i, price in enumerate(new_close):
+        for span in EMA_SPANS:
+            state[f"ema{span}"] += ema_alpha[span] * (price - state[f"ema{span}"])
+            out[f"ema{span}"][i] = state[f"ema{span}"]
+
+        dif = state[f"ema{EMA_SPANS[0]}"] - state[f"ema{EMA_SPANS[1]}"]
+        state["macd_dea"] += signal_alpha * (dif - state["macd_dea"])
+        out["macd_dif"][i] = dif
+        out["macd_dea"][i] = state["macd_dea"]
+        out["macd_hist"][i] = 2 * (dif - state["macd_dea"])
+
+        change = price - state["last_close"]
+        state["rsi_avg_gain"] += rsi_alpha * (max(change, 0.0) - state["rsi_avg_gain"])
+        state["rsi_avg_loss"] += rsi_alpha * (max(-change, 0.0) - state["rsi_avg_loss"])
+        out[f"rsi{RSI_PERIOD}"][i] = (
+            _rsi(np.array([state["rsi_avg_gain"]]), np.array([state["rsi_avg_loss"]]))[0]
+            if state["bar_count"] >= RSI_PERIOD else np.nan
+        )
+
+        state["last_close"] = float(price)
+        state["bar_count"] += 1
+
+    # 滚动窗口指标只依赖最近 HISTORY_WINDOW 个收盘价
+    window = pd.Series(np.concatenate([history[-HISTORY_WINDOW:], new_close])).ffill()
+    for w in MA_WINDOWS:
+        out[f"ma{w}"] = window.rolling(w).mean().to_numpy()[-n:]
+    mid = window.rolling(BOLL_WINDOW).mean().to_numpy()[-n:]
+    width = window.rolling(BOLL_WINDOW).std().to_numpy()[-n:] * BOLL_WIDTH
+    out["boll_mid"] = mid
+    out["boll_upper"] = mid + width
+    out["boll_lower"] = mid - width
+
+    return pd.DataFrame(out, columns=INDICATOR_COLUMNS), state
+
+
+def _write_indicators(conn: sqlite3.Connection, source: str, key_value: str,
+                      dates: List[str], frame: pd.DataFrame, state: dict):
+    key = BAR_SOURCES[source]["key"]
+    tables = INDICATOR_TABLES[source]
+
+    values = frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {tables['table']} ({key}, date, {', '.join(INDICATOR_COLUMNS)}) "
+        f"VALUES (?, ?, {', '.join('?' for _ in INDICATOR_COLUMNS)})",
+        [(key_value, date) + row for date, row in zip(dates, values)]
+    )
+
+    state = dict(state, last_date=dates[-1])
+    conn.execute(
+        f"INSERT OR REPLACE INTO {tables['state_table']} ({key}, {', '.join(STATE_COLUMNS)}) "
+        f"VALUES (?, {', '.join('?' for _ in STATE_COLUMNS)})",
+        [key_value] + [state[name] for name in STATE_COLUMNS]
+    )
+
+
+def update_indicators(conn: sqlite3.Connection, source: str, key_value: str,
+                      since_date: str = None) -> int:
+    """更新某个股票/指数的指标（调用方负责提交）
+
+    新数据全部晚于上次计算的最后日期时按状态递推；否则（首次计算、
+    历史数据被改写）对该股票/指数全量重算。
+
+    Returns:
+        写入的指标行数
+    """
+    spec = BAR_SOURCES[source]
+    key = spec["key"]
+    tables = INDICATOR_TABLES[source]
+
+    state_row = conn.execute(
+        f"SELECT {', '.join(STATE_COLUMNS)} FROM {tables['state_table']} WHERE {key} = ?",
+        (key_value,)
+    ).fetchone()
+    state = dict(zip(STATE_COLUMNS, state_row)) if state_row else None
+    # 状态中有 NULL（旧版本写入的 NaN 状态）时无法递推，改为全量重算
+    if state and any(value is None for value in state.values()):
+        state = None
+
+    if state and since_date and since_date > state["last_date"]:
+        rows = conn.execute(
+            f"SELECT date, close FROM {spec['table']} WHERE {key} = ? AND date > ? ORDER BY date",
+            (key_value, state["last_date"])
+        ).fetchall()
+        if not rows:
+            return 0
+
+        history = conn.execute(
+            f"SELECT close FROM {spec['table']} WHERE {key} = ? AND date <= ? ORDER BY date DESC LIMIT ?",
+            (key_value, state["last_date"], HISTORY_WINDOW)
+        ).fetchall()
+        history = np.array([r[0] for r in reversed(history)], dtype=np.float64)
+
+        dates = [r[0] for r in rows]
+        frame, new_state = advance_indicators(
+            state, history, np.array([r[1] for r in rows], dtype=np.float64)
+        )
+    else:
+        rows = conn.execute(
+            f"SELECT date, close FROM {spec['table']} WHERE {key} = ? ORDER BY date",
+            (key_value,)
+        ).fetchall()
+        conn.execute(f"DELETE FROM {tables['table']} WHERE {key} = ?", (key_value,))
+        if not rows:
+            conn.execute(f"DELETE FROM {tables['state_table']} WHERE {key} = ?", (key_value,))
+            return 0
+
+        dates = [r[0] for r in rows]
+        frame, new_state = compute_indicators([r[1] for r in rows])
+
+    _write_indicators(conn, source, key_value, dates, frame, new_state)
+    return len(dates)
+
+
+def has_indicators(conn: sqlite3.Connection, source: str, key_value: str) -> bool:
+    """某个股票/指数的日线指标是否已物化（旧数据库可能尚未建表）"""
+    tables = INDICATOR_TABLES[source]
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tables["state_table"],)
+    ).fetchone()
+    if not exists:
+        return False
+    key = BAR_SOURCES[source]["key"]
+    return conn.execute(
+        f"SELECT 1 FROM {tables['state_table']} WHERE {key} = ?", (key_value,)
+    ).fetchone() is not None
+
+
+def load_indicators(conn: sqlite3.Connection, source: str, key_value: str,
+                    timeframe: str = "daily", start_date: str = None,
+                    end_date: str = None) -> pd.DataFrame:
+    """读取指标（date + INDICATOR_COLUMNS），只读，不写数据库
+
+    日线指标读取数据库中的物化结果；尚未回填（python indicator_engine.py）的股票/指数
+    以及周/月/季线指标由K线即时计算。
+    """
+    spec = BAR_SOURCES[source]
+    key = spec["key"]
+
+    if timeframe == "daily":
+        tables = INDICATOR_TABLES[source]
+        if has_indicators(conn, source, key_value):
+            query = f"SELECT date, {', '.join(INDICATOR_COLUMNS)} FROM {tables['table']} WHERE {key} = ?"
+            params = [key_value]
+            if start_date:
+                query += " AND date >= ?"
+                params.append(start_date)
+            if end_date:
+                query += " AND date <= ?"
+                params.append(end_date)
+            df = pd.read_sql_query(query + " ORDER BY date", conn, params=params)
+        else:
+            df = _compute_from_table(conn, spec["table"], key, key_value)
+    elif timeframe in TIMEFRAMES:
+        df = _compute_from_table(conn, spec["bar_table"], key, key_value, timeframe)
+    else:
+        raise ValueError(f"不支持的周期: {timeframe}")
+
+    if not df.empty:
+        df["date"] = pd.to_datetime(df["date"])
+        if start_date:
+            df = df[df["date"] >= pd.to_datetime(start_date)]
+        if end_date:
+            df = df[df["date"] <= pd.to_datetime(end_date)]
+    return df.reset_index(drop=True)
+
+
+def _compute_from_table(conn: sqlite3.Connection, table: str, key: str, key_value: str,
+                        timeframe: Optional[str] = None) -> pd.DataFrame:
+    query = f"SELECT date, close FROM {table} WHERE {key} = ?"
+    params = [key_value]
+    if timeframe:
+        query += " AND timeframe = ?"
+        params.append(timeframe)
+    prices = pd.read_sql_query(query + " ORDER BY date", conn, params=params)
+
+    frame, _ = compute_indicators(prices["close"])
+    frame.insert(0, "date", prices["date"])
+    return frame
+
+
+def rebuild_all_indicators(db_path: str, source: str = "kline") -> int:
+    """全量重算某个数据库全部股票/指数的指标（用于已有数据库的首次回填）"""
+    spec = BAR_SOURCES[source]
+    conn = sqlite3.connect(db_path)
+    written = 0
+    try:
+        init_indicator_tables(conn, source)
+        keys = [r[0] for r in conn.execute(f"SELECT DISTINCT {spec['key']} FROM {spec['table']}")]
+        for i, key_value in enumerate(keys, 1):
+            written += update_indicators(conn, source, key_value)
+            if i % 500 == 0:
+                conn.commit()
+                logger.info(f"{db_path}: 指标进度 {i}/{len(keys)}")
+        conn.commit()
+    finally:
+        conn.close()
+
+    logger.info(f"{db_path}: 已计算 {written} 行指标")
+    return written
+
+
+def main():
+    """主函数 - 为已有数据库回填技术指标"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    print("🚀 技术指标计算工具")
+    print("=" * 50)
+
+    targets = [
+        ("output/kline_data/a_share_klines.db", "kline"),
+        ("output/index_data/major_indices.db", "index"),
+    ]
+
+    for db_path, source in targets:
+        if not os.path.exists(db_path):
+            print(f"⚠️ 数据库不存在，跳过: {db_path}")
+            continue
+
+        print(f"🔄 正在计算: {db_path}")
+        written = rebuild_all_indicators(db_path, source)
+        print(f"✅ 完成: {written:,} 行指标")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,7 @@ from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
 import sys
 import os
+from returns_engine import has_returns_table
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -78,12 +79,22 @@ class InteractiveChartPlotter:
         try:
             conn = sqlite3.connect(self.kline_db_path)
             
-            query = """
-            SELECT symbol, date, open, high, low, close, volume, amount
-            FROM kline_data 
-            WHERE symbol = ?
-            ORDER BY date
-            """
+            # 附带收益率表中的累计净值（旧数据库未回填时为空）
+            if has_returns_table(conn, "kline"):
+                query = """
+                SELECT k.symbol, k.date, k.open, k.high, k.low, k.close, k.volume, k.amount, r.nav
+                FROM kline_data k
+                LEFT JOIN kline_returns r ON r.symbol = k.symbol AND r.date = k.date
+                WHERE k.symbol = ?
+                ORDER BY k.date
+                """
+            else:
+                query = """
+                SELECT symbol, date, open, high, low, close, volume, amount
+                FROM kline_data 
+                WHERE symbol = ?
+                ORDER BY date
+                """
             
             df = pd.read_sql_query(query, conn, params=(symbol,))
             conn.close()
@@ -128,12 +139,21 @@ class InteractiveChartPlotter:
         try:
             conn = sqlite3.connect(self.index_db_path)
             
-            query = """
-            SELECT index_name, date, open, high, low, close, volume, amount
-            FROM index_data 
-            WHERE index_name = ?
-            ORDER BY date
-            """
+            if has_returns_table(conn, "index"):
+                query = """
+                SELECT i.index_name, i.date, i.open, i.high, i.low, i.close, i.volume, i.amount, r.nav
+                FROM index_data i
+                LEFT JOIN index_returns r ON r.index_name = i.index_name AND r.date = i.date
+                WHERE i.index_name = ?
+                ORDER BY i.date
+                """
+            else:
+                query = """
+                SELECT index_name, date, open, high, low, close, volume, amount
+                FROM index_data 
+                WHERE index_name = ?
+                ORDER BY date
+                """
             
             df = pd.read_sql_query(query, conn, params=(index_name,))
             conn.close()
@@ -198,50 +218,51 @@ class InteractiveChartPlotter:
             return pd.DataFrame()
     
     def normalize_data_for_comparison(self, datasets: list, base_date: str = None) -> list:
-        """标准化数据用于对比（以指定日期或第一个有效日期为基准=100）"""
-        if not datasets:
-            return []
+        """标准化数据用于对比（以指定日期或第一个有效日期为基准=100）
         
-        normalized_datasets = []
+        标准化价格 = 累计净值 / 基期净值 × 100，净值缺失时退回使用收盘价。
+        返回与 datasets 一一对应的标准化价格Series（空数据为 None），不复制DataFrame。
+        """
+        normalized = []
         
         for df in datasets:
             if df.empty:
+                normalized.append(None)
                 continue
             
-            df_copy = df.copy()
+            values = df['nav'] if 'nav' in df.columns and df['nav'].notna().all() else df['close']
             
-            # 确定基准日期
+            # 确定基期位置（基准日期之后无数据时使用第一个数据点）
+            base_pos = 0
             if base_date:
                 try:
-                    base_date_dt = pd.to_datetime(base_date)
-                    base_data = df_copy[df_copy['date'] >= base_date_dt]
-                    if not base_data.empty:
-                        base_price = base_data.iloc[0]['close']
-                    else:
-                        base_price = df_copy.iloc[0]['close']
-                except:
-                    base_price = df_copy.iloc[0]['close']
-            else:
-                base_price = df_copy.iloc[0]['close']
+                    base_pos = int(df['date'].searchsorted(pd.to_datetime(base_date)))
+                except (ValueError, TypeError):
+                    base_pos = 0
+                if base_pos >= len(df):
+                    base_pos = 0
             
-            # 计算标准化价格
-            df_copy['normalized_price'] = (df_copy['close'] / base_price) * 100
-            normalized_datasets.append(df_copy)
+            normalized.append(values / values.iloc[base_pos] * 100)
         
-        return normalized_datasets
+        return normalized
+    
+    @staticmethod
+    def _date_mask(df: pd.DataFrame, start_date: str = None, end_date: str = None) -> pd.Series:
+        """日期范围筛选掩码（不复制DataFrame）"""
+        mask = pd.Series(True, index=df.index)
+        if start_date:
+            mask &= df['date'] >= pd.to_datetime(start_date)
+        if end_date:
+            mask &= df['date'] <= pd.to_datetime(end_date)
+        return mask
     
     def create_chart(self, stock_datasets: list, index_data: pd.DataFrame, 
                     normalize: bool = False, start_date: str = None, end_date: str = None):
         """创建交互式图表（支持hover和十字线）"""
         
-        # 如果需要标准化
+        # 如果需要标准化（返回与数据集一一对应的标准化价格）
         if normalize:
-            all_datasets = stock_datasets + ([index_data] if not index_data.empty else [])
-            normalized_datasets = self.normalize_data_for_comparison(all_datasets, start_date)
-            
-            if normalized_datasets:
-                stock_datasets = normalized_datasets[:-1] if not index_data.empty else normalized_datasets
-                index_data = normalized_datasets[-1] if not index_data.empty and len(normalized_datasets) > len(stock_datasets) else pd.DataFrame()
+            normalized_prices = self.normalize_data_for_comparison(stock_datasets + [index_data], start_date)
         
         # 创建plotly图形，开启十字线功能
         fig = go.Figure()
@@ -255,18 +276,15 @@ class InteractiveChartPlotter:
                 continue
             
             # 筛选日期范围
-            plot_df = stock_df.copy()
-            if start_date:
-                plot_df = plot_df[plot_df['date'] >= pd.to_datetime(start_date)]
-            if end_date:
-                plot_df = plot_df[plot_df['date'] <= pd.to_datetime(end_date)]
+            mask = self._date_mask(stock_df, start_date, end_date)
+            plot_df = stock_df[mask]
             
             if plot_df.empty:
                 continue
             
             color = colors[i % len(colors)]
             
-            y_data = plot_df['normalized_price'] if normalize else plot_df['close']
+            y_data = normalized_prices[i][mask] if normalize else plot_df['close']
             
             # 计算点的大小基于成交量，归一化到合适范围
             volumes = plot_df['volume']
@@ -275,27 +293,28 @@ class InteractiveChartPlotter:
             else:
                 normalized_volume = 15  # 如果成交量都相同，使用固定大小
             
-            # 准备hover信息
-            hover_text = []
-            for _, row in plot_df.iterrows():
-                date_str = row['date'].strftime('%Y-%m-%d')
-                volume_str = f"{row['volume']:,}"
-                amount_str = f"{row['amount']:,.0f}" if 'amount' in row and pd.notna(row['amount']) else "N/A"
-                
-                if normalize:
-                    price_info = f"标准化价格: {row['normalized_price']:.2f}"
-                    orig_price_info = f"<br>原始价格: {row['close']:.2f}"
-                else:
-                    price_info = f"收盘价: {row['close']:.2f}"
-                    orig_price_info = f"<br>开盘价: {row['open']:.2f}<br>最高价: {row['high']:.2f}<br>最低价: {row['low']:.2f}"
-                
-                hover_text.append(
-                    f"<b>{row['name']} ({row['symbol']})</b><br>"
-                    f"日期: {date_str}<br>"
-                    f"{price_info}{orig_price_info}<br>"
-                    f"成交量: {volume_str}<br>"
-                    f"成交额: {amount_str}元"
-                )
+            # hover信息：数值放在 customdata，每条曲线一个 hovertemplate
+            if normalize:
+                hover_columns = ['close', 'volume', 'amount']
+                price_info = "标准化价格: %{y:.2f}<br>原始价格: %{customdata[0]:.2f}"
+            else:
+                hover_columns = ['close', 'open', 'high', 'low', 'volume', 'amount']
+                price_info = ("收盘价: %{customdata[0]:.2f}<br>开盘价: %{customdata[1]:.2f}<br>"
+                              "最高价: %{customdata[2]:.2f}<br>最低价: %{customdata[3]:.2f}")
+            
+            volume_index = len(hover_columns) - 2
+            if plot_df['amount'].notna().any():
+                amount_info = f"%{{customdata[{volume_index + 1}]:,.0f}}"
+            else:
+                amount_info = "N/A"
+            
+            hovertemplate = (
+                f"<b>{plot_df['name'].iloc[0]} ({plot_df['symbol'].iloc[0]})</b><br>"
+                f"日期: %{{x|%Y-%m-%d}}<br>"
+                f"{price_info}<br>"
+                f"成交量: %{{customdata[{volume_index}]:,.0f}}<br>"
+                f"成交额: {amount_info}元<extra></extra>"
+            )
             
             # 添加散点图（点大小代表成交量）
             fig.add_trace(go.Scatter(
@@ -310,39 +329,27 @@ class InteractiveChartPlotter:
                 ),
                 line=dict(color=color, width=2),
                 name=f"{stock_df.iloc[0]['name']} ({plot_df['symbol'].iloc[0]})",
-                hovertemplate='<extra></extra>%{text}',
-                text=hover_text,
+                hovertemplate=hovertemplate,
+                customdata=plot_df[hover_columns].to_numpy(dtype=np.float64),
                 showlegend=True
             ))
         
         # 绘制指数数据
         if not index_data.empty:
-            plot_index = index_data.copy()
-            if start_date:
-                plot_index = plot_index[plot_index['date'] >= pd.to_datetime(start_date)]
-            if end_date:
-                plot_index = plot_index[plot_index['date'] <= pd.to_datetime(end_date)]
+            mask = self._date_mask(index_data, start_date, end_date)
+            plot_index = index_data[mask]
             
             if not plot_index.empty:
-                y_data = plot_index['normalized_price'] if normalize else plot_index['close']
+                y_data = normalized_prices[-1][mask] if normalize else plot_index['close']
                 
-                # 准备指数hover信息
-                hover_text_index = []
-                for _, row in plot_index.iterrows():
-                    date_str = row['date'].strftime('%Y-%m-%d')
-                    
-                    if normalize:
-                        price_info = f"标准化点位: {row['normalized_price']:.2f}"
-                        orig_price_info = f"<br>原始点位: {row['close']:.2f}"
-                    else:
-                        price_info = f"收盘点位: {row['close']:.2f}"
-                        orig_price_info = f"<br>开盘点位: {row['open']:.2f}<br>最高点位: {row['high']:.2f}<br>最低点位: {row['low']:.2f}"
-                    
-                    hover_text_index.append(
-                        f"<b>{row['index_name']}</b><br>"
-                        f"日期: {date_str}<br>"
-                        f"{price_info}{orig_price_info}"
-                    )
+                # 指数hover信息
+                if normalize:
+                    hover_columns = ['close']
+                    price_info = "标准化点位: %{y:.2f}<br>原始点位: %{customdata[0]:.2f}"
+                else:
+                    hover_columns = ['close', 'open', 'high', 'low']
+                    price_info = ("收盘点位: %{customdata[0]:.2f}<br>开盘点位: %{customdata[1]:.2f}<br>"
+                                  "最高点位: %{customdata[2]:.2f}<br>最低点位: %{customdata[3]:.2f}")
                 
                 # 添加指数线（虚线）
                 fig.add_trace(go.Scatter(
@@ -351,8 +358,9 @@ class InteractiveChartPlotter:
                     mode='lines',
                     line=dict(color='red', width=3, dash='dash'),
                     name=f"{plot_index.iloc[0]['index_name']}",
-                    hovertemplate='<extra></extra>%{text}',
-                    text=hover_text_index,
+                    hovertemplate=(f"<b>{plot_index['index_name'].iloc[0]}</b><br>"
+                                   f"日期: %{{x|%Y-%m-%d}}<br>{price_info}<extra></extra>"),
+                    customdata=plot_index[hover_columns].to_numpy(dtype=np.float64),
                     showlegend=True
                 ))
         
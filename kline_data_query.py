@@ -6,13 +6,31 @@ K线数据查询工具
 """
 
 import pandas as pd
+import numpy as np
 import sqlite3
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import matplotlib.pyplot as plt
 import seaborn as sns
 from typing import List, Optional
 
+from bar_aggregator import TIMEFRAMES
+from query_cache import LRUCache, VersionedQueryCache, DEFAULT_CACHE_BYTES, STORED_ADJUST, GLOBAL_VERSION_KEY
+from indicator_engine import load_indicators
+from correlation_engine import correlation_matrix, rolling_beta
+from stock_screener import StockScreener
+from universe_stats import (
+    load_universe_statistics, refresh_universe_statistics, iter_symbol_batches, DEFAULT_STATS_CHUNK_ROWS
+)
+from returns_engine import RETURNS_COLUMNS, has_returns_table
+from lazy_query import LazyQuery, COMPACT_DTYPES
+
+# 单条SQL的参数个数上限（旧版SQLite为999）
+MAX_SQL_PARAMS = 900
+
+# 可用于面板查询的行情字段
+PANEL_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'amount')
+
 # 设置中文字体
 plt.rcParams['font.sans-serif'] = ['SimHei', 'Arial Unicode MS', 'DejaVu Sans']
 plt.rcParams['axes.unicode_minus'] = False
@@ -20,11 +38,34 @@ plt.rcParams['axes.unicode_minus'] = False
 class KlineDataQuery:
     """K线数据查询工具"""
     
-    def __init__(self, db_path: str = "output/kline_data/a_share_klines.db"):
+    def __init__(self, db_path: str = "output/kline_data/a_share_klines.db",
+                 index_db_path: str = "output/index_data/major_indices.db",
+                 cache_max_bytes: int = DEFAULT_CACHE_BYTES):
         self.db_path = db_path
+        self.index_db_path = index_db_path
         
         if not os.path.exists(self.db_path):
             raise FileNotFoundError(f"数据库文件不存在: {self.db_path}")
+        
+        # 查询结果缓存：股票和指数共用一个LRU，各自按所在数据库的版本号失效
+        lru = LRUCache(cache_max_bytes)
+        self.stock_cache = VersionedQueryCache(self.db_path, cache=lru)
+        self.index_cache = VersionedQueryCache(self.index_db_path, cache=lru)
+        
+        # 条件选股器（全市场近期面板，按数据版本号自动重新加载）
+        self.screener = StockScreener(self.db_path)
+    
+    def _connect(self, attach_index: bool = False) -> sqlite3.Connection:
+        """打开K线数据库连接，可选ATTACH指数数据库（别名 idx）"""
+        conn = sqlite3.connect(self.db_path)
+        
+        if attach_index:
+            if not os.path.exists(self.index_db_path):
+                conn.close()
+                raise FileNotFoundError(f"指数数据库文件不存在: {self.index_db_path}")
+            conn.execute("ATTACH DATABASE ? AS idx", (self.index_db_path,))
+        
+        return conn
     
     def get_stock_list(self) -> pd.DataFrame:
         """获取所有股票列表"""
@@ -45,10 +86,77 @@ class KlineDataQuery:
         
         return df
     
-    def query_stock_data(self, symbol: str, start_date: str = None, end_date: str = None) -> pd.DataFrame:
-        """查询指定股票的K线数据"""
-        query = "SELECT * FROM kline_data WHERE symbol = ?"
-        params = [symbol]
+    def cache_stats(self) -> dict:
+        """查询缓存统计: hits / misses / evictions / entries / bytes"""
+        return self.stock_cache.stats()
+    
+    def lazy(self, symbols: List[str] = None, source: str = "kline") -> LazyQuery:
+        """创建惰性查询（见 lazy_query 模块），链式添加条件后调用 to_pandas()/to_numpy() 执行
+        
+        Args:
+            symbols: 股票代码（source="index" 时为指数名称），None 表示全部
+            source: "kline" 或 "index"
+        """
+        db_path = self.db_path if source == "kline" else self.index_db_path
+        query = LazyQuery(db_path, source)
+        return query.symbols(symbols) if symbols is not None else query
+    
+    def query_stock_data(self, symbol: str, start_date: str = None, end_date: str = None,
+                         timeframe: str = "daily", use_cache: bool = True,
+                         columns: List[str] = None, compact: bool = False) -> pd.DataFrame:
+        """查询指定股票的K线数据
+        
+        Args:
+            timeframe: "daily"（日线）或 "weekly"/"monthly"/"quarterly"（读取物化聚合表）
+            use_cache: 是否使用查询缓存（数据入库后自动失效）
+            columns: 只读取这些列（如 ['date', 'close']），默认 symbol + 全部行情列
+            compact: 紧凑列类型（float32价格、category代码），见 lazy_query.compact_frame
+        """
+        query = self.lazy([symbol]).between(start_date, end_date).timeframe(timeframe)
+        if columns:
+            query = query.select(columns)
+        
+        def loader():
+            return query.to_pandas(compact=compact)
+        
+        if not use_cache:
+            return loader()
+        
+        params = (start_date, end_date, timeframe, STORED_ADJUST)
+        if columns or compact:
+            params += (tuple(columns or ()), compact)
+        df = self.stock_cache.get_or_load('stock', symbol, params, loader)
+        return df.copy()
+    
+    def query_index_data(self, index_name: str, start_date: str = None, end_date: str = None,
+                         timeframe: str = "daily", use_cache: bool = True) -> pd.DataFrame:
+        """查询指定指数的K线数据（通过ATTACH的指数数据库）"""
+        if not use_cache:
+            return self._load_index_data(index_name, start_date, end_date, timeframe)
+        
+        df = self.index_cache.get_or_load(
+            'index', index_name, (start_date, end_date, timeframe),
+            lambda: self._load_index_data(index_name, start_date, end_date, timeframe)
+        )
+        return df.copy()
+    
+    def _load_index_data(self, index_name: str, start_date: str = None, end_date: str = None,
+                         timeframe: str = "daily") -> pd.DataFrame:
+        """从指数数据库读取指数K线数据"""
+        if timeframe == "daily":
+            query = """
+            SELECT index_name, date, open, high, low, close, volume, amount
+            FROM idx.index_data WHERE index_name = ?
+            """
+            params = [index_name]
+        elif timeframe in TIMEFRAMES:
+            query = """
+            SELECT index_name, date, open, high, low, close, volume, amount
+            FROM idx.index_bars WHERE index_name = ? AND timeframe = ?
+            """
+            params = [index_name, timeframe]
+        else:
+            raise ValueError(f"不支持的周期: {timeframe}")
         
         if start_date:
             query += " AND date >= ?"
@@ -60,15 +168,421 @@ class KlineDataQuery:
         
         query += " ORDER BY date"
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect(attach_index=True)
         df = pd.read_sql_query(query, conn, params=params)
         conn.close()
         
         if not df.empty:
             df['date'] = pd.to_datetime(df['date'])
-            
+        
+        return df
+    
+    def query_indicators(self, symbol: str, start_date: str = None, end_date: str = None,
+                         timeframe: str = "daily", use_cache: bool = True) -> pd.DataFrame:
+        """查询股票技术指标（MA/EMA/MACD/RSI/布林带）
+        
+        日线指标读取数据库中的物化结果（首次查询时计算并写入），其他周期由聚合K线即时计算。
+        """
+        def loader():
+            conn = sqlite3.connect(self.db_path)
+            try:
+                return load_indicators(conn, "kline", symbol, timeframe, start_date, end_date)
+            finally:
+                conn.close()
+        
+        if not use_cache:
+            return loader()
+        return self.stock_cache.get_or_load(
+            'indicators', symbol, (start_date, end_date, timeframe, STORED_ADJUST), loader
+        ).copy()
+    
+    def query_index_indicators(self, index_name: str, start_date: str = None, end_date: str = None,
+                               timeframe: str = "daily", use_cache: bool = True) -> pd.DataFrame:
+        """查询指数技术指标"""
+        def loader():
+            conn = sqlite3.connect(self.index_db_path)
+            try:
+                return load_indicators(conn, "index", index_name, timeframe, start_date, end_date)
+            finally:
+                conn.close()
+        
+        if not use_cache:
+            return loader()
+        return self.index_cache.get_or_load(
+            'indicators', index_name, (start_date, end_date, timeframe), loader
+        ).copy()
+    
+    def query_returns(self, symbol: str, start_date: str = None, end_date: str = None,
+                      use_cache: bool = True) -> pd.DataFrame:
+        """查询股票收益率派生数据（日收益率、对数收益率、累计净值、最高净值、回撤）
+        
+        收益率表由入库流程增量维护；旧数据库未回填时返回空DataFrame（可运行 returns_engine.py 回填）。
+        """
+        def loader():
+            conn = sqlite3.connect(self.db_path)
+            try:
+                if not has_returns_table(conn, "kline"):
+                    return pd.DataFrame()
+                
+                query = f"SELECT date, {', '.join(RETURNS_COLUMNS)} FROM kline_returns WHERE symbol = ?"
+                params = [symbol]
+                if start_date:
+                    query += " AND date >= ?"
+                    params.append(start_date)
+                if end_date:
+                    query += " AND date <= ?"
+                    params.append(end_date)
+                query += " ORDER BY date"
+                
+                df = pd.read_sql_query(query, conn, params=params)
+                df['date'] = pd.to_datetime(df['date'])
+                return df
+            finally:
+                conn.close()
+        
+        if not use_cache:
+            return loader()
+        return self.stock_cache.get_or_load(
+            'returns', symbol, (start_date, end_date, None, STORED_ADJUST), loader
+        ).copy()
+    
+    def query_stock_with_index(self, symbol: str, index_name: str = "上证指数",
+                               start_date: str = None, end_date: str = None) -> pd.DataFrame:
+        """在同一连接中查询股票与指数数据，按交易日对齐（单次SQL）"""
+        query = """
+        SELECT k.date, k.symbol, k.open, k.high, k.low, k.close, k.volume, k.amount,
+               i.open AS index_open, i.high AS index_high, i.low AS index_low,
+               i.close AS index_close, i.volume AS index_volume
+        FROM kline_data k
+        LEFT JOIN idx.index_data i ON i.index_name = ? AND i.date = k.date
+        WHERE k.symbol = ?
+        """
+        params = [index_name, symbol]
+        
+        if start_date:
+            query += " AND k.date >= ?"
+            params.append(start_date)
+        
+        if end_date:
+            query += " AND k.date <= ?"
+            params.append(end_date)
+        
+        query += " ORDER BY k.date"
+        
+        conn = self._connect(attach_index=True)
+        df = pd.read_sql_query(query, conn, params=params)
+        conn.close()
+        
+        if not df.empty:
+            df['date'] = pd.to_datetime(df['date'])
+        
+        return df
+    
+    def get_relative_strength(self, index_name: str = "沪深300", start_date: str = None,
+                              end_date: str = None) -> pd.DataFrame:
+        """计算全市场股票相对指数的强度（单次跨库SQL）
+        
+        relative_strength = (1 + 股票区间收益) / (1 + 指数区间收益)，
+        指数价格取不晚于股票首/末交易日的最近一个点位。
+        """
+        date_filter = ""
+        params = []
+        
+        if start_date:
+            date_filter += " AND date >= ?"
+            params.append(start_date)
+        
+        if end_date:
+            date_filter += " AND date <= ?"
+            params.append(end_date)
+        
+        query = f"""
+        WITH bounds AS (
+            SELECT symbol, MIN(date) AS first_date, MAX(date) AS last_date, COUNT(*) AS data_count
+            FROM kline_data
+            WHERE 1 = 1{date_filter}
+            GROUP BY symbol
+        ),
+        prices AS (
+            SELECT b.symbol, b.first_date, b.last_date, b.data_count,
+                   f.close AS first_close, l.close AS last_close,
+                   (SELECT close FROM idx.index_data
+                    WHERE index_name = ? AND date <= b.first_date
+                    ORDER BY date DESC LIMIT 1) AS index_first_close,
+                   (SELECT close FROM idx.index_data
+                    WHERE index_name = ? AND date <= b.last_date
+                    ORDER BY date DESC LIMIT 1) AS index_last_close
+            FROM bounds b
+            JOIN kline_data f ON f.symbol = b.symbol AND f.date = b.first_date
+            JOIN kline_data l ON l.symbol = b.symbol AND l.date = b.last_date
+        )
+        SELECT p.symbol, s.name, s.market, p.first_date, p.last_date, p.data_count,
+               p.first_close, p.last_close, p.index_first_close, p.index_last_close,
+               (p.last_close / p.first_close - 1) * 100 AS stock_return,
+               (p.index_last_close / p.index_first_close - 1) * 100 AS index_return,
+               (p.last_close / p.first_close) / (p.index_last_close / p.index_first_close) AS relative_strength
+        FROM prices p
+        LEFT JOIN stock_info s ON s.symbol = p.symbol
+        WHERE p.first_close > 0 AND p.index_first_close > 0 AND p.index_last_close > 0
+        ORDER BY relative_strength DESC
+        """
+        params += [index_name, index_name]
+        
+        conn = self._connect(attach_index=True)
+        df = pd.read_sql_query(query, conn, params=params)
+        conn.close()
+        
+        if not df.empty:
+            df['excess_return'] = df['stock_return'] - df['index_return']
+        
         return df
     
+    def query_panel(self, symbols: List[str], start_date: str = None, end_date: str = None,
+                    fields='close', timeframe: str = "daily", compact: bool = False) -> pd.DataFrame:
+        """批量查询多只股票，返回按日期对齐的宽表
+        
+        股票代码按 MAX_SQL_PARAMS 分块，每块一条 IN (...) 查询，共用一个连接。
+        
+        Args:
+            symbols: 股票代码列表
+            fields: 单个字段名（如 "close"）或字段列表
+            timeframe: "daily" 或 "weekly"/"monthly"/"quarterly"
+            compact: 价格字段使用 float32（对齐后缺失值为NaN，成交量仍为 float64）
+        Returns:
+            单字段: index=date, columns=symbol
+            多字段: index=date, columns=MultiIndex(field, symbol)
+        """
+        single_field = isinstance(fields, str)
+        field_list = [fields] if single_field else list(fields)
+        
+        invalid = [f for f in field_list if f not in PANEL_FIELDS]
+        if invalid:
+            raise ValueError(f"不支持的字段: {invalid}")
+        if timeframe != "daily" and timeframe not in TIMEFRAMES:
+            raise ValueError(f"不支持的周期: {timeframe}")
+        
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return pd.DataFrame()
+        
+        if timeframe == "daily":
+            base_query = f"SELECT symbol, date, {', '.join(field_list)} FROM kline_data WHERE 1 = 1"
+            base_params = []
+        else:
+            base_query = f"SELECT symbol, date, {', '.join(field_list)} FROM kline_bars WHERE timeframe = ?"
+            base_params = [timeframe]
+        
+        if start_date:
+            base_query += " AND date >= ?"
+            base_params.append(start_date)
+        
+        if end_date:
+            base_query += " AND date <= ?"
+            base_params.append(end_date)
+        
+        conn = self._connect()
+        frames = []
+        for i in range(0, len(symbols), MAX_SQL_PARAMS):
+            chunk = symbols[i:i + MAX_SQL_PARAMS]
+            placeholders = ', '.join('?' for _ in chunk)
+            frames.append(pd.read_sql_query(
+                f"{base_query} AND symbol IN ({placeholders})",
+                conn, params=base_params + chunk
+            ))
+        conn.close()
+        
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+        if df.empty:
+            return pd.DataFrame()
+        
+        panel = df.pivot(index='date', columns='symbol', values=fields if single_field else field_list)
+        
+        # 只对去重后的日期做一次解析
+        panel.index = pd.to_datetime(panel.index)
+        panel = panel.sort_index()
+        panel.index.name = 'date'
+        
+        loaded = set(df['symbol'].unique())
+        present = [s for s in symbols if s in loaded]
+        if single_field:
+            panel = panel.reindex(columns=present)
+        else:
+            panel = panel.reindex(columns=pd.MultiIndex.from_product([field_list, present]))
+        panel.columns.names = ['symbol'] if single_field else ['field', 'symbol']
+        
+        if compact:
+            float32_fields = [f for f in field_list if COMPACT_DTYPES.get(f) == 'float32']
+            if single_field and float32_fields:
+                panel = panel.astype('float32')
+            elif float32_fields:
+                panel = panel.astype({col: 'float32' for col in panel.columns if col[0] in float32_fields})
+        
+        return panel
+    
+    def get_correlation_matrix(self, symbols: List[str] = None, end_date: str = None,
+                               window: int = 250) -> pd.DataFrame:
+        """截至 end_date 的 window 日收益率相关系数矩阵（默认全市场）
+        
+        分块计算，结果按 窗口+日期+数据版本号 缓存在 output/correlation_cache。
+        """
+        symbols, corr = correlation_matrix(self.db_path, end_date, window, symbols)
+        return pd.DataFrame(corr, index=pd.Index(symbols, name='symbol'),
+                            columns=pd.Index(symbols, name='symbol'), copy=False)
+    
+    def get_rolling_beta(self, index_name: str = "沪深300", window: int = 250,
+                         start_date: str = None, end_date: str = None,
+                         symbols: List[str] = None) -> dict:
+        """股票相对指数的滚动Beta和相关系数
+        
+        Returns:
+            {'beta': DataFrame, 'corr': DataFrame}，index=date, columns=symbol
+        """
+        result = rolling_beta(self.db_path, self.index_db_path, index_name, window,
+                              start_date, end_date, symbols)
+        index = pd.DatetimeIndex(pd.to_datetime(result['dates']), name='date')
+        columns = pd.Index(result['symbols'], name='symbol')
+        return {
+            name: pd.DataFrame(result[name], index=index, columns=columns, copy=False)
+            for name in ('beta', 'corr')
+        }
+    
+    def screen(self, expression: str, markets: List[str] = None, limit: int = None) -> pd.DataFrame:
+        """条件选股，例如 "close > ma(close, 250) and volume > 3 * ma(volume, 20)"
+        
+        表达式语法见 stock_screener 模块说明；markets 按 stock_info.market 过滤（如 ['创业板']）。
+        """
+        return self.screener.screen(expression, markets, limit)
+    
+    def get_stock_names(self, symbols: List[str]) -> dict:
+        """批量获取股票名称，返回 {symbol: name}"""
+        symbols = list(dict.fromkeys(symbols))
+        names = {}
+        
+        conn = self._connect()
+        for i in range(0, len(symbols), MAX_SQL_PARAMS):
+            chunk = symbols[i:i + MAX_SQL_PARAMS]
+            placeholders = ', '.join('?' for _ in chunk)
+            names.update(conn.execute(
+                f"SELECT symbol, name FROM stock_info WHERE symbol IN ({placeholders})", chunk
+            ).fetchall())
+        conn.close()
+        
+        return names
+    
+    def get_market_snapshot(self, date: str, end_date: str = None, lookback_days: int = 15) -> dict:
+        """横截面行情快照：某一交易日（或短日期区间）全部股票的K线
+        
+        单次按 idx_date 索引的区间查询，向前多取 lookback_days 个自然日用于计算涨跌幅。
+        
+        Args:
+            date: 起始日期 YYYY-MM-DD
+            end_date: 结束日期，默认与 date 相同
+            lookback_days: 向前查找上一收盘价的自然日数
+        Returns:
+            按 (symbol, date) 排序的numpy数组字典:
+            symbol, name, market, date(datetime64[D]), open, high, low, close, volume, amount,
+            prev_close, pct_change(%), amplitude(%), amount_rank(当日成交额排名，1为最大)
+            行情列均为float64，缺失值为NaN
+        """
+        end_date = end_date or date
+        lookback_start = (datetime.strptime(date, '%Y-%m-%d') - timedelta(days=lookback_days)).strftime('%Y-%m-%d')
+        
+        conn = self._connect()
+        df = pd.read_sql_query(
+            """
+            SELECT symbol, date, open, high, low, close, volume, amount
+            FROM kline_data
+            WHERE date >= ? AND date <= ?
+            """,
+            conn, params=[lookback_start, end_date]
+        )
+        info = pd.read_sql_query("SELECT symbol, name, market FROM stock_info", conn)
+        conn.close()
+        
+        symbols = df['symbol'].to_numpy(dtype=object)
+        dates = df['date'].to_numpy().astype('datetime64[D]')
+        
+        # 按 (symbol, date) 排序，同一股票的相邻行即前后交易日
+        order = np.lexsort((dates, symbols))
+        symbols = symbols[order]
+        dates = dates[order]
+        # 成交量可能为NULL，与价格一样用float64保存（转int64会把NaN变成极小值）
+        columns = {col: df[col].to_numpy(dtype=np.float64)[order]
+                   for col in ('open', 'high', 'low', 'close', 'volume', 'amount')}
+        
+        close = columns['close']
+        prev_close = np.full(len(close), np.nan)
+        if len(close) > 1:
+            same_symbol = symbols[1:] == symbols[:-1]
+            prev_close[1:] = np.where(same_symbol, close[:-1], np.nan)
+        
+        # 只保留请求区间内的行
+        keep = dates >= np.datetime64(date, 'D')
+        symbols, dates, prev_close = symbols[keep], dates[keep], prev_close[keep]
+        columns = {col: values[keep] for col, values in columns.items()}
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct_change = (columns['close'] / prev_close - 1) * 100
+            amplitude = (columns['high'] - columns['low']) / prev_close * 100
+        
+        # 当日成交额排名：按 (date, -amount) 排序后减去每个交易日的起始位置
+        amount = np.nan_to_num(columns['amount'], nan=-np.inf)
+        rank_order = np.lexsort((-amount, dates))
+        sorted_dates = dates[rank_order]
+        is_start = np.ones(len(sorted_dates), dtype=bool)
+        is_start[1:] = sorted_dates[1:] != sorted_dates[:-1]
+        group_start = np.maximum.accumulate(np.where(is_start, np.arange(len(sorted_dates)), 0))
+        amount_rank = np.empty(len(sorted_dates), dtype=np.int32)
+        amount_rank[rank_order] = np.arange(len(sorted_dates)) - group_start + 1
+        
+        info_index = pd.Index(info['symbol'])
+        positions = info_index.get_indexer(symbols)
+        found = positions >= 0
+        names = np.where(found, info['name'].to_numpy(dtype=object)[positions], None)
+        markets = np.where(found, info['market'].to_numpy(dtype=object)[positions], None)
+        
+        return {
+            'symbol': symbols,
+            'name': names,
+            'market': markets,
+            'date': dates,
+            **columns,
+            'prev_close': prev_close,
+            'pct_change': pct_change,
+            'amplitude': amplitude,
+            'amount_rank': amount_rank,
+        }
+    
+    def get_market_breadth(self, date: str, end_date: str = None) -> pd.DataFrame:
+        """市场宽度统计：每个交易日的上涨/下跌/平盘家数及涨跌幅中位数"""
+        snapshot = self.get_market_snapshot(date, end_date)
+        if len(snapshot['date']) == 0:
+            return pd.DataFrame()
+        
+        unique_dates, date_idx = np.unique(snapshot['date'], return_inverse=True)
+        pct = snapshot['pct_change']
+        valid = ~np.isnan(pct)
+        
+        def count(mask):
+            return np.bincount(date_idx[mask], minlength=len(unique_dates))
+        
+        # 按交易日分段求中位数
+        order = np.lexsort((pct, date_idx))
+        sorted_pct, sorted_idx = pct[order], date_idx[order]
+        valid_sorted = ~np.isnan(sorted_pct)
+        bounds = np.searchsorted(sorted_idx[valid_sorted], np.arange(len(unique_dates) + 1))
+        medians = [np.median(sorted_pct[valid_sorted][lo:hi]) if hi > lo else np.nan
+                   for lo, hi in zip(bounds[:-1], bounds[1:])]
+        
+        return pd.DataFrame({
+            'date': pd.to_datetime(unique_dates),
+            'total': np.bincount(date_idx, minlength=len(unique_dates)),
+            'up': count(valid & (pct > 0)),
+            'down': count(valid & (pct < 0)),
+            'flat': count(valid & (pct == 0)),
+            'median_pct_change': medians,
+        })
+    
     def get_market_summary(self) -> pd.DataFrame:
         """获取市场汇总统计"""
         query = """
@@ -131,16 +645,68 @@ class KlineDataQuery:
             '总成交额': df['amount'].sum(),
         }
         
-        # 计算收益率
+        # 计算收益率：优先读取收益率表中的累计净值和回撤，未回填时由收盘价计算
         if len(df) > 1:
-            total_return = (df['close'].iloc[-1] / df['close'].iloc[0] - 1) * 100
-            stats['总收益率(%)'] = total_return
+            returns = self.query_returns(symbol)
+            if len(returns) == len(df):
+                growth = returns['nav'].iloc[-1] / returns['nav'].iloc[0]
+                stats['最大回撤(%)'] = returns['drawdown'].min() * 100
+            else:
+                growth = df['close'].iloc[-1] / df['close'].iloc[0]
+            
+            stats['总收益率(%)'] = (growth - 1) * 100
             
             # 年化收益率
             days = (df['date'].iloc[-1] - df['date'].iloc[0]).days
             if days > 0:
-                annual_return = (df['close'].iloc[-1] / df['close'].iloc[0]) ** (365/days) - 1
-                stats['年化收益率(%)'] = annual_return * 100
+                stats['年化收益率(%)'] = (growth ** (365/days) - 1) * 100
+        
+        return stats
+    
+    def iter_symbols(self, fields: List[str] = ('date', 'close'), chunk_rows: int = DEFAULT_STATS_CHUNK_ROWS,
+                     start_date: str = None, end_date: str = None):
+        """逐只股票流式遍历全市场日线（单个游标，内存上限约 chunk_rows 行 + 单只股票的行数）
+        
+        Args:
+            fields: 读取的列（date/open/high/low/close/volume/amount）
+            chunk_rows: 每次从游标读取的行数
+        
+        Yields:
+            (symbol, {字段名: ndarray})，date 为 datetime64[D]，其余为 float64；
+            数组是当前块的视图，需要跨迭代保留时请自行 copy()
+        
+        示例:
+            for symbol, bars in query.iter_symbols(['date', 'close']):
+                ...
+        """
+        unknown = [f for f in fields if f not in PANEL_FIELDS and f != 'date']
+        if unknown:
+            raise ValueError(f"不支持的字段: {', '.join(unknown)}")
+        
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for batch in iter_symbol_batches(conn, fields, chunk_rows, start_date, end_date):
+                symbols = batch.pop('symbol')
+                if 'date' in batch:
+                    batch['date'] = batch['date'].astype('U10').astype('datetime64[D]')
+                
+                starts = np.flatnonzero(np.r_[True, symbols[1:] != symbols[:-1]])
+                ends = np.r_[starts[1:], len(symbols)]
+                for start, end in zip(starts, ends):
+                    yield symbols[start], {name: values[start:end] for name, values in batch.items()}
+        finally:
+            conn.close()
+    
+    def get_universe_statistics(self, refresh: bool = False) -> pd.DataFrame:
+        """获取全市场统计（每只股票一行，指标同 get_stock_statistics）
+        
+        读取 stock_statistics 表；表不存在、数据版本已变化或 refresh=True 时单次扫描重新计算。
+        """
+        stats = pd.DataFrame() if refresh else load_universe_statistics(self.db_path)
+        current_version = self.stock_cache.versions.get(GLOBAL_VERSION_KEY)
+        
+        if stats.empty or (stats['data_version'] != current_version).any():
+            stats = refresh_universe_statistics(self.db_path)
         
         return stats
     
@@ -187,21 +753,22 @@ class KlineDataQuery:
         """比较多只股票的表现"""
         fig, ax = plt.subplots(1, 1, figsize=(12, 8))
         
+        # 一次查询取回所有股票的收盘价面板和名称
+        panel = self.query_panel(symbols, start_date, end_date, fields='close')
+        names = self.get_stock_names(symbols)
+        
         for symbol in symbols:
-            df = self.query_stock_data(symbol, start_date, end_date)
-            
-            if df.empty:
+            if symbol not in panel.columns:
                 print(f"警告: {symbol} 没有数据")
                 continue
             
-            # 计算归一化价格（以第一天为基准）
-            normalized_price = df['close'] / df['close'].iloc[0] * 100
+            close = panel[symbol].dropna()
             
-            # 获取股票名称
-            stock_list = self.search_stocks(symbol)
-            stock_name = stock_list['name'].iloc[0] if not stock_list.empty else symbol
+            # 计算归一化价格（以第一天为基准）
+            normalized_price = close / close.iloc[0] * 100
             
-            ax.plot(df['date'], normalized_price, label=f'{symbol} - {stock_name}', linewidth=2)
+            stock_name = names.get(symbol) or symbol
+            ax.plot(close.index, normalized_price, label=f'{symbol} - {stock_name}', linewidth=2)
         
         ax.set_title('股票表现对比（归一化）', fontsize=14, fontweight='bold')
         ax.set_ylabel('相对表现 (%)', fontsize=12)
@@ -213,22 +780,36 @@ class KlineDataQuery:
         plt.show()
     
     def export_stock_data(self, symbol: str, start_date: str = None, end_date: str = None,
-                         output_path: str = None):
-        """导出股票数据到CSV"""
+                         output_path: str = None, file_format: str = "csv", compression: str = None):
+        """导出股票数据到CSV/Parquet/Feather
+        
+        Args:
+            file_format: "csv" / "parquet" / "feather"
+            compression: parquet/feather 的压缩方式（默认zstd）
+        """
         df = self.query_stock_data(symbol, start_date, end_date)
         
         if df.empty:
             print(f"没有找到 {symbol} 的数据")
             return None
         
+        extension = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+        if file_format not in extension:
+            raise ValueError(f"不支持的文件格式: {file_format}")
+        
         if output_path is None:
             safe_symbol = symbol.replace('.', '_')
-            output_path = f"output/{safe_symbol}_kline_data.csv"
+            output_path = f"output/{safe_symbol}_kline_data{extension[file_format]}"
         
         # 确保输出目录存在
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         
-        df.to_csv(output_path, index=False, encoding='utf-8-sig')
+        if file_format == "csv":
+            df.to_csv(output_path, index=False, encoding='utf-8-sig')
+        elif file_format == "parquet":
+            df.to_parquet(output_path, index=False, compression=compression or "zstd")
+        else:
+            df.to_feather(output_path, compression=compression or "zstd")
         print(f"数据已导出到: {output_path}")
         
         return output_path
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+惰性K线查询
+链式收集 股票/指数、日期范围、列、周期 条件，调用 to_pandas() / to_numpy() 时才
+编译成只读取所需列的最小SQL（或带列裁剪和过滤下推的Parquet扫描）并执行。
+
+示例:
+    q = LazyQuery(db_path).symbols("sh600519").between("2020-01-01").select("close")
+    closes = q.to_numpy()["close"]
+"""
+
+import copy
+import json
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from bar_aggregator import BAR_SOURCES, TIMEFRAMES
+
+# 可查询的行情列（不含自增 id）
+QUERY_COLUMNS = ("date", "open", "high", "low", "close", "volume", "amount")
+
+# 单条SQL的参数个数上限，超过时改用 json_each 传入代码列表
+MAX_SQL_PARAMS = 900
+
+# to_numpy 的列类型（其余列为字符串）
+NUMPY_DTYPES = {
+    "open": np.float64,
+    "high": np.float64,
+    "low": np.float64,
+    "close": np.float64,
+    "volume": np.int64,
+    "amount": np.float64,
+}
+
+# 紧凑模式的列类型：价格 float32（约7位有效数字，足够表示A股价格），成交量保持 int64，
+# 成交额数值较大、累计净值用于标准化计算，仍用 float64；代码/名称等重复字符串转为 category
+COMPACT_DTYPES = {
+    "open": "float32",
+    "high": "float32",
+    "low": "float32",
+    "close": "float32",
+    "volume": "int64",
+}
+COMPACT_CATEGORY_COLUMNS = ("symbol", "index_name", "name", "market")
+
+
+def compact_frame(df: pd.DataFrame, date_format: str = "datetime") -> pd.DataFrame:
+    """把查询结果转换为紧凑列类型（返回新DataFrame）
+
+    Args:
+        date_format: "datetime" 保持/转换为 datetime64；"int" 转为 int32 的 YYYYMMDD
+    """
+    dtypes = {col: dtype for col, dtype in COMPACT_DTYPES.items() if col in df.columns}
+    # 含缺失值的成交量无法转为整数，保持原类型
+    if "volume" in dtypes and df["volume"].isna().any():
+        del dtypes["volume"]
+    dtypes.update({col: "category" for col in COMPACT_CATEGORY_COLUMNS if col in df.columns})
+    df = df.astype(dtypes)
+
+    if "date" in df.columns:
+        if date_format == "int":
+            dates = pd.to_datetime(df["date"])
+            df["date"] = (dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day).astype("int32")
+        elif not pd.api.types.is_datetime64_any_dtype(df["date"]):
+            df["date"] = pd.to_datetime(df["date"])
+    return df
+
+
+class LazyQuery:
+    """惰性K线查询
+
+    每个条件方法返回新的查询对象，原对象不变，可作为模板复用。
+    """
+
+    def __init__(self, db_path: str, source: str = "kline", columnar_path: str = None):
+        """
+        Args:
+            db_path: SQLite数据库路径
+            source: "kline"（股票）或 "index"（指数）
+            columnar_path: 导出的Parquet/Feather文件，指定后日线查询改为扫描该文件
+        """
+        if source not in BAR_SOURCES:
+            raise ValueError(f"不支持的数据源: {source}")
+
+        self.db_path = db_path
+        self.source = source
+        self.columnar_path = columnar_path
+        self._keys: Optional[Tuple[str, ...]] = None
+        self._start_date: Optional[str] = None
+        self._end_date: Optional[str] = None
+        self._columns: Optional[Tuple[str, ...]] = None
+        self._timeframe = "daily"
+
+    @property
+    def key_column(self) -> str:
+        return BAR_SOURCES[self.source]["key"]
+
+    def _replace(self, **changes) -> "LazyQuery":
+        query = copy.copy(self)
+        query.__dict__.update(changes)
+        return query
+
+    def symbols(self, *keys: str) -> "LazyQuery":
+        """限定股票代码（指数数据源为指数名称），可传多个或一个列表"""
+        if len(keys) == 1 and not isinstance(keys[0], str):
+            keys = tuple(keys[0])
+        return self._replace(_keys=tuple(keys))
+
+    def between(self, start_date: str = None, end_date: str = None) -> "LazyQuery":
+        """限定日期范围（闭区间，YYYY-MM-DD）"""
+        return self._replace(_start_date=start_date, _end_date=end_date)
+
+    def select(self, *columns: str) -> "LazyQuery":
+        """只读取指定列（可包含代码列）"""
+        if len(columns) == 1 and not isinstance(columns[0], str):
+            columns = tuple(columns[0])
+
+        allowed = set(QUERY_COLUMNS) | {self.key_column}
+        unknown = [col for col in columns if col not in allowed]
+        if unknown:
+            raise ValueError(f"不支持的列: {', '.join(unknown)}")
+        return self._replace(_columns=tuple(columns))
+
+    def timeframe(self, timeframe: str) -> "LazyQuery":
+        """K线周期: daily / weekly / monthly / quarterly"""
+        if timeframe != "daily" and timeframe not in TIMEFRAMES:
+            raise ValueError(f"不支持的周期: {timeframe}")
+        return self._replace(_timeframe=timeframe)
+
+    @property
+    def columns(self) -> List[str]:
+        """结果列：未调用 select 时为 代码列 + 全部行情列"""
+        if self._columns is None:
+            return [self.key_column] + list(QUERY_COLUMNS)
+        return list(self._columns)
+
+    def compile(self) -> Tuple[str, list]:
+        """编译为 (SQL, 参数)"""
+        spec = BAR_SOURCES[self.source]
+        key = self.key_column
+        conditions, params = [], []
+
+        if self._timeframe == "daily":
+            table = spec["table"]
+        else:
+            table = spec["bar_table"]
+            conditions.append("timeframe = ?")
+            params.append(self._timeframe)
+
+        if self._keys is not None:
+            if len(self._keys) == 1:
+                conditions.append(f"{key} = ?")
+                params.append(self._keys[0])
+            elif len(self._keys) <= MAX_SQL_PARAMS:
+                conditions.append(f"{key} IN ({', '.join('?' for _ in self._keys)})")
+                params.extend(self._keys)
+            else:
+                conditions.append(f"{key} IN (SELECT value FROM json_each(?))")
+                params.append(json.dumps(list(self._keys)))
+
+        if self._start_date:
+            conditions.append("date >= ?")
+            params.append(self._start_date)
+        if self._end_date:
+            conditions.append("date <= ?")
+            params.append(self._end_date)
+
+        sql = f"SELECT {', '.join(self.columns)} FROM {table}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        # 单只股票按日期排序即可走 (symbol, date) 索引
+        if self._keys is not None and len(self._keys) == 1:
+            sql += " ORDER BY date"
+        else:
+            sql += f" ORDER BY {key}, date"
+
+        return sql, params
+
+    def _use_columnar(self) -> bool:
+        if not self.columnar_path:
+            return False
+        if self._timeframe != "daily" or self.source != "kline":
+            raise ValueError("列式文件只支持股票日线查询")
+        return True
+
+    def _scan_columnar(self) -> pd.DataFrame:
+        from data_exporter import read_columnar
+
+        # 多只股票时需要代码列和日期列排序，排序后再去掉未选择的列
+        columns = self.columns
+        read_columns = list(dict.fromkeys(columns + [self.key_column, "date"]))
+        df = read_columnar(self.columnar_path, columns=read_columns, symbols=self._keys,
+                           start_date=self._start_date, end_date=self._end_date)
+        df = df.sort_values([self.key_column, "date"], kind="stable", ignore_index=True)
+        return df[columns]
+
+    def to_pandas(self, parse_dates: bool = True, compact: bool = False) -> pd.DataFrame:
+        """执行查询并返回DataFrame
+
+        Args:
+            parse_dates: 是否把 date 转为 datetime64
+            compact: 紧凑列类型（见 compact_frame），全市场数据约节省一半以上内存
+        """
+        if self._use_columnar():
+            df = self._scan_columnar()
+            return compact_frame(df) if compact else df
+
+        sql, params = self.compile()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            df = pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+
+        if compact:
+            return compact_frame(df, "datetime" if parse_dates else "int")
+        if parse_dates and "date" in df.columns and not df.empty:
+            df["date"] = pd.to_datetime(df["date"])
+        return df
+
+    def to_numpy(self) -> Dict[str, np.ndarray]:
+        """执行查询并返回 {列名: ndarray}，date 为 datetime64[D]，不经过DataFrame"""
+        if self._use_columnar():
+            df = self._scan_columnar()
+            result = {col: df[col].to_numpy() for col in df.columns}
+            if "date" in result:
+                result["date"] = result["date"].astype("datetime64[D]")
+            return result
+
+        sql, params = self.compile()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+        columns = self.columns
+        values = list(zip(*rows)) if rows else [()] * len(columns)
+
+        result = {}
+        for col, column_values in zip(columns, values):
+            if col == "date":
+                result[col] = np.array([d[:10] for d in column_values], dtype="datetime64[D]")
+            elif col in NUMPY_DTYPES:
+                # 含 NULL 的整数列退化为 float64（NaN）
+                dtype = NUMPY_DTYPES[col] if None not in column_values else np.float64
+                result[col] = np.array(column_values, dtype=dtype)
+            else:
+                result[col] = np.array(column_values, dtype=object)
+        return result
+
+    def __repr__(self) -> str:
+        sql, params = self.compile()
+        return f"LazyQuery({sql!r}, params={params!r})"
+
@@ -35,6 +35,14 @@ from datetime import datetime, timedelta
 import warnings
 warnings.filterwarnings('ignore')
 
+from bar_aggregator import init_bar_tables, update_bars
+from indicator_engine import init_indicator_tables, update_indicators
+from returns_engine import init_returns_table, update_returns
+from query_cache import init_version_table, bump_data_version
+from data_exporter import (
+    stream_query_to_csv, stream_query_to_columnar, export_groups_parallel, DEFAULT_CHUNK_ROWS
+)
+
 class MajorIndexFetcher:
     def __init__(self, start_date="1990-01-01"):
         self.start_date = start_date
@@ -127,6 +135,16 @@ class MajorIndexFetcher:
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_index_date ON index_data(index_name, date)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_date ON index_data(date)')
             
+            # 创建周线/月线/季线聚合表
+            init_bar_tables(conn, "index")
+            
+            # 创建技术指标表和收益率派生表
+            init_indicator_tables(conn, "index")
+            init_returns_table(conn, "index")
+            
+            # 创建数据版本表（用于查询缓存失效）
+            init_version_table(conn)
+            
             conn.commit()
             conn.close()
             
@@ -392,6 +410,15 @@ class MajorIndexFetcher:
                 VALUES (?, ?, ?, ?)
             ''', (index_name, symbol, market, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
             
+            # 增量更新受影响周期的周线/月线/季线，并递推技术指标和收益率/净值
+            if not df_save.empty:
+                update_bars(conn, "index", index_name, df_save['date'].min())
+                update_indicators(conn, "index", index_name, df_save['date'].min())
+                update_returns(conn, "index", index_name, df_save['date'].min())
+            
+            # 递增数据版本号，使查询缓存失效
+            bump_data_version(conn, [index_name])
+            
             conn.commit()
             conn.close()
             
@@ -554,8 +581,8 @@ class MajorIndexFetcher:
         except Exception as e:
             self.logger.error(f"❌ 保存报告失败: {str(e)}")
     
-    def export_to_csv(self, split_by_index=True):
-        """导出数据为CSV格式"""
+    def export_to_csv(self, split_by_index=True, compression=None, chunk_rows=DEFAULT_CHUNK_ROWS):
+        """导出数据为CSV格式（单文件导出为流式写入，可选gzip/zstd压缩）"""
         try:
             self.logger.info("\n📤 开始导出CSV文件...")
             
@@ -566,35 +593,50 @@ class MajorIndexFetcher:
                 csv_dir = os.path.join(self.output_dir, "csv_export")
                 os.makedirs(csv_dir, exist_ok=True)
                 
-                # 获取所有指数列表
-                cursor = conn.cursor()
-                cursor.execute("SELECT DISTINCT index_name FROM index_data")
-                indices = [row[0] for row in cursor.fetchall()]
+                # 指数数量少，串行导出即可
+                stats = export_groups_parallel(
+                    self.db_path, "index_data", "index_name", csv_dir,
+                    workers=1, compression=compression, chunk_rows=chunk_rows
+                )
                 
-                for index_name in indices:
-                    df = pd.read_sql(
-                        "SELECT * FROM index_data WHERE index_name = ? ORDER BY date",
-                        conn, params=(index_name,)
-                    )
-                    
-                    filename = os.path.join(csv_dir, f"{index_name}.csv")
-                    df.to_csv(filename, index=False, encoding='utf-8-sig')
+                for index_name, rows, filename in stats['results']:
                     self.logger.info(f"  ✅ {index_name}: {filename}")
                 
                 self.logger.info(f"📁 CSV文件已保存到: {csv_dir}")
                 
             else:
-                # 导出到单个文件
-                df = pd.read_sql("SELECT * FROM index_data ORDER BY index_name, date", conn)
+                # 流式导出到单个文件
                 filename = os.path.join(self.output_dir, "all_indices_data.csv")
-                df.to_csv(filename, index=False, encoding='utf-8-sig')
-                self.logger.info(f"📁 所有数据已保存到: {filename}")
+                stats = stream_query_to_csv(
+                    conn, "SELECT * FROM index_data ORDER BY index_name, date", filename,
+                    chunk_rows=chunk_rows, compression=compression
+                )
+                self.logger.info(f"📁 所有数据已保存到: {stats['path']} "
+                                 f"({stats['rows']:,} 行, {stats['rows_per_sec']:,.0f} 行/秒)")
             
             conn.close()
             
         except Exception as e:
             self.logger.error(f"❌ 导出CSV失败: {str(e)}")
     
+    def export_to_columnar(self, file_format="parquet", compression="zstd"):
+        """导出全部指数数据为Parquet或Feather文件"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            filename = os.path.join(self.output_dir, "all_indices_data")
+            stats = stream_query_to_columnar(
+                conn, "SELECT * FROM index_data ORDER BY index_name, date", filename,
+                file_format=file_format, compression=compression
+            )
+            conn.close()
+            
+            self.logger.info(f"📁 所有数据已保存到: {stats['path']}")
+            return stats['path']
+            
+        except Exception as e:
+            self.logger.error(f"❌ 导出{file_format}失败: {str(e)}")
+            return None
+    
     def query_index_data(self, index_name, start_date=None, end_date=None):
         """查询指定指数的数据"""
         try:
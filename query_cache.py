@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+查询结果缓存
+按内存大小限制的LRU缓存 + 数据版本号：数据入库时按股票/指数递增版本号，
+缓存键包含版本号，新数据写入后旧缓存自动失效
+"""
+
+import os
+import sys
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+import pandas as pd
+
+# 每次入库都会递增的全局版本键
+GLOBAL_VERSION_KEY = "*"
+
+# stock_info 表的版本键（股票列表/名称变化）
+STOCK_INFO_VERSION_KEY = "__stock_info__"
+
+# 数据库中K线的复权方式（下载时使用前复权）
+STORED_ADJUST = "qfq"
+
+# 默认缓存上限 256MB
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def init_version_table(conn: sqlite3.Connection):
+    """创建数据版本表"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            key TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        )
+    """)
+
+
+def bump_data_version(conn: sqlite3.Connection, keys: Iterable[str]):
+    """递增指定股票/指数（以及全局）的数据版本号，由入库流程调用（调用方负责提交）"""
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    keys = set(keys)
+    keys.add(GLOBAL_VERSION_KEY)
+
+    init_version_table(conn)
+    conn.executemany("""
+        INSERT INTO data_version (key, version, updated_at) VALUES (?, 1, ?)
+        ON CONFLICT(key) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at
+    """, [(key, now) for key in keys])
+
+
+class DataVersionTracker:
+    """数据版本号读取器
+
+    数据库文件（含WAL）的修改时间和大小未变化时直接使用内存中的版本快照，
+    只有文件变化时才重新读取 data_version 表。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._signature = None
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _file_signature(self) -> tuple:
+        signature = []
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def refresh(self) -> Set[str]:
+        """检查数据库是否变化，返回版本号发生变化的键"""
+        signature = self._file_signature()
+
+        with self._lock:
+            if signature == self._signature:
+                return set()
+
+            try:
+                conn = sqlite3.connect(self.db_path)
+                rows = conn.execute("SELECT key, version FROM data_version").fetchall()
+                conn.close()
+            except sqlite3.Error:
+                rows = []
+
+            versions = dict(rows)
+            changed = {key for key in set(versions) | set(self._versions)
+                       if versions.get(key) != self._versions.get(key)}
+
+            self._versions = versions
+            self._signature = signature
+            return changed
+
+    def get(self, key: str) -> int:
+        """获取某个股票/指数的当前数据版本号"""
+        self.refresh()
+        return self._versions.get(key, 0)
+
+
+def estimate_size(value: Any) -> int:
+    """估算缓存对象占用的字节数"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None:
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """按字节数限制的线程安全LRU缓存"""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Any) -> Optional[Any]:
+        """读取缓存，未命中返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Any, value: Any, size: int = None):
+        """写入缓存，超出上限时淘汰最久未使用的条目"""
+        size = estimate_size(value) if size is None else size
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_load(self, key: Any, loader: Callable[[], Any]) -> Any:
+        """命中则返回缓存，否则调用loader加载并写入缓存"""
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def invalidate(self, predicate: Callable[[Any], bool]) -> int:
+        """删除满足条件的缓存键，返回删除数量"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                _, size = self._entries.pop(key)
+                self._bytes -= size
+            return len(keys)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计: 命中/未命中/淘汰次数、条目数、占用字节"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class VersionedQueryCache:
+    """带数据版本号的查询缓存
+
+    缓存键为 (命名空间, 股票/指数, 查询参数..., 版本号)；检测到版本变化时
+    主动清除对应股票/指数的旧条目。
+    """
+
+    def __init__(self, db_path: str, max_bytes: int = DEFAULT_CACHE_BYTES,
+                 cache: Optional[LRUCache] = None):
+        """
+        Args:
+            db_path: 版本号所在的数据库
+            max_bytes: 缓存上限（未传入共享cache时使用）
+            cache: 可与其他数据库共享的LRU缓存实例
+        """
+        self.versions = DataVersionTracker(db_path)
+        self.cache = cache if cache is not None else LRUCache(max_bytes)
+
+    def _make_key(self, namespace: str, key_value: str, params: tuple) -> tuple:
+        changed = self.versions.refresh()
+        if changed:
+            self.cache.invalidate(lambda key: key[1] in changed)
+
+        return (namespace, key_value) + tuple(params) + (self.versions.get(key_value),)
+
+    def get(self, namespace: str, key_value: str, params: tuple) -> Optional[Any]:
+        """读取缓存，未命中返回None"""
+        return self.cache.get(self._make_key(namespace, key_value, params))
+
+    def put(self, namespace: str, key_value: str, params: tuple, value: Any):
+        """写入缓存"""
+        self.cache.put(self._make_key(namespace, key_value, params), value)
+
+    def get_or_load(self, namespace: str, key_value: str, params: tuple,
+                    loader: Callable[[], Any]) -> Any:
+        """按 (命名空间, 键, 参数, 当前版本号) 读取或加载缓存"""
+        return self.cache.get_or_load(self._make_key(namespace, key_value, params), loader)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+收益率派生表
+为 kline_data / index_data 维护逐K线的 简单收益率、对数收益率、累计净值、历史最高净值和回撤，
+新数据入库时从上一条记录的净值和最高净值递推，只计算新增部分。
+标准化对比（基期=100）即 nav / 基期nav × 100
+"""
+
+import os
+import sqlite3
+import logging
+
+import numpy as np
+import pandas as pd
+
+from bar_aggregator import BAR_SOURCES
+
+logger = logging.getLogger(__name__)
+
+# 数据源 -> 收益率表
+RETURNS_TABLES = {
+    "kline": "kline_returns",
+    "index": "index_returns",
+}
+
+RETURNS_COLUMNS = ["ret", "log_ret", "nav", "peak", "drawdown"]
+
+
+def init_returns_table(conn: sqlite3.Connection, source: str = "kline"):
+    """创建收益率派生表"""
+    key = BAR_SOURCES[source]["key"]
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {RETURNS_TABLES[source]} (
+            {key} TEXT,
+            date TEXT,
+            ret REAL,
+            log_ret REAL,
+            nav REAL,
+            peak REAL,
+            drawdown REAL,
+            PRIMARY KEY ({key}, date)
+        )
+    """)
+
+
+def has_returns_table(conn: sqlite3.Connection, source: str = "kline", schema: str = "main") -> bool:
+    """数据库中是否已有收益率表（旧数据库可能尚未回填）"""
+    row = conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+        (RETURNS_TABLES[source],)
+    ).fetchone()
+    return row is not None
+
+
+def compute_returns(close: np.ndarray, prev_close: float = None, prev_nav: float = 1.0,
+                    prev_peak: float = None) -> pd.DataFrame:
+    """由收盘价序列计算收益率、净值、最高净值和回撤
+
+    收盘价缺失（NULL）的K线沿用上一个收盘价（当日收益率为0），下一根K线的收益率
+    相对该收盘价计算，净值始终等于 收盘价 / 基期收盘价。
+
+    Args:
+        close: 按日期排序的收盘价
+        prev_close: 序列之前最后一根有效K线的收盘价，None 表示从第一根K线开始
+                    （首个有效收盘价的收益率为0、净值为1，之前缺失的K线为NaN）
+        prev_nav: 之前最后一根K线的净值
+        prev_peak: 之前的历史最高净值
+    """
+    close = pd.Series(close, dtype=np.float64)
+    if prev_close is not None:
+        close = pd.concat([pd.Series([prev_close], dtype=np.float64), close], ignore_index=True)
+    close = close.ffill().to_numpy()
+
+    first_valid = np.flatnonzero(~np.isnan(close))
+    base = close[first_valid[0]] if len(first_valid) else np.nan
+    # 前收只在首个有效收盘价及之前缺失，以基期收盘价代替
+    previous = np.concatenate([[np.nan], close[:-1]])
+    previous[np.isnan(previous)] = base
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ret = close / previous - 1
+        log_ret = np.log(close / previous)
+        nav = prev_nav * close / base
+
+    if prev_close is not None:
+        ret, log_ret, nav = ret[1:], log_ret[1:], nav[1:]
+
+    peak = np.fmax.accumulate(nav)
+    if prev_peak is not None:
+        peak = np.fmax(peak, prev_peak)
+
+    return pd.DataFrame({
+        "ret": ret,
+        "log_ret": log_ret,
+        "nav": nav,
+        "peak": peak,
+        "drawdown": nav / peak - 1,
+    })
+
+
+def update_returns(conn: sqlite3.Connection, source: str, key_value: str,
+                   since_date: str = None) -> int:
+    """重算某个股票/指数 since_date 及之后的收益率（调用方负责提交）
+
+    从 since_date 之前最后一条记录的收盘价、净值、最高净值递推；
+    没有更早记录或未指定 since_date 时全量计算。
+
+    Returns:
+        写入的行数
+    """
+    spec = BAR_SOURCES[source]
+    key = spec["key"]
+    table = RETURNS_TABLES[source]
+
+    prev = None
+    if since_date:
+        prev = conn.execute(f"""
+            SELECT d.date, d.close, r.nav, r.peak
+            FROM {spec['table']} d
+            JOIN {table} r ON r.{key} = d.{key} AND r.date = d.date
+            WHERE d.{key} = ? AND d.date < ? AND d.close IS NOT NULL
+            ORDER BY d.date DESC LIMIT 1
+        """, (key_value, since_date)).fetchone()
+
+    if prev:
+        rows = conn.execute(
+            f"SELECT date, close FROM {spec['table']} WHERE {key} = ? AND date > ? ORDER BY date",
+            (key_value, prev[0])
+        ).fetchall()
+        conn.execute(f"DELETE FROM {table} WHERE {key} = ? AND date > ?", (key_value, prev[0]))
+    else:
+        rows = conn.execute(
+            f"SELECT date, close FROM {spec['table']} WHERE {key} = ? ORDER BY date",
+            (key_value,)
+        ).fetchall()
+        conn.execute(f"DELETE FROM {table} WHERE {key} = ?", (key_value,))
+
+    if not rows:
+        return 0
+
+    dates = [r[0] for r in rows]
+    if prev:
+        frame = compute_returns([r[1] for r in rows], prev[1], prev[2], prev[3])
+    else:
+        frame = compute_returns([r[1] for r in rows])
+
+    values = frame.astype(object).where(frame.notna(), None).itertuples(index=False, name=None)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {table} ({key}, date, {', '.join(RETURNS_COLUMNS)}) "
+        f"VALUES (?, ?, {', '.join('?' for _ in RETURNS_COLUMNS)})",
+        [(key_value, date) + row for date, row in zip(dates, values)]
+    )
+    return len(dates)
+
+
+def rebuild_all_returns(db_path: str, source: str = "kline") -> int:
+    """全量重算某个数据库的收益率表（用于已有数据库的首次回填）"""
+    spec = BAR_SOURCES[source]
+    conn = sqlite3.connect(db_path)
+    written = 0
+    try:
+        init_returns_table(conn, source)
+        keys = [r[0] for r in conn.execute(f"SELECT DISTINCT {spec['key']} FROM {spec['table']}")]
+        for i, key_value in enumerate(keys, 1):
+            written += update_returns(conn, source, key_value)
+            if i % 500 == 0:
+                conn.commit()
+                logger.info(f"{db_path}: 收益率进度 {i}/{len(keys)}")
+        conn.commit()
+    finally:
+        conn.close()
+
+    logger.info(f"{db_path}: 已计算 {written} 行收益率")
+    return written
+
+
+def main():
+    """主函数 - 为已有数据库回填收益率派生表"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    print("🚀 收益率派生表计算工具")
+    print("=" * 50)
+
+    targets = [
+        ("output/kline_data/a_share_klines.db", "kline"),
+        ("output/index_data/major_indices.db", "index"),
+    ]
+
+    for db_path, source in targets:
+        if not os.path.exists(db_path):
+            print(f"⚠️ 数据库不存在，跳过: {db_path}")
+            continue
+
+        print(f"🔄 正在计算: {db_path}")
+        written = rebuild_all_returns(db_path, source)
+        print(f"✅ 完成: {written:,} 行收益率")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,15 @@ $(document).ready(function() {
     let indicesData = [];
     let isLoading = false;
     
+    // 图表响应缓存：请求体 -> {etag, response}，重复请求携带 If-None-Match，未变化时服务器返回304
+    const chartResponses = new Map();
+    const CHART_RESPONSE_LIMIT = 20;
+    
+    // 当前图表的请求参数（缩放时在此基础上附加可视范围重新请求）
+    let currentChartRequest = null;
+    let zoomTimer = null;
+    let zoomSequence = 0;
+    
     // 初始化应用
     initializeApp();
     
@@ -241,14 +250,9 @@ $(document).ready(function() {
         // 显示加载占位符
         showLoadingChart();
         
-        $.ajax({
-            url: '/api/chart',
-            method: 'POST',
-            contentType: 'application/json',
-            data: JSON.stringify(formData),
-            timeout: 30000 // 30秒超时
-        }).done(function(response) {
+        requestChart(formData).done(function(response) {
             if (response.success) {
+                currentChartRequest = formData;
                 displayChart(response.chart);
                 updateChartInfo(response.stock_count, response.index_name);
                 updateStatus(`图表生成成功 (${response.stock_count}只股票)`, false);
@@ -270,6 +274,88 @@ $(document).ready(function() {
         });
     }
     
+    /**
+     * 请求图表数据，携带已缓存响应的ETag，服务器返回304时使用缓存
+     */
+    function requestChart(formData) {
+        const requestBody = JSON.stringify(formData);
+        const cachedChart = chartResponses.get(requestBody);
+        
+        return $.ajax({
+            url: '/api/chart',
+            method: 'POST',
+            contentType: 'application/json',
+            data: requestBody,
+            headers: cachedChart ? { 'If-None-Match': cachedChart.etag } : {},
+            timeout: 30000 // 30秒超时
+        }).then(function(response, status, xhr) {
+            if (xhr.status === 304 && cachedChart) {
+                return cachedChart.response;
+            }
+            rememberChartResponse(requestBody, xhr.getResponseHeader('ETag'), response);
+            return response;
+        });
+    }
+    
+    /**
+     * 缩放/平移后只请求可视范围内的数据（服务器按像素宽度降采样，范围足够小时即为完整数据），
+     * 双击重置时恢复整体视图
+     */
+    function handleChartRelayout(event) {
+        if (!currentChartRequest) {
+            return;
+        }
+        
+        let range = null;
+        if (event['xaxis.range[0]'] !== undefined && event['xaxis.range[1]'] !== undefined) {
+            range = [event['xaxis.range[0]'], event['xaxis.range[1]']];
+        } else if (event['xaxis.range']) {
+            range = event['xaxis.range'];
+        } else if (!event['xaxis.autorange']) {
+            return;
+        }
+        
+        clearTimeout(zoomTimer);
+        zoomTimer = setTimeout(function() {
+            const sequence = ++zoomSequence;
+            const formData = Object.assign({}, currentChartRequest);
+            if (range) {
+                formData.view_start = String(range[0]).slice(0, 10);
+                formData.view_end = String(range[1]).slice(0, 10);
+            }
+            
+            requestChart(formData).done(function(response) {
+                // 只应用最后一次缩放的结果
+                if (sequence !== zoomSequence || !response.success) {
+                    return;
+                }
+                
+                const chartData = parseChart(response.chart);
+                chartData.layout.dragmode = 'pan';
+                if (range) {
+                    chartData.layout.xaxis.range = range;
+                    chartData.layout.xaxis.autorange = false;
+                }
+                Plotly.react('plotlyChart', chartData.data, chartData.layout);
+            });
+        }, 300);
+    }
+    
+    /**
+     * 记录带ETag的图表响应（超过上限时淘汰最早的记录）
+     */
+    function rememberChartResponse(requestBody, etag, response) {
+        if (!etag || !response.success) {
+            return;
+        }
+        
+        chartResponses.delete(requestBody);
+        chartResponses.set(requestBody, { etag: etag, response: response });
+        if (chartResponses.size > CHART_RESPONSE_LIMIT) {
+            chartResponses.delete(chartResponses.keys().next().value);
+        }
+    }
+    
     /**
      * 收集表单数据
      */
@@ -278,8 +364,12 @@ $(document).ready(function() {
             stocks: $('#stockSelect').val() || ['sh600519'],
             index: $('#indexSelect').val() || '上证指数',
             normalize: $('#normalizeCheck').is(':checked'),
+            timeframe: $('#timeframeSelect').val() || 'daily',
+            indicators: $('.indicator-check:checked').map(function() { return this.value; }).get(),
             start_date: $('#startDate').val() || null,
-            end_date: $('#endDate').val() || null
+            end_date: $('#endDate').val() || null,
+            width: Math.round($('#plotlyChart').parent().width() || 1200),
+            binary: true  // 曲线数据以类型化数组传输（Plotly.js 2.28+ 直接解码）
         };
     }
     
@@ -302,7 +392,7 @@ $(document).ready(function() {
      */
     function displayChart(chartJson) {
         try {
-            const chartData = JSON.parse(chartJson);
+            const chartData = parseChart(chartJson);
             
             // 确保图表容器可见
             $('#initialMessage').hide();
@@ -331,6 +421,11 @@ $(document).ready(function() {
                 }
             });
             
+            // 缩放后按可视范围重新请求数据
+            const chartDiv = document.getElementById('plotlyChart');
+            chartDiv.removeAllListeners('plotly_relayout');
+            chartDiv.on('plotly_relayout', handleChartRelayout);
+            
             console.log('✅ 图表渲染成功');
             
         } catch (error) {
@@ -340,6 +435,13 @@ $(document).ready(function() {
         }
     }
     
+    /**
+     * 图表数据：二进制模式为 {data, layout} 对象，JSON模式为 fig.to_json() 字符串
+     */
+    function parseChart(chart) {
+        return typeof chart === 'string' ? JSON.parse(chart) : chart;
+    }
+    
     /**
      * 显示加载图表
      */
@@ -375,6 +477,8 @@ $(document).ready(function() {
         
         // 重置复选框和日期
         $('#normalizeCheck').prop('checked', false);
+        $('#timeframeSelect').val('daily');
+        $('.indicator-check').prop('checked', false);
         $('#startDate').val('');
         $('#endDate').val('');
         
@@ -443,43 +547,6 @@ $(document).ready(function() {
         }
     }
     
-    /**
-     * 简单的拼音首字母匹配函数
-     */
-    function matchPinyinInitials(text, searchTerm) {
-        // 简单的拼音首字母映射（常用汉字）
-        const pinyinMap = {
-            '上': 's', '海': 'h', '电': 'd', '力': 'l', '贵': 'g', '州': 'z', '茅': 'm', '台': 't',
-            '中': 'z', '国': 'g', '银': 'y', '行': 'x', '工': 'g', '商': 's', '农': 'n', '业': 'y',
-            '建': 'j', '设': 's', '交': 'j', '通': 't', '民': 'm', '生': 's', '招': 'z', '发': 'f',
-            '展': 'z', '万': 'w', '科': 'k', '技': 'j', '华': 'h', '为': 'w', '联': 'l', '想': 'x',
-            '京': 'j', '东': 'd', '阿': 'a', '里': 'l', '巴': 'b', '腾': 't', '讯': 'x', '美': 'm',
-            '团': 't', '滴': 'd', '出': 'c', '安': 'a', '全': 'q', '保': 'b', '险': 'x', '平': 'p',
-            '五': 'w', '粮': 'l', '液': 'y', '泸': 'l', '老': 'l', '窖': 'j', '剑': 'j', '南': 'n',
-            '春': 'c', '药': 'y', '恒': 'h', '瑞': 'r', '医': 'y', '迈': 'm', '宝': 'b', '能': 'n',
-            '源': 'y', '新': 'x', '光': 'g', '伏': 'f', '钢': 'g', '铁': 't', '有': 'y', '色': 's',
-            '金': 'j', '属': 's', '煤': 'm', '炭': 't', '石': 's', '油': 'y', '化': 'h', '环': 'h',
-            '境': 'j', '水': 's', '务': 'w', '食': 's', '品': 'p', '饮': 'y', '料': 'l', '纺': 'f',
-            '织': 'z', '服': 'f', '装': 'z', '家': 'j', '具': 'j', '电': 'd', '器': 'q', '汽': 'q',
-            '车': 'c', '航': 'h', '空': 'k', '运': 'y', '输': 's', '港': 'g', '口': 'k', '机': 'j',
-            '场': 'c', '房': 'f', '地': 'd', '产': 'c', '建': 'j', '筑': 'z', '材': 'c', '装': 'z',
-            '修': 'x', '通': 't', '信': 'x', '计': 'j', '算': 's', '软': 'r', '件': 'j', '互': 'h',
-            '联': 'l', '网': 'w', '传': 'c', '媒': 'm', '文': 'w', '化': 'h', '教': 'j', '育': 'y',
-            '旅': 'l', '游': 'y', '酒': 'j', '店': 'd', '餐': 'c', '饮': 'y', '零': 'l', '售': 's'
-        };
-        
-        // 生成拼音首字母
-        let initials = '';
-        for (let char of text) {
-            if (pinyinMap[char]) {
-                initials += pinyinMap[char];
-            }
-        }
-        
-        // 检查是否匹配
-        return initials.includes(searchTerm);
-    }
-    
     /**
      * 工具函数：格式化数字
      */
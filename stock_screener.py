@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+条件选股引擎
+用简单的表达式描述选股条件，在最近N个交易日的全市场面板上按列向量化计算，例如:
+
+    close > ma(close, 250) and volume > 3 * ma(volume, 20) and market == '创业板'
+
+表达式语法（Python表达式子集，只允许白名单内的字段和函数）:
+    字段: open high low close volume amount pct_change（行情，按日期×股票）
+          symbol name market（股票信息）
+    函数: ma(x, n) ema(x, n) std(x, n) sum(x, n) hhv(x, n) llv(x, n) ref(x, n)
+          abs(x) max(a, b) min(a, b)
+    运算: + - * / 比较 and or not & | ~  in / not in（如 market in ['创业板', '科创板']，'ST' in name）
+条件取面板最后一个交易日的值；面板按数据版本号缓存，入库后自动重新加载。
+"""
+
+import ast
+import sqlite3
+import threading
+import logging
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from query_cache import DataVersionTracker, GLOBAL_VERSION_KEY
+
+logger = logging.getLogger(__name__)
+
+# 面板默认交易日数（覆盖250日均线）
+DEFAULT_PANEL_DAYS = 260
+
+# 单个窗口参数上限和整个表达式的回看交易日上限（限制Web请求可加载的面板大小）
+MAX_WINDOW = 500
+MAX_LOOKBACK_DAYS = 1000
+
+# 行情字段（日期 × 股票 数组）
+PRICE_FIELDS = ("open", "high", "low", "close", "volume", "amount")
+
+# 股票信息字段（每只股票一个值）
+INFO_FIELDS = ("symbol", "name", "market")
+
+# 滚动窗口函数 -> 需要的回看长度（不含窗口本身）
+WINDOW_FUNCTIONS = ("ma", "ema", "std", "sum", "hhv", "llv")
+
+ELEMENT_FUNCTIONS = {"abs": 1, "max": 2, "min": 2}
+
+COMPARE_OPS = {
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+
+BINARY_OPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.BitAnd: np.logical_and,
+    ast.BitOr: np.logical_or,
+}
+
+
+class ScreenExpressionError(ValueError):
+    """选股表达式错误"""
+
+
+def _window_arg(node: ast.Call) -> int:
+    if len(node.args) != 2 or not isinstance(node.args[1], ast.Constant) \
+            or not isinstance(node.args[1].value, int) or node.args[1].value < 1:
+        raise ScreenExpressionError(f"{node.func.id}() 的第二个参数必须是正整数")
+    if node.args[1].value > MAX_WINDOW:
+        raise ScreenExpressionError(f"{node.func.id}() 的窗口不能超过 {MAX_WINDOW}")
+    return node.args[1].value
+
+
+def parse_expression(expression: str) -> ast.Expression:
+    """解析并校验表达式，只允许白名单内的语法"""
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ScreenExpressionError(f"表达式语法错误: {e.msg}")
+
+    allowed = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub,
+               ast.Invert, ast.BinOp, ast.Compare, ast.In, ast.NotIn, ast.Call, ast.Name,
+               ast.Load, ast.Constant, ast.List, ast.Tuple,
+               *COMPARE_OPS, *BINARY_OPS)
+
+    function_names = {id(node.func) for node in ast.walk(tree) if isinstance(node, ast.Call)}
+
+    for node in ast.walk(tree):
+        if not isinstance(node, allowed):
+            raise ScreenExpressionError(f"不支持的语法: {type(node).__name__}")
+        if isinstance(node, ast.Name) and id(node) not in function_names \
+                and node.id not in PRICE_FIELDS + INFO_FIELDS + ("pct_change",):
+            raise ScreenExpressionError(f"未知字段: {node.id}")
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.keywords:
+                raise ScreenExpressionError("不支持的函数调用")
+            name = node.func.id
+            if name in WINDOW_FUNCTIONS or name == "ref":
+                _window_arg(node)
+            elif name in ELEMENT_FUNCTIONS:
+                if len(node.args) != ELEMENT_FUNCTIONS[name]:
+                    raise ScreenExpressionError(f"{name}() 需要 {ELEMENT_FUNCTIONS[name]} 个参数")
+            else:
+                raise ScreenExpressionError(f"未知函数: {name}")
+        if isinstance(node, ast.Constant) and not isinstance(node.value, (int, float, str)):
+            raise ScreenExpressionError(f"不支持的常量: {node.value!r}")
+
+    if lookback_days(tree) > MAX_LOOKBACK_DAYS:
+        raise ScreenExpressionError(f"表达式需要的历史数据不能超过 {MAX_LOOKBACK_DAYS} 个交易日")
+
+    return tree
+
+
+def lookback_days(node: ast.AST) -> int:
+    """表达式在最后一个交易日取值所需的历史交易日数（不含当天）"""
+    if isinstance(node, ast.Expression):
+        return lookback_days(node.body)
+    if isinstance(node, ast.Name):
+        return 1 if node.id == "pct_change" else 0
+    if isinstance(node, ast.Call):
+        name = node.func.id
+        inner = lookback_days(node.args[0])
+        if name in WINDOW_FUNCTIONS:
+            return inner + _window_arg(node) - 1
+        if name == "ref":
+            return inner + _window_arg(node)
+    return max((lookback_days(child) for child in ast.iter_child_nodes(node)), default=0)
+
+
+class ScreenPanel:
+    """最近N个交易日的全市场面板: 行情字段为 日期 × 股票 的float64数组"""
+
+    def __init__(self, dates: np.ndarray, symbols: np.ndarray, fields: dict, info: dict):
+        self.dates = dates
+        self.symbols = symbols
+        self.fields = fields
+        self.info = info
+
+    @property
+    def days(self) -> int:
+        return len(self.dates)
+
+
+def load_screen_panel(conn: sqlite3.Connection, days: int = DEFAULT_PANEL_DAYS) -> ScreenPanel:
+    """读取最近 days 个交易日的全市场面板（单次按日期范围查询）"""
+    dates = [r[0] for r in conn.execute(
+        "SELECT DISTINCT date FROM kline_data ORDER BY date DESC LIMIT ?", (days,)
+    )]
+    dates.reverse()
+
+    df = pd.read_sql_query(
+        f"SELECT symbol, date, {', '.join(PRICE_FIELDS)} FROM kline_data WHERE date >= ?",
+        conn, params=[dates[0] if dates else ""]
+    )
+    info = pd.read_sql_query("SELECT symbol, name, market FROM stock_info", conn)
+
+    date_codes = pd.Index(dates).get_indexer(df["date"])
+    symbol_codes, symbols = pd.factorize(df["symbol"], sort=True)
+
+    fields = {}
+    for field in PRICE_FIELDS:
+        array = np.full((len(dates), len(symbols)), np.nan)
+        array[date_codes, symbol_codes] = df[field].to_numpy(dtype=np.float64)
+        fields[field] = array
+
+    info = info.set_index("symbol").reindex(symbols)
+    info_arrays = {
+        "symbol": np.asarray(symbols, dtype=object),
+        "name": info["name"].fillna(pd.Series(symbols, index=symbols)).to_numpy(dtype=object),
+        "market": info["market"].fillna("").to_numpy(dtype=object),
+    }
+
+    return ScreenPanel(np.array(dates), np.asarray(symbols, dtype=object), fields, info_arrays)
+
+
+class _Evaluator:
+    """在面板上对表达式树求值，行情字段为 日期 × 股票 数组，信息字段为 1 × 股票 数组"""
+
+    def __init__(self, panel: ScreenPanel):
+        self.panel = panel
+
+    def eval(self, node):
+        method = getattr(self, f"_eval_{type(node).__name__}")
+        return method(node)
+
+    def _eval_Expression(self, node):
+        return self.eval(node.body)
+
+    def _eval_Constant(self, node):
+        return node.value
+
+    def _eval_List(self, node):
+        return [self.eval(e) for e in node.elts]
+
+    _eval_Tuple = _eval_List
+
+    def _eval_Name(self, node):
+        if node.id in self.panel.fields:
+            return self.panel.fields[node.id]
+        if node.id == "pct_change":
+            close = self.panel.fields["close"]
+            change = np.full_like(close, np.nan)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                change[1:] = (close[1:] / close[:-1] - 1) * 100
+            return change
+        return self.panel.info[node.id][None, :]
+
+    def _eval_BoolOp(self, node):
+        op = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        result = self._as_bool(self.eval(node.values[0]))
+        for value in node.values[1:]:
+            result = op(result, self._as_bool(self.eval(value)))
+        return result
+
+    def _eval_UnaryOp(self, node):
+        operand = self.eval(node.operand)
+        if isinstance(node.op, ast.USub):
+            return np.negative(operand)
+        return np.logical_not(self._as_bool(operand))
+
+    def _eval_BinOp(self, node):
+        left, right = self.eval(node.left), self.eval(node.right)
+        op = BINARY_OPS[type(node.op)]
+        if op in (np.logical_and, np.logical_or):
+            return op(self._as_bool(left), self._as_bool(right))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return op(left, right)
+
+    def _eval_Compare(self, node):
+        result = None
+        left = self.eval(node.left)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = self.eval(comparator)
+            if isinstance(op, (ast.In, ast.NotIn)):
+                value = self._contains(left, right)
+                if isinstance(op, ast.NotIn):
+                    value = np.logical_not(value)
+            else:
+                with np.errstate(invalid="ignore"):
+                    value = COMPARE_OPS[type(op)](left, right)
+            result = value if result is None else np.logical_and(result, value)
+            left = right
+        return result
+
+    def _contains(self, left, right):
+        # market in ['创业板', '科创板']
+        if isinstance(right, list):
+            return np.isin(left, right)
+        # 'ST' in name
+        if isinstance(left, str) and isinstance(right, np.ndarray):
+            return np.array([[left in str(v) for v in row] for row in right])
+        raise ScreenExpressionError("in 的右侧必须是列表或 name/symbol/market 字段")
+
+    def _eval_Call(self, node):
+        name = node.func.id
+        x = self.eval(node.args[0])
+
+        if name == "abs":
+            return np.abs(x)
+        if name in ("max", "min"):
+            op = np.fmax if name == "max" else np.fmin
+            return op(x, self.eval(node.args[1]))
+
+        n = node.args[1].value
+        frame = pd.DataFrame(np.asarray(x, dtype=np.float64))
+        if name == "ref":
+            return frame.shift(n).to_numpy()
+        if name == "ema":
+            return frame.ewm(span=n, adjust=False).mean().to_numpy()
+
+        rolling = frame.rolling(n)
+        reducer = {"ma": rolling.mean, "std": rolling.std, "sum": rolling.sum,
+                   "hhv": rolling.max, "llv": rolling.min}[name]
+        return reducer().to_numpy()
+
+    @staticmethod
+    def _as_bool(value):
+        if isinstance(value, (bool, np.bool_)) or (isinstance(value, np.ndarray) and value.dtype == bool):
+            return value
+        raise ScreenExpressionError("逻辑运算的操作数必须是条件表达式（& | 两侧的比较需加括号）")
+
+
+class StockScreener:
+    """条件选股器：缓存最近N个交易日的全市场面板，表达式按列向量化求值"""
+
+    def __init__(self, db_path: str, panel_days: int = DEFAULT_PANEL_DAYS):
+        self.db_path = db_path
+        self.panel_days = panel_days
+        self.versions = DataVersionTracker(db_path)
+        self._panel: Optional[ScreenPanel] = None
+        self._panel_version = None
+        # 面板已包含数据库中的全部交易日（请求更长历史时无需重新加载）
+        self._panel_complete = False
+        self._lock = threading.Lock()
+
+    def get_panel(self, days: int = None) -> ScreenPanel:
+        """获取面板；数据版本变化或需要更长历史时重新加载"""
+        days = max(days or 0, self.panel_days)
+        version = self.versions.get(GLOBAL_VERSION_KEY)
+
+        with self._lock:
+            if self._panel is None or self._panel_version != version \
+                    or (self._panel.days < days and not self._panel_complete):
+                conn = sqlite3.connect(self.db_path)
+                try:
+                    self._panel = load_screen_panel(conn, days)
+                finally:
+                    conn.close()
+                self._panel_version = version
+                self._panel_complete = self._panel.days < days
+                logger.info(f"选股面板已加载: {len(self._panel.symbols)} 只股票 × {self._panel.days} 个交易日")
+            return self._panel
+
+    def screen(self, expression: str, markets: List[str] = None, limit: int = None) -> pd.DataFrame:
+        """按表达式选股
+
+        Args:
+            expression: 选股条件表达式
+            markets: 只保留这些市场（stock_info.market），如 ['创业板']
+            limit: 最多返回条数（按成交额从大到小）
+        Returns:
+            满足条件的股票: symbol, name, market, date, close, pct_change, volume, amount
+        """
+        tree = parse_expression(expression)
+        panel = self.get_panel(lookback_days(tree) + 1)
+
+        try:
+            result = _Evaluator(panel).eval(tree)
+        except ScreenExpressionError:
+            raise
+        except (TypeError, ValueError) as e:
+            raise ScreenExpressionError(f"表达式求值失败: {e}")
+        if not isinstance(result, np.ndarray) or result.dtype != bool:
+            raise ScreenExpressionError("表达式的结果必须是条件（比较或逻辑运算）")
+
+        mask = np.broadcast_to(result, (panel.days, len(panel.symbols)))[-1].copy()
+        if markets:
+            mask &= np.isin(panel.info["market"], markets)
+
+        close = panel.fields["close"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct_change = (close[-1] / close[-2] - 1) * 100 if panel.days > 1 else np.full(close.shape[1], np.nan)
+
+        matched = pd.DataFrame({
+            "symbol": panel.symbols[mask],
+            "name": panel.info["name"][mask],
+            "market": panel.info["market"][mask],
+            "date": panel.dates[-1] if panel.days else None,
+            "close": close[-1][mask],
+            "pct_change": pct_change[mask],
+            "volume": panel.fields["volume"][-1][mask],
+            "amount": panel.fields["amount"][-1][mask],
+        })
+        matched = matched.sort_values("amount", ascending=False, ignore_index=True)
+        return matched.head(limit) if limit else matched
+
+
+def main():
+    """主函数 - 交互式条件选股"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    screener = StockScreener("output/kline_data/a_share_klines.db")
+
+    print("🚀 条件选股")
+    print("=" * 50)
+    print("示例: close > ma(close, 250) and volume > 3 * ma(volume, 20) and market == '创业板'")
+
+    while True:
+        expression = input("\n请输入选股条件 (q退出): ").strip()
+        if expression.lower() == 'q':
+            break
+        if not expression:
+            continue
+
+        try:
+            result = screener.screen(expression)
+            print(f"\n✅ 共 {len(result)} 只股票满足条件")
+            if not result.empty:
+                print(result.head(50).to_string(index=False))
+        except ScreenExpressionError as e:
+            print(f"❌ {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+股票搜索索引
+stock_info 入库时同步重建 FTS5 全文索引（trigram 分词，支持任意位置的子串匹配），
+并为每个名称生成拼音全拼和首字母列，支持 "gzmt"、"maotai" 这类输入。
+排序：代码精确匹配 > 代码前缀 > 名称精确/前缀 > 拼音首字母/全拼前缀 > bm25 相关度
+"""
+
+import re
+import sqlite3
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Sequence, Tuple
+
+from query_cache import bump_data_version, STOCK_INFO_VERSION_KEY
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypinyin import lazy_pinyin, Style
+    PYPINYIN_AVAILABLE = True
+except ImportError:
+    PYPINYIN_AVAILABLE = False
+
+# FTS5 索引表，内容存放在普通表 stock_search_keys 中（external content）
+SEARCH_TABLE = "stock_search"
+SEARCH_KEYS_TABLE = "stock_search_keys"
+
+# trigram 分词的最短匹配长度；更短的输入对 keys 列做 instr 扫描（全市场约5000行）
+TRIGRAM_MIN_LENGTH = 3
+
+# 带交易所后缀的代码（600519.SH），统一转换为 sh600519 形式
+SUFFIX_CODE_PATTERN = re.compile(r"^(\d{6})\.(sh|sz|bj)$")
+
+# 匹配优先级（数值越小越靠前，内存索引与SQL排序一致）
+RANK_EXACT_CODE = 0
+RANK_CODE_PREFIX = 1
+RANK_EXACT_NAME = 2
+RANK_NAME_PREFIX = 3
+RANK_INITIALS_PREFIX = 4
+RANK_PINYIN_PREFIX = 5
+RANK_SUBSTRING = 6
+
+
+def init_search_table(conn: sqlite3.Connection):
+    """创建搜索索引表
+
+    stock_search_keys 保存代码、名称、拼音及其小写拼接列 keys；
+    stock_search 是建立在其上的 FTS5 trigram 索引（code 只用于排序，不参与分词）。
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SEARCH_KEYS_TABLE} (
+            id INTEGER PRIMARY KEY,
+            symbol TEXT UNIQUE,
+            code TEXT,
+            name TEXT,
+            pinyin TEXT,
+            initials TEXT,
+            keys TEXT
+        )
+    """)
+    conn.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+            symbol, name, pinyin, initials,
+            content = '{SEARCH_KEYS_TABLE}', content_rowid = 'id',
+            tokenize = 'trigram'
+        )
+    """)
+
+
+def has_search_index(conn: sqlite3.Connection) -> bool:
+    """数据库中是否已建立搜索索引"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SEARCH_TABLE,)
+    ).fetchone()
+    return row is not None
+
+
+def name_to_pinyin(name: str) -> Tuple[str, str]:
+    """名称 -> (拼音全拼, 拼音首字母)，非汉字部分原样保留并转小写
+
+    未安装 pypinyin 时返回空字符串，搜索仍支持代码和名称。
+    """
+    if not name or not PYPINYIN_AVAILABLE:
+        return "", ""
+
+    full = "".join(lazy_pinyin(name)).lower()
+    initials = "".join(lazy_pinyin(name, style=Style.FIRST_LETTER)).lower()
+    return full, initials
+
+
+def rebuild_search_index(conn: sqlite3.Connection) -> int:
+    """由 stock_info 全量重建搜索索引（调用方负责提交）
+
+    Returns:
+        索引的股票数
+    """
+    init_search_table(conn)
+    rows = conn.execute("SELECT symbol, name FROM stock_info WHERE name IS NOT NULL").fetchall()
+
+    records = []
+    for symbol, name in rows:
+        full, initials = name_to_pinyin(name)
+        keys = "|".join((symbol, name, full, initials)).lower()
+        records.append((symbol, symbol[-6:], name, full, initials, keys))
+
+    conn.execute(f"DELETE FROM {SEARCH_KEYS_TABLE}")
+    conn.executemany(
+        f"INSERT INTO {SEARCH_KEYS_TABLE} (symbol, code, name, pinyin, initials, keys) "
+        f"VALUES (?, ?, ?, ?, ?, ?)",
+        records
+    )
+    conn.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+    return len(records)
+
+
+def normalize_query(query: str) -> str:
+    """规范化搜索词：去空白、转小写，600519.SH 转为 sh600519"""
+    query = query.strip().lower()
+    match = SUFFIX_CODE_PATTERN.match(query)
+    if match:
+        return f"{match.group(2)}{match.group(1)}"
+    return query
+
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_stocks(conn: sqlite3.Connection, query: str, limit: int = 20) -> List[Dict[str, str]]:
+    """搜索股票代码/名称/拼音，返回 [{'symbol': ..., 'name': ...}]
+
+    没有搜索索引的旧数据库退回 stock_info 上的 LIKE 查询。
+    """
+    query = normalize_query(query)
+    if not query:
+        return []
+
+    if not has_search_index(conn):
+        pattern = f"%{_escape_like(query)}%"
+        rows = conn.execute("""
+            SELECT symbol, name FROM stock_info
+            WHERE name IS NOT NULL
+              AND (symbol LIKE :pattern ESCAPE '\\' OR name LIKE :pattern ESCAPE '\\')
+            ORDER BY CASE WHEN symbol = :q OR substr(symbol, 3) = :q THEN 0
+                          WHEN name = :q THEN 1 ELSE 2 END, symbol
+            LIMIT :limit
+        """, {"pattern": pattern, "q": query, "limit": limit}).fetchall()
+        return [{"symbol": symbol, "name": name} for symbol, name in rows]
+
+    params = {
+        "q": query,
+        "prefix": f"{_escape_like(query)}%",
+        "limit": limit,
+    }
+    rank = """
+        CASE
+            WHEN k.symbol = :q OR k.code = :q THEN 0
+            WHEN k.code LIKE :prefix ESCAPE '\\' OR k.symbol LIKE :prefix ESCAPE '\\' THEN 1
+            WHEN k.name = :q THEN 2
+            WHEN k.name LIKE :prefix ESCAPE '\\' THEN 3
+            WHEN k.initials LIKE :prefix ESCAPE '\\' THEN 4
+            WHEN k.pinyin LIKE :prefix ESCAPE '\\' THEN 5
+            ELSE 6
+        END
+    """
+
+    if len(query) >= TRIGRAM_MIN_LENGTH:
+        # 整个搜索词作为短语做子串匹配，同级按 bm25 相关度排序
+        params["match"] = '"' + query.replace('"', '""') + '"'
+        sql = f"""
+            SELECT k.symbol, k.name
+            FROM {SEARCH_TABLE} s
+            JOIN {SEARCH_KEYS_TABLE} k ON k.id = s.rowid
+            WHERE {SEARCH_TABLE} MATCH :match
+            ORDER BY {rank}, bm25({SEARCH_TABLE}), k.symbol
+            LIMIT :limit
+        """
+    else:
+        sql = f"""
+            SELECT k.symbol, k.name FROM {SEARCH_KEYS_TABLE} k
+            WHERE instr(k.keys, :q) > 0
+            ORDER BY {rank}, k.symbol
+            LIMIT :limit
+        """
+
+    rows = conn.execute(sql, params).fetchall()
+    return [{"symbol": symbol, "name": name} for symbol, name in rows]
+
+
+class StockSearchIndex:
+    """内存中的股票搜索索引（Web应用启动时加载）
+
+    所有检索键（sh600519、600519、600519.sh、名称、拼音首字母、全拼）排成一个有序数组，
+    前缀查询用二分定位连续区间，不访问数据库；前缀结果不足 limit 时再在
+    所有股票拼接成的一个字符串上用 str.find 做子串查找。
+    """
+
+    def __init__(self, records: Sequence[Tuple[str, str, str, str]]):
+        """
+        Args:
+            records: [(symbol, name, pinyin, initials)]
+        """
+        records = sorted(records)
+        self.symbols = [r[0] for r in records]
+        self.names = [r[1] for r in records]
+        
+        # 子串查找语料：每只股票一行（按代码排序），_offsets 为各行起始位置
+        haystacks = ["|".join(r).lower() for r in records]
+        self._offsets = array("i", [0] * len(haystacks))
+        offset = 0
+        for i, haystack in enumerate(haystacks):
+            self._offsets[i] = offset
+            offset += len(haystack) + 1
+        self._corpus = "\n".join(haystacks)
+
+        entries = []
+        for i, (symbol, name, full, initials) in enumerate(records):
+            code = symbol[-6:]
+            entries.append((symbol, i, RANK_CODE_PREFIX))
+            entries.append((code, i, RANK_CODE_PREFIX))
+            entries.append((f"{code}.{symbol[:2]}", i, RANK_CODE_PREFIX))
+            entries.append((name.lower(), i, RANK_NAME_PREFIX))
+            if initials:
+                entries.append((initials, i, RANK_INITIALS_PREFIX))
+            if full:
+                entries.append((full, i, RANK_PINYIN_PREFIX))
+        entries.sort()
+
+        self._keys = [e[0] for e in entries]
+        self._ids = array("i", (e[1] for e in entries))
+        self._ranks = array("b", (e[2] for e in entries))
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> "StockSearchIndex":
+        """从数据库加载：优先读取已生成拼音的 stock_search_keys，否则由 stock_info 现算"""
+        if has_search_index(conn):
+            records = conn.execute(
+                f"SELECT symbol, name, pinyin, initials FROM {SEARCH_KEYS_TABLE}"
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT symbol, name FROM stock_info WHERE name IS NOT NULL"
+            ).fetchall()
+            records = [(symbol, name) + name_to_pinyin(name) for symbol, name in rows]
+        return cls(records)
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, str]]:
+        """搜索股票，返回 [{'symbol': ..., 'name': ...}]，排序规则同 search_stocks"""
+        query = normalize_query(query)
+        if not query:
+            return []
+
+        best: Dict[int, int] = {}
+        for pos in range(bisect_left(self._keys, query), len(self._keys)):
+            key = self._keys[pos]
+            if not key.startswith(query):
+                break
+
+            rank = self._ranks[pos]
+            if key == query:
+                if rank == RANK_CODE_PREFIX:
+                    rank = RANK_EXACT_CODE
+                elif rank == RANK_NAME_PREFIX:
+                    rank = RANK_EXACT_NAME
+
+            stock = self._ids[pos]
+            if rank < best.get(stock, RANK_SUBSTRING + 1):
+                best[stock] = rank
+
+        # 子串匹配同级按代码排序，语料也按代码排序，补足 limit 条即可停止
+        needed = limit - len(best)
+        found = self._corpus.find(query) if needed > 0 else -1
+        while found >= 0:
+            stock = bisect_right(self._offsets, found) - 1
+            if stock not in best:
+                best[stock] = RANK_SUBSTRING
+                needed -= 1
+            if needed == 0 or stock + 1 >= len(self._offsets):
+                break
+            found = self._corpus.find(query, self._offsets[stock + 1])
+
+        ordered = sorted(best, key=lambda stock: (best[stock], self.symbols[stock]))[:limit]
+        return [{"symbol": self.symbols[i], "name": self.names[i]} for i in ordered]
+
+
+def main():
+    """主函数 - 为已有数据库建立搜索索引"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    db_path = "output/kline_data/a_share_klines.db"
+    print("🚀 股票搜索索引")
+    print("=" * 50)
+
+    if not PYPINYIN_AVAILABLE:
+        print("⚠️ 未安装 pypinyin，将不生成拼音列（pip install pypinyin）")
+
+    conn = sqlite3.connect(db_path)
+    try:
+        count = rebuild_search_index(conn)
+        # 同一事务中递增股票信息版本号，Web服务据此重新加载内存中的搜索索引
+        bump_data_version(conn, [STOCK_INFO_VERSION_KEY])
+        conn.commit()
+    finally:
+        conn.close()
+
+    print(f"✅ 完成: 已索引 {count:,} 只股票")
+
+
+if __name__ == "__main__":
+    main()
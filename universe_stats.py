@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+全市场统计计算
+按 (symbol, date) 顺序单次流式读取 kline_data，用numpy分组归约一次性计算
+所有股票的统计指标（与 KlineDataQuery.get_stock_statistics 口径一致），
+结果写入 stock_statistics 表
+"""
+
+import sqlite3
+import logging
+from datetime import datetime
+from typing import Iterator, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from query_cache import GLOBAL_VERSION_KEY
+
+logger = logging.getLogger(__name__)
+
+STATS_TABLE = "stock_statistics"
+
+DEFAULT_STATS_CHUNK_ROWS = 200000
+
+# 统计表列 -> SQL类型
+STATS_COLUMNS = {
+    "symbol": "TEXT PRIMARY KEY",
+    "record_count": "INTEGER",
+    "start_date": "TEXT",
+    "end_date": "TEXT",
+    "last_close": "REAL",
+    "max_high": "REAL",
+    "min_low": "REAL",
+    "mean_close": "REAL",
+    "std_close": "REAL",
+    "total_volume": "INTEGER",
+    "mean_volume": "REAL",
+    "max_volume": "INTEGER",
+    "total_amount": "REAL",
+    "total_return": "REAL",
+    "annual_return": "REAL",
+    "data_version": "INTEGER",
+    "computed_at": "TEXT",
+}
+
+
+def init_stats_table(conn: sqlite3.Connection):
+    """创建统计结果表"""
+    columns = ",\n            ".join(f"{name} {sql_type}" for name, sql_type in STATS_COLUMNS.items())
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATS_TABLE} (
+            {columns}
+        )
+    """)
+
+
+def iter_symbol_batches(conn: sqlite3.Connection, fields: Sequence[str],
+                        chunk_rows: int = DEFAULT_STATS_CHUNK_ROWS,
+                        start_date: str = None, end_date: str = None) -> Iterator[dict]:
+    """按股票代码顺序分块读取 kline_data，保证每块只包含完整的股票
+
+    每次 fetchmany 后把最后一只（可能不完整的）股票留到下一块，
+    因此内存占用约为 chunk_rows 加上单只股票的行数。
+
+    Yields:
+        {'symbol': ndarray, 字段名: ndarray, ...}，按 (symbol, date) 排序
+    """
+    columns = ["symbol"] + [f for f in fields if f != "symbol"]
+    conditions, params = [], []
+    if start_date:
+        conditions.append("date >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append("date <= ?")
+        params.append(end_date)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    cursor = conn.execute(
+        f"SELECT {', '.join(columns)} FROM kline_data{where} ORDER BY symbol, date", params
+    )
+
+    carry: List[tuple] = []
+    while True:
+        rows = cursor.fetchmany(chunk_rows)
+        if not rows:
+            break
+
+        rows = carry + rows
+        last_symbol = rows[-1][0]
+        split = len(rows)
+        while split > 0 and rows[split - 1][0] == last_symbol:
+            split -= 1
+
+        # 整块都是同一只股票时继续累积
+        if split == 0:
+            carry = rows
+            continue
+
+        carry = rows[split:]
+        yield _rows_to_arrays(rows[:split], columns)
+
+    if carry:
+        yield _rows_to_arrays(carry, columns)
+
+
+def _rows_to_arrays(rows: List[tuple], columns: List[str]) -> dict:
+    values = list(zip(*rows))
+    batch = {}
+    for name, column in zip(columns, values):
+        if name in ("symbol", "date"):
+            batch[name] = np.array(column, dtype=object)
+        else:
+            batch[name] = np.array(column, dtype=np.float64)
+    return batch
+
+
+def _group_statistics(batch: dict) -> pd.DataFrame:
+    """对一块完整股票的数据做分组归约"""
+    symbols = batch["symbol"]
+    starts = np.flatnonzero(np.r_[True, symbols[1:] != symbols[:-1]])
+    ends = np.r_[starts[1:], len(symbols)] - 1
+    counts = np.diff(np.r_[starts, len(symbols)])
+
+    close = batch["close"]
+    volume = np.nan_to_num(batch["volume"])
+    amount = np.nan_to_num(batch["amount"])
+
+    # 与pandas一致：均值/标准差忽略缺失值，样本标准差 ddof=1
+    valid = ~np.isnan(close)
+    valid_count = np.add.reduceat(valid.astype(np.int64), starts)
+    close_sum = np.add.reduceat(np.where(valid, close, 0.0), starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_close = close_sum / valid_count
+        deviation = np.where(valid, close - np.repeat(mean_close, counts), 0.0)
+        std_close = np.sqrt(np.add.reduceat(deviation ** 2, starts) / (valid_count - 1))
+    std_close[valid_count < 2] = np.nan
+
+    first_close = close[starts]
+    last_close = close[ends]
+    start_dates = batch["date"][starts]
+    end_dates = batch["date"][ends]
+    days = (end_dates.astype("datetime64[D]") - start_dates.astype("datetime64[D]")).astype(np.int64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = last_close / first_close
+        total_return = np.where(counts > 1, (growth - 1) * 100, np.nan)
+        annual_return = np.where((counts > 1) & (days > 0),
+                                 (growth ** (365 / np.maximum(days, 1)) - 1) * 100, np.nan)
+
+    return pd.DataFrame({
+        "symbol": symbols[starts],
+        "record_count": counts,
+        "start_date": start_dates,
+        "end_date": end_dates,
+        "last_close": last_close,
+        "max_high": np.fmax.reduceat(batch["high"], starts),
+        "min_low": np.fmin.reduceat(batch["low"], starts),
+        "mean_close": mean_close,
+        "std_close": std_close,
+        "total_volume": np.add.reduceat(volume, starts).astype(np.int64),
+        "mean_volume": np.add.reduceat(volume, starts) / counts,
+        "max_volume": np.maximum.reduceat(volume, starts).astype(np.int64),
+        "total_amount": np.add.reduceat(amount, starts),
+        "total_return": total_return,
+        "annual_return": annual_return,
+    })
+
+
+def compute_universe_statistics(conn: sqlite3.Connection,
+                                chunk_rows: int = DEFAULT_STATS_CHUNK_ROWS) -> pd.DataFrame:
+    """单次扫描计算全部股票的统计指标"""
+    fields = ["date", "close", "high", "low", "volume", "amount"]
+    frames = [_group_statistics(batch) for batch in iter_symbol_batches(conn, fields, chunk_rows)]
+
+    if not frames:
+        return pd.DataFrame(columns=[c for c in STATS_COLUMNS if c not in ("data_version", "computed_at")])
+    return pd.concat(frames, ignore_index=True)
+
+
+def refresh_universe_statistics(db_path: str,
+                                chunk_rows: int = DEFAULT_STATS_CHUNK_ROWS) -> pd.DataFrame:
+    """重新计算全市场统计并写入 stock_statistics 表"""
+    conn = sqlite3.connect(db_path)
+    try:
+        # 在同一读事务中读取版本号和数据，保证版本号与统计结果对应
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute("SELECT version FROM data_version WHERE key = ?",
+                               (GLOBAL_VERSION_KEY,)).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        version = row[0] if row else 0
+
+        stats = compute_universe_statistics(conn, chunk_rows)
+        conn.rollback()
+
+        stats["data_version"] = version
+        stats["computed_at"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+        init_stats_table(conn)
+        conn.execute(f"DELETE FROM {STATS_TABLE}")
+        placeholders = ", ".join("?" for _ in STATS_COLUMNS)
+        conn.executemany(
+            f"INSERT INTO {STATS_TABLE} ({', '.join(STATS_COLUMNS)}) VALUES ({placeholders})",
+            stats[list(STATS_COLUMNS)].astype(object).where(stats[list(STATS_COLUMNS)].notna(), None)
+            .itertuples(index=False, name=None)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    logger.info(f"{db_path}: 已计算 {len(stats)} 只股票的统计指标")
+    return stats
+
+
+def load_universe_statistics(db_path: str) -> pd.DataFrame:
+    """读取已保存的全市场统计，表不存在时返回空DataFrame"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return pd.read_sql_query(f"SELECT * FROM {STATS_TABLE} ORDER BY symbol", conn)
+    except Exception:
+        return pd.DataFrame()
+    finally:
+        conn.close()
+
+
+def main():
+    """主函数 - 计算全市场统计"""
+    import time
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    db_path = "output/kline_data/a_share_klines.db"
+    print("🚀 全市场统计计算")
+    print("=" * 50)
+
+    start_time = time.time()
+    stats = refresh_universe_statistics(db_path)
+    print(f"✅ 完成: {len(stats):,} 只股票，耗时 {time.time() - start_time:.1f} 秒")
+
+    if not stats.empty:
+        top = stats.dropna(subset=["annual_return"]).nlargest(10, "annual_return")
+        print("\n📈 年化收益率前10:")
+        print(top[["symbol", "start_date", "end_date", "annual_return"]].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
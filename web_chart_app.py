@@ -13,8 +13,39 @@ import plotly.graph_objects as go
 import plotly.express as px
 from datetime import datetime, timedelta
 import json
+import hashlib
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from bar_aggregator import BAR_SOURCES, TIMEFRAMES
+from query_cache import (LRUCache, VersionedQueryCache, DEFAULT_CACHE_BYTES, STORED_ADJUST,
+                         GLOBAL_VERSION_KEY, STOCK_INFO_VERSION_KEY)
+from indicator_engine import INDICATORS, load_indicators
+from stock_screener import StockScreener
+from returns_engine import RETURNS_TABLES, has_returns_table
+from stock_search import StockSearchIndex
+from lazy_query import compact_frame
+from chart_downsample import lttb_indices
+from chart_payload import datetime_to_ms, encode_typed_arrays
+
+try:
+    from asgiref.sync import ThreadSensitiveContext
+    from asgiref.wsgi import WsgiToAsgi
+    ASGI_AVAILABLE = True
+except ImportError:
+    ASGI_AVAILABLE = False
+
+# 数据库读取线程池大小：股票、指数、技术指标各用独立连接并发读取（sqlite3 查询期间释放GIL）
+DB_WORKERS = 4
+
+# 降采样目标点数 = 图表像素宽度 × POINTS_PER_PIXEL（按100取整，相近宽度共用缓存），限制在上下限之间
+POINTS_PER_PIXEL = 1
+MIN_CHART_POINTS = 200
+MAX_CHART_POINTS = 4000
+
+# 图表响应缓存上限 64MB（缓存序列化后的JSON响应体）
+CHART_CACHE_BYTES = 64 * 1024 * 1024
 
 class WebChartApp:
     """Web图表应用类"""
@@ -27,9 +58,33 @@ class WebChartApp:
         self.kline_db_path = "/Users/guanjie/Desktop/cursor/longbridge/output/kline_data/a_share_klines.db"
         self.index_db_path = "/Users/guanjie/Desktop/cursor/longbridge/output/index_data/major_indices.db"
         
+        # 查询结果缓存（股票/指数共用LRU，入库后按数据版本号自动失效）
+        lru = LRUCache(DEFAULT_CACHE_BYTES)
+        self.stock_cache = VersionedQueryCache(self.kline_db_path, cache=lru)
+        self.index_cache = VersionedQueryCache(self.index_db_path, cache=lru)
+        
+        # 图表响应缓存：键为规范化请求参数 + 数据版本号的哈希，同时作为ETag
+        self.chart_cache = LRUCache(CHART_CACHE_BYTES)
+        
+        # 有界的数据库读取线程池，请求线程只等待结果
+        self.db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='chart-db')
+        
+        # 条件选股器
+        self.screener = StockScreener(self.kline_db_path)
+        
+        # 股票搜索的内存前缀索引（stock_info 版本号变化时重新加载）
+        self._search_index = None
+        self._search_index_version = None
+        
         # 检查数据库
         self.check_databases()
         
+        # 启动时预先加载搜索索引，数据库缺失时推迟到首次搜索
+        try:
+            self.get_search_index()
+        except sqlite3.Error:
+            pass
+        
         # 设置路由
         self.setup_routes()
     
@@ -57,33 +112,12 @@ class WebChartApp:
                 search = request.args.get('search', '').strip()
                 limit = int(request.args.get('limit', 100))  # 默认限制100条
                 
-                conn = sqlite3.connect(self.kline_db_path)
-                
                 if search:
-                    # 搜索模式 - 优化的搜索查询
-                    query = """
-                    SELECT si.symbol, si.name 
-                    FROM stock_info si
-                    WHERE si.name IS NOT NULL 
-                    AND (si.symbol LIKE ? OR si.name LIKE ?)
-                    ORDER BY 
-                        CASE WHEN si.symbol = ? THEN 1 ELSE 2 END,
-                        CASE WHEN si.name = ? THEN 1 ELSE 2 END,
-                        CASE 
-                            WHEN si.symbol LIKE 'sh60%' THEN 1
-                            WHEN si.symbol LIKE 'sz00%' THEN 2
-                            WHEN si.symbol LIKE 'sz30%' THEN 3
-                            WHEN si.symbol LIKE 'bj%' THEN 4
-                            ELSE 5
-                        END, si.symbol
-                    LIMIT ?
-                    """
-                    search_pattern = f"%{search}%"
-                    df = pd.read_sql_query(query, conn, params=[
-                        search_pattern, search_pattern, search, search, limit
-                    ])
+                    # 搜索模式 - 走内存搜索索引（代码/名称/拼音），不访问数据库
+                    stocks = self.get_search_index().search(search, limit)
                 else:
                     # 默认模式 - 返回热门股票
+                    conn = sqlite3.connect(self.kline_db_path)
                     query = """
                     SELECT si.symbol, si.name 
                     FROM stock_info si
@@ -100,11 +134,9 @@ class WebChartApp:
                         ELSE 5
                     END, si.symbol
                     """
-                    df = pd.read_sql_query(query, conn)
+                    stocks = pd.read_sql_query(query, conn).to_dict('records')
+                    conn.close()
                 
-                conn.close()
-                
-                stocks = df.to_dict('records')
                 return jsonify({
                     'success': True, 
                     'data': stocks,
@@ -124,40 +156,9 @@ class WebChartApp:
                 if not search:
                     return jsonify({'success': True, 'data': []})
                 
-                conn = sqlite3.connect(self.kline_db_path)
-                
-                # 优化的搜索查询 - 精确匹配优先
-                query = """
-                SELECT si.symbol, si.name,
-                       CASE 
-                           WHEN si.symbol = ? THEN 1
-                           WHEN si.symbol LIKE ? THEN 2
-                           WHEN si.name = ? THEN 3
-                           WHEN si.name LIKE ? THEN 4
-                           ELSE 5
-                       END as priority
-                FROM stock_info si
-                WHERE si.name IS NOT NULL 
-                AND (si.symbol LIKE ? OR si.name LIKE ?)
-                ORDER BY priority, si.symbol
-                LIMIT ?
-                """
-                
-                search_pattern = f"%{search}%"
-                search_start = f"{search}%"
-                
-                df = pd.read_sql_query(query, conn, params=[
-                    search, search_start, search, search_start, 
-                    search_pattern, search_pattern, limit
-                ])
+                # 内存搜索索引：代码精确匹配优先，其次前缀、名称、拼音
+                stocks = self.get_search_index().search(search, limit)
                 
-                conn.close()
-                
-                # 移除priority列
-                if 'priority' in df.columns:
-                    df = df.drop('priority', axis=1)
-                
-                stocks = df.to_dict('records')
                 return jsonify({
                     'success': True, 
                     'data': stocks,
@@ -180,6 +181,41 @@ class WebChartApp:
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)})
         
+        @self.app.route('/api/cache/stats')
+        def cache_stats():
+            """查询缓存统计"""
+            return jsonify({
+                'success': True,
+                'data': self.stock_cache.stats(),
+                'chart': self.chart_cache.stats()
+            })
+        
+        @self.app.route('/api/screen', methods=['POST'])
+        def screen_stocks():
+            """条件选股API
+            
+            请求: {"expression": "close > ma(close, 250) and volume > 3 * ma(volume, 20)",
+                   "markets": ["创业板"], "limit": 100}
+            """
+            try:
+                data = request.get_json() or {}
+                expression = (data.get('expression') or '').strip()
+                if not expression:
+                    return jsonify({'success': False, 'error': '请输入选股条件'})
+                
+                limit = int(data.get('limit') or 200)
+                result = self.screener.screen(expression, data.get('markets'), limit)
+                
+                result = result.astype(object).where(result.notna(), None)
+                return jsonify({
+                    'success': True,
+                    'data': result.to_dict('records'),
+                    'count': len(result),
+                    'date': result['date'].iloc[0] if not result.empty else None
+                })
+            except Exception as e:
+                return jsonify({'success': False, 'error': str(e)})
+        
         @self.app.route('/api/chart', methods=['POST'])
         def generate_chart():
             """生成图表"""
@@ -188,89 +224,370 @@ class WebChartApp:
                 stocks = data.get('stocks', ['sh600519'])
                 index_name = data.get('index', '上证指数')
                 normalize = data.get('normalize', False)
-                start_date = data.get('start_date')
-                end_date = data.get('end_date')
+                start_date = self._parse_date(data.get('start_date'))
+                end_date = self._parse_date(data.get('end_date'))
+                timeframe = data.get('timeframe') or 'daily'
+                indicators = data.get('indicators') or []
+                # 可视范围（缩放后重新请求该范围的完整数据）与图表像素宽度（决定降采样点数）
+                view_start = self._parse_date(data.get('view_start'))
+                view_end = self._parse_date(data.get('view_end'))
+                max_points = self.chart_points(data.get('width'))
+                # 二进制模式：曲线数据以类型化数组传输（需要 Plotly.js 2.28+）
+                binary = bool(data.get('binary', False))
+                
+                if timeframe != 'daily' and timeframe not in TIMEFRAMES:
+                    return jsonify({'success': False, 'error': f'不支持的周期: {timeframe}'})
+                
+                unknown = [name for name in indicators if name not in INDICATORS]
+                if unknown:
+                    return jsonify({'success': False, 'error': f'不支持的指标: {", ".join(unknown)}'})
+                
+                # 相同请求且数据未更新时：浏览器持有的版本直接返回304，否则返回缓存的响应体
+                etag = self.chart_cache_key({
+                    'stocks': stocks, 'index': index_name, 'normalize': normalize,
+                    'start_date': start_date, 'end_date': end_date,
+                    'timeframe': timeframe, 'indicators': indicators,
+                    'view_start': view_start, 'view_end': view_end, 'max_points': max_points,
+                    'binary': binary
+                })
+                if request.if_none_match.contains(etag):
+                    return self._chart_response(None, etag)
+                
+                cached = self.chart_cache.get(etag)
+                if cached is not None:
+                    return self._chart_response(cached, etag)
+                
+                # 只读取查询范围与可视范围的交集（日期条件在SQL中过滤）
+                load_start = max(filter(None, (start_date, view_start)), default=None)
+                load_end = min(filter(None, (end_date, view_end)), default=None)
+                
+                # 股票数据（一次批量查询）与指数数据在线程池中并发读取
+                stocks_future = self.db_executor.submit(
+                    self.get_stocks_data, stocks, timeframe, load_start, load_end
+                )
+                index_future = self.db_executor.submit(
+                    self.get_index_data, index_name, timeframe, load_start, load_end
+                )
+                stock_datasets = stocks_future.result()
+                
+                # 获取技术指标（可选叠加），各股票并发读取
+                indicator_futures = {}
+                if indicators:
+                    for stock_df in stock_datasets:
+                        symbol = stock_df['symbol'].iloc[0]
+                        indicator_futures[symbol] = self.db_executor.submit(
+                            self.get_indicator_data, symbol, timeframe, load_start, load_end
+                        )
                 
-                # 获取股票数据
-                stock_datasets = []
-                for stock_code in stocks:
-                    stock_data = self.get_stock_data(stock_code)
-                    if not stock_data.empty:
-                        stock_datasets.append(stock_data)
+                index_data = index_future.result()
+                indicator_data = {symbol: future.result() for symbol, future in indicator_futures.items()}
                 
-                # 获取指数数据
-                index_data = self.get_index_data(index_name)
+                # 标准化基期为 start_date；缩放后读取范围从 view_start 开始时，单独查询基期K线
+                base_rows = None
+                if normalize and load_start != start_date:
+                    base_rows = self.get_base_rows(
+                        [df['symbol'].iloc[0] for df in stock_datasets], index_name, timeframe, start_date
+                    )
                 
                 # 生成图表
+                # 配色按请求中的股票顺序分配，缩放后某只股票没有数据时其余股票颜色不变
                 chart_json = self.create_chart_json(
-                    stock_datasets, index_data, normalize, start_date, end_date
+                    stock_datasets, index_data, normalize, base_rows,
+                    indicators, indicator_data, max_points, binary,
+                    color_order=list(dict.fromkeys(self.validate_stock_code(s) for s in stocks))
                 )
                 
-                return jsonify({
+                body = jsonify({
                     'success': True, 
                     'chart': chart_json,
                     'stock_count': len(stock_datasets),
-                    'index_name': index_name
-                })
+                    'index_name': index_name,
+                    'timeframe': timeframe
+                }).get_data()
+                self.chart_cache.put(etag, body)
+                return self._chart_response(body, etag)
                 
             except Exception as e:
                 return jsonify({'success': False, 'error': str(e)})
     
-    def get_stock_data(self, symbol: str) -> pd.DataFrame:
-        """获取股票数据"""
-        try:
+    def chart_cache_key(self, params: dict) -> str:
+        """图表请求的缓存键（同时作为ETag）
+        
+        股票代码统一为数据库格式并去重（保留顺序，顺序决定配色），参数按键排序序列化，
+        再拼上K线库和指数库的全局数据版本号，数据入库后键自动变化。
+        """
+        params = dict(params)
+        params['stocks'] = list(dict.fromkeys(self.validate_stock_code(s) for s in params['stocks']))
+        params['normalize'] = bool(params['normalize'])
+        canonical = json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        
+        versions = (self.stock_cache.versions.get(GLOBAL_VERSION_KEY),
+                    self.index_cache.versions.get(GLOBAL_VERSION_KEY))
+        return hashlib.sha1(f"{canonical}|{versions}".encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def chart_points(width) -> int:
+        """由图表像素宽度计算每条曲线的降采样点数，未提供宽度时返回 None（不降采样）"""
+        if not width:
+            return None
+        points = int(round(float(width) * POINTS_PER_PIXEL / 100)) * 100
+        return min(max(points, MIN_CHART_POINTS), MAX_CHART_POINTS)
+    
+    def _chart_response(self, body, etag: str):
+        """带ETag的图表响应，body 为 None 时返回304"""
+        if body is None:
+            response = self.app.response_class(status=304)
+        else:
+            response = self.app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        # POST响应不会被浏览器自动缓存，由前端携带 If-None-Match 重新验证
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    def get_search_index(self) -> StockSearchIndex:
+        """获取股票搜索索引，stock_info 数据版本变化后重新加载"""
+        version = self.stock_cache.versions.get(STOCK_INFO_VERSION_KEY)
+        if self._search_index is None or version != self._search_index_version:
             conn = sqlite3.connect(self.kline_db_path)
+            try:
+                self._search_index = StockSearchIndex.load(conn)
+            finally:
+                conn.close()
+            self._search_index_version = version
+        return self._search_index
+    
+    def get_stock_data(self, symbol: str, timeframe: str = 'daily') -> pd.DataFrame:
+        """获取股票数据（timeframe: daily/weekly/monthly/quarterly）"""
+        datasets = self.get_stocks_data([symbol], timeframe)
+        return datasets[0] if datasets else pd.DataFrame()
+    
+    def get_stocks_data(self, symbols: list, timeframe: str = 'daily',
+                        start_date: str = None, end_date: str = None) -> list:
+        """批量获取多只股票数据，按传入顺序返回非空DataFrame列表
+        
+        先查缓存，未命中的股票合并为一次 IN 查询读取后写入缓存；日期范围（YYYY-MM-DD，闭区间）
+        在SQL中过滤并作为缓存键的一部分。返回的DataFrame与缓存共享，调用方不得原地修改。
+        """
+        try:
+            symbols = list(dict.fromkeys(self.validate_stock_code(s) for s in symbols))
+            # 数据中带有 stock_info 的股票名称，股票信息更新（如名称增减ST）后需重新读取
+            cache_params = (start_date, end_date, timeframe, STORED_ADJUST,
+                            self.stock_cache.versions.get(STOCK_INFO_VERSION_KEY))
             
-            # 标准化股票代码
-            symbol = self.validate_stock_code(symbol)
-            
-            query = """
-            SELECT kd.date, kd.symbol, si.name, kd.open, kd.high, kd.low, kd.close, kd.volume, kd.amount
-            FROM kline_data kd
-            LEFT JOIN stock_info si ON kd.symbol = si.symbol
-            WHERE kd.symbol = ?
-            ORDER BY kd.date
-            """
-            
-            df = pd.read_sql_query(query, conn, params=(symbol,))
-            conn.close()
+            results = {}
+            missing = []
+            for symbol in symbols:
+                cached = self.stock_cache.get('stock', symbol, cache_params)
+                if cached is None:
+                    missing.append(symbol)
+                else:
+                    results[symbol] = cached
             
-            if not df.empty:
-                df['date'] = pd.to_datetime(df['date'])
-                # 如果没有股票名称，使用symbol作为name
-                if df['name'].isna().all():
-                    df['name'] = symbol
+            if missing:
+                df = self._load_stocks_frame(missing, timeframe, start_date, end_date)
+                groups = {symbol: group.reset_index(drop=True)
+                          for symbol, group in df.groupby('symbol', sort=False, observed=True)}
+                for symbol in missing:
+                    results[symbol] = groups.get(symbol, pd.DataFrame())
+                    self.stock_cache.put('stock', symbol, cache_params, results[symbol])
             
-            return df
+            return [results[s] for s in symbols if not results[s].empty]
             
         except Exception as e:
             print(f"获取股票数据失败: {e}")
-            return pd.DataFrame()
+            return []
     
-    def get_index_data(self, index_name: str) -> pd.DataFrame:
-        """获取指数数据"""
-        try:
-            conn = sqlite3.connect(self.index_db_path)
-            
-            query = """
-            SELECT date, index_name, open, high, low, close, volume
-            FROM index_data 
-            WHERE index_name = ?
-            ORDER BY date
+    def _load_stocks_frame(self, symbols: list, timeframe: str = 'daily',
+                           start_date: str = None, end_date: str = None) -> pd.DataFrame:
+        """从数据库读取多只股票的K线数据（单次 IN 查询），附带累计净值 nav"""
+        placeholders = ', '.join('?' for _ in symbols)
+        date_filter, date_params = self._date_filter('k', start_date, end_date)
+        conn = sqlite3.connect(self.kline_db_path)
+        
+        # 周/月/季线的 date 为周期最后一个交易日，可直接关联日线净值
+        if has_returns_table(conn, "kline"):
+            nav_column = "kr.nav"
+            nav_join = "LEFT JOIN kline_returns kr ON kr.symbol = k.symbol AND kr.date = k.date"
+        else:
+            nav_column = "NULL AS nav"
+            nav_join = ""
+        
+        if timeframe == 'daily':
+            query = f"""
+            SELECT k.date, k.symbol, si.name, k.open, k.high, k.low, k.close, k.volume, k.amount, {nav_column}
+            FROM kline_data k
+            LEFT JOIN stock_info si ON k.symbol = si.symbol
+            {nav_join}
+            WHERE k.symbol IN ({placeholders}){date_filter}
+            ORDER BY k.symbol, k.date
             """
-            
-            df = pd.read_sql_query(query, conn, params=(index_name,))
-            conn.close()
-            
-            if not df.empty:
-                df['date'] = pd.to_datetime(df['date'])
-            
-            return df
-            
+            params = list(symbols) + date_params
+        else:
+            query = f"""
+            SELECT k.date, k.symbol, si.name, k.open, k.high, k.low, k.close, k.volume, k.amount, {nav_column}
+            FROM kline_bars k
+            LEFT JOIN stock_info si ON k.symbol = si.symbol
+            {nav_join}
+            WHERE k.timeframe = ? AND k.symbol IN ({placeholders}){date_filter}
+            ORDER BY k.symbol, k.date
+            """
+            params = [timeframe] + list(symbols) + date_params
+        
+        df = pd.read_sql_query(query, conn, params=params)
+        conn.close()
+        
+        if not df.empty:
+            # 如果没有股票名称，使用symbol作为name
+            df['name'] = df['name'].fillna(df['symbol'])
+            # 缓存中的数据使用紧凑列类型（float32价格、category代码/名称）
+            df = compact_frame(df)
+        
+        return df
+    
+    def get_index_data(self, index_name: str, timeframe: str = 'daily',
+                       start_date: str = None, end_date: str = None) -> pd.DataFrame:
+        """获取指数数据（timeframe: daily/weekly/monthly/quarterly），日期范围在SQL中过滤，结果带缓存"""
+        try:
+            return self.index_cache.get_or_load(
+                'index', index_name, (start_date, end_date, timeframe),
+                lambda: self._load_index_frame(index_name, timeframe, start_date, end_date)
+            )
         except Exception as e:
             print(f"获取指数数据失败: {e}")
             return pd.DataFrame()
     
+    def _load_index_frame(self, index_name: str, timeframe: str = 'daily',
+                          start_date: str = None, end_date: str = None) -> pd.DataFrame:
+        """从数据库读取指数数据，附带累计净值 nav"""
+        date_filter, date_params = self._date_filter('i', start_date, end_date)
+        conn = sqlite3.connect(self.index_db_path)
+        
+        if has_returns_table(conn, "index"):
+            nav_column = "r.nav"
+            nav_join = "LEFT JOIN index_returns r ON r.index_name = i.index_name AND r.date = i.date"
+        else:
+            nav_column = "NULL AS nav"
+            nav_join = ""
+        
+        if timeframe == 'daily':
+            query = f"""
+            SELECT i.date, i.index_name, i.open, i.high, i.low, i.close, i.volume, {nav_column}
+            FROM index_data i
+            {nav_join}
+            WHERE i.index_name = ?{date_filter}
+            ORDER BY i.date
+            """
+            params = [index_name] + date_params
+        else:
+            query = f"""
+            SELECT i.date, i.index_name, i.open, i.high, i.low, i.close, i.volume, {nav_column}
+            FROM index_bars i
+            {nav_join}
+            WHERE i.index_name = ? AND i.timeframe = ?{date_filter}
+            ORDER BY i.date
+            """
+            params = [index_name, timeframe] + date_params
+        
+        df = pd.read_sql_query(query, conn, params=params)
+        conn.close()
+        
+        if not df.empty:
+            df['date'] = pd.to_datetime(df['date'])
+        
+        return df
+    
+    def get_indicator_data(self, symbol: str, timeframe: str = 'daily',
+                           start_date: str = None, end_date: str = None) -> pd.DataFrame:
+        """获取股票技术指标（日线读取数据库物化结果，其他周期即时计算），结果带缓存"""
+        def loader():
+            conn = sqlite3.connect(self.kline_db_path)
+            try:
+                return load_indicators(conn, "kline", symbol, timeframe, start_date, end_date)
+            finally:
+                conn.close()
+        
+        try:
+            return self.stock_cache.get_or_load(
+                'indicators', symbol, (start_date, end_date, timeframe, STORED_ADJUST), loader
+            )
+        except Exception as e:
+            print(f"获取技术指标失败: {e}")
+            return pd.DataFrame()
+    
+    def get_base_rows(self, symbols: list, index_name: str, timeframe: str = 'daily',
+                      base_date: str = None) -> list:
+        """标准化基期K线：各股票及指数在 base_date 当天或之后的第一根K线的 (close, nav)
+        
+        Returns:
+            与 symbols + [index_name] 一一对应的列表，基期之后无数据时为 None
+        """
+        conn = sqlite3.connect(self.kline_db_path)
+        try:
+            rows = [self._load_base_row(conn, 'kline', symbol, timeframe, base_date) for symbol in symbols]
+        finally:
+            conn.close()
+        
+        conn = sqlite3.connect(self.index_db_path)
+        try:
+            rows.append(self._load_base_row(conn, 'index', index_name, timeframe, base_date))
+        finally:
+            conn.close()
+        return rows
+    
+    @staticmethod
+    def _load_base_row(conn: sqlite3.Connection, source: str, key_value: str,
+                       timeframe: str = 'daily', base_date: str = None):
+        """读取某个股票/指数在基期的 (close, nav)，走 (代码, 日期) 索引只取一行"""
+        spec = BAR_SOURCES[source]
+        key = spec['key']
+        conditions = [f"d.{key} = ?"]
+        params = [key_value]
+        
+        if timeframe == 'daily':
+            table = spec['table']
+        else:
+            table = spec['bar_table']
+            conditions.append("d.timeframe = ?")
+            params.append(timeframe)
+        if base_date:
+            conditions.append("d.date >= ?")
+            params.append(base_date)
+        
+        if has_returns_table(conn, source):
+            returns_table = RETURNS_TABLES[source]
+            nav_column = "r.nav"
+            nav_join = f"LEFT JOIN {returns_table} r ON r.{key} = d.{key} AND r.date = d.date"
+        else:
+            nav_column = "NULL"
+            nav_join = ""
+        
+        return conn.execute(f"""
+            SELECT d.close, {nav_column}
+            FROM {table} d
+            {nav_join}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY d.date LIMIT 1
+        """, params).fetchone()
+    
+    @staticmethod
+    def _date_filter(alias: str, start_date: str = None, end_date: str = None):
+        """日期范围的SQL条件片段和参数（闭区间）"""
+        sql, params = "", []
+        if start_date:
+            sql += f" AND {alias}.date >= ?"
+            params.append(start_date)
+        if end_date:
+            sql += f" AND {alias}.date <= ?"
+            params.append(end_date)
+        return sql, params
+    
+    @staticmethod
+    def _parse_date(value) -> str:
+        """请求中的日期统一为 YYYY-MM-DD（与数据库中的 date 格式一致），空值返回 None"""
+        if not value:
+            return None
+        return pd.to_datetime(value).strftime('%Y-%m-%d')
+    
     def validate_stock_code(self, code: str) -> str:
         """验证和标准化股票代码"""
         code = code.strip()
@@ -298,54 +615,73 @@ class WebChartApp:
         
         return code.lower()
     
-    def normalize_data_for_comparison(self, datasets: list, base_date: str = None) -> list:
-        """标准化数据用于对比"""
-        if not datasets or len(datasets) == 0:
-            return []
+    def normalize_data_for_comparison(self, datasets: list, base_rows: list = None) -> list:
+        """标准化数据用于对比（基期=100）
+        
+        使用收益率表预先计算的累计净值：标准化价格 = nav / 基期nav × 100，
+        不复制DataFrame；尚未回填收益率表的旧数据库退回使用收盘价。
         
-        normalized_datasets = []
+        Args:
+            base_rows: 与 datasets 一一对应的基期 (close, nav)（见 get_base_rows），
+                       为 None 时以各数据集的第一行为基期
         
-        for df in datasets:
-            if df.empty:
+        Returns:
+            与 datasets 一一对应的标准化价格Series，数据为空或基期之后无数据时为 None
+        """
+        normalized = []
+        
+        for i, df in enumerate(datasets):
+            base_row = base_rows[i] if base_rows is not None else None
+            if df.empty or (base_rows is not None and base_row is None):
+                normalized.append(None)
                 continue
             
-            df_copy = df.copy()
-            
-            # 确定基准日期
-            if base_date:
-                try:
-                    base_date_dt = pd.to_datetime(base_date)
-                    # 找到最接近基准日期的数据点
-                    base_row = df_copy[df_copy['date'] >= base_date_dt].iloc[0:1]
-                except:
-                    base_row = df_copy.iloc[0:1]
+            use_nav = 'nav' in df.columns and df['nav'].notna().all()
+            if base_row is None:
+                values = df['nav'] if use_nav else df['close']
+                base = values.iloc[0]
             else:
-                base_row = df_copy.iloc[0:1]
-            
-            if base_row.empty:
-                continue
-            
-            base_price = base_row['close'].iloc[0]
-            
-            # 计算标准化价格（基期=100）
-            df_copy['normalized_price'] = (df_copy['close'] / base_price) * 100
+                base_close, base_nav = base_row
+                use_nav = use_nav and base_nav is not None
+                values = df['nav'] if use_nav else df['close']
+                # 基期值与数据同精度（紧凑模式下收盘价为 float32），保证与全量读取时结果一致
+                base = values.dtype.type(base_nav if use_nav else base_close)
             
-            normalized_datasets.append(df_copy)
+            normalized.append(values / base * 100)
         
-        return normalized_datasets
+        return normalized
     
-    def create_chart_json(self, stock_datasets: list, index_data: pd.DataFrame, 
-                         normalize: bool = False, start_date: str = None, end_date: str = None):
-        """创建图表JSON数据"""
+    def create_chart_json(self, stock_datasets: list, index_data: pd.DataFrame,
+                         normalize: bool = False, base_rows: list = None,
+                         indicators: list = None, indicator_data: dict = None,
+                         max_points: int = None, binary: bool = False, color_order: list = None):
+        """创建图表JSON数据
         
-        # 如果需要标准化
+        stock_datasets、index_data 已按请求的日期范围（查询范围与可视范围的交集）在SQL中过滤。
+        
+        Args:
+            base_rows: 标准化基期K线（见 get_base_rows），为 None 时以各数据集第一行为基期
+            indicators: 叠加的技术指标名称（见 indicator_engine.INDICATORS）
+            indicator_data: {股票代码: 指标DataFrame}
+            max_points: 每条曲线最多输出的点数，超过时按LTTB降采样
+            binary: 返回 {'data', 'layout'} 字典，数值序列编码为类型化数组、日期为毫秒时间戳；
+                    否则返回 fig.to_json() 字符串（数值为列表）
+            color_order: 请求的股票代码顺序（去重后），股票颜色按其中的位置分配；
+                         缺省按 stock_datasets 中的位置
+        """
+        indicators = indicators or []
+        indicator_data = indicator_data or {}
+        
+        # 副图指标（MACD/RSI）各占一个子图，自下而上排列
+        panels = [name for name in indicators if not INDICATORS[name]['overlay']]
+        panel_height = 0.18
+        panel_gap = 0.05
+        
+        # 如果需要标准化（返回与数据集一一对应的标准化价格）
         if normalize:
-            all_datasets = stock_datasets + ([index_data] if not index_data.empty else [])
-            normalized_datasets = self.normalize_data_for_comparison(all_datasets, start_date)
-            
-            if normalized_datasets:
-                stock_datasets = normalized_datasets[:-1] if not index_data.empty else normalized_datasets
-                index_data = normalized_datasets[-1] if not index_data.empty and len(normalized_datasets) > len(stock_datasets) else pd.DataFrame()
+            normalized_prices = self.normalize_data_for_comparison(stock_datasets + [index_data], base_rows)
+        else:
+            normalized_prices = [None] * (len(stock_datasets) + 1)
         
         # 创建plotly图形
         fig = go.Figure()
@@ -355,21 +691,15 @@ class WebChartApp:
         
         # 绘制股票数据
         for i, stock_df in enumerate(stock_datasets):
-            if stock_df.empty:
+            if stock_df.empty or (normalize and normalized_prices[i] is None):
                 continue
             
-            # 筛选日期范围
-            plot_df = stock_df.copy()
-            if start_date:
-                plot_df = plot_df[plot_df['date'] >= pd.to_datetime(start_date)]
-            if end_date:
-                plot_df = plot_df[plot_df['date'] <= pd.to_datetime(end_date)]
-            
-            if plot_df.empty:
-                continue
-            
-            color = colors[i % len(colors)]
-            y_data = plot_df['normalized_price'] if normalize else plot_df['close']
+            plot_df = stock_df
+            symbol = plot_df['symbol'].iloc[0]
+            color_index = color_order.index(symbol) if color_order and symbol in color_order else i
+            color = colors[color_index % len(colors)]
+            y_data = normalized_prices[i] if normalize else plot_df['close']
+            plot_df, y_data = self._downsample(plot_df, y_data, max_points)
             
             # 计算点的大小基于成交量 (保留原方法，暂时不使用)
             volumes = plot_df['volume']
@@ -385,85 +715,87 @@ class WebChartApp:
             else:
                 volume_opacity = 0.7
             
-            # 准备hover信息
-            hover_text = []
-            for _, row in plot_df.iterrows():
-                date_str = row['date'].strftime('%Y-%m-%d')
-                volume_str = f"{row['volume']:,}"
-                amount_str = f"{row['amount']:,.0f}" if 'amount' in row and pd.notna(row['amount']) else "N/A"
-                
-                if normalize:
-                    price_info = f"标准化价格: {row['normalized_price']:.2f}"
-                    orig_price_info = f"<br>原始价格: {row['close']:.2f}"
-                else:
-                    price_info = f"收盘价: {row['close']:.2f}"
-                    orig_price_info = f"<br>开盘价: {row['open']:.2f}<br>最高价: {row['high']:.2f}<br>最低价: {row['low']:.2f}"
-                
-                hover_text.append(
-                    f"<b>{row['name']} ({row['symbol']})</b><br>"
-                    f"日期: {date_str}<br>"
-                    f"{price_info}{orig_price_info}<br>"
-                    f"成交量: {volume_str}<br>"
-                    f"成交额: {amount_str}元"
-                )
+            # hover信息：数值放在 customdata，每条曲线一个 hovertemplate 由前端格式化
+            if normalize:
+                hover_columns = ['close', 'volume', 'amount']
+                price_info = "标准化价格: %{y:.2f}<br>原始价格: %{customdata[0]:.2f}"
+            else:
+                hover_columns = ['close', 'open', 'high', 'low', 'volume', 'amount']
+                price_info = ("收盘价: %{customdata[0]:.2f}<br>开盘价: %{customdata[1]:.2f}<br>"
+                              "最高价: %{customdata[2]:.2f}<br>最低价: %{customdata[3]:.2f}")
+            
+            volume_index = len(hover_columns) - 2
+            if plot_df['amount'].notna().any():
+                amount_info = f"%{{customdata[{volume_index + 1}]:,.0f}}"
+            else:
+                amount_info = "N/A"
             
-            # 添加散点图（确保数据为Python原生类型）
+            hovertemplate = (
+                f"<b>{plot_df['name'].iloc[0]} ({plot_df['symbol'].iloc[0]})</b><br>"
+                f"日期: %{{x|%Y-%m-%d}}<br>"
+                f"{price_info}<br>"
+                f"成交量: %{{customdata[{volume_index}]:,.0f}}<br>"
+                f"成交额: {amount_info}元<extra></extra>"
+            )
+            
+            # 添加散点图（JSON模式转为Python列表，二进制模式保留numpy数组）
+            if hasattr(volume_opacity, 'tolist'):
+                # 透明度无需双精度，二进制模式用 float32
+                volume_opacity = self._trace_values(
+                    volume_opacity.astype(np.float32) if binary else volume_opacity, binary
+                )
             fig.add_trace(go.Scatter(
-                x=plot_df['date'].tolist(),  # 转换为Python列表
-                y=y_data.tolist(),  # 转换为Python列表
+                x=self._trace_values(plot_df['date'], binary),
+                y=self._trace_values(y_data, binary),
                 mode='markers+lines',
                 marker=dict(
                     size=12,  # 统一大小
                     color=color,
-                    opacity=volume_opacity.tolist() if hasattr(volume_opacity, 'tolist') else volume_opacity,  # 用透明度表示成交量
+                    opacity=volume_opacity,  # 用透明度表示成交量
                     line=dict(width=1, color='white')
                     # 可切换回原方法: size=normalized_volume_size.tolist() if hasattr(normalized_volume_size, 'tolist') else normalized_volume_size,
                 ),
                 line=dict(color=color, width=2),
                 name=f"{stock_df.iloc[0]['name']} ({plot_df['symbol'].iloc[0]})",
-                hovertemplate='<extra></extra>%{text}',
-                text=hover_text,
+                hovertemplate=hovertemplate,
+                customdata=self._hover_customdata(plot_df, hover_columns, binary),
                 showlegend=True
             ))
+            
+            if indicators and symbol in indicator_data and not indicator_data[symbol].empty:
+                self._add_indicator_traces(
+                    fig, plot_df, indicator_data[symbol], indicators, panels, color,
+                    f"{stock_df.iloc[0]['name']}", y_data.iloc[0] / plot_df['close'].iloc[0] if normalize else 1.0,
+                    binary
+                )
         
         # 绘制指数数据
-        if not index_data.empty:
-            plot_index = index_data.copy()
-            if start_date:
-                plot_index = plot_index[plot_index['date'] >= pd.to_datetime(start_date)]
-            if end_date:
-                plot_index = plot_index[plot_index['date'] <= pd.to_datetime(end_date)]
+        if not index_data.empty and not (normalize and normalized_prices[-1] is None):
+            plot_index = index_data
             
             if not plot_index.empty:
-                y_data = plot_index['normalized_price'] if normalize else plot_index['close']
+                y_data = normalized_prices[-1] if normalize else plot_index['close']
+                plot_index, y_data = self._downsample(plot_index, y_data, max_points)
                 
-                # 准备指数hover信息
-                hover_text_index = []
-                for _, row in plot_index.iterrows():
-                    date_str = row['date'].strftime('%Y-%m-%d')
-                    
-                    if normalize:
-                        price_info = f"标准化点位: {row['normalized_price']:.2f}"
-                        orig_price_info = f"<br>原始点位: {row['close']:.2f}"
-                    else:
-                        price_info = f"收盘点位: {row['close']:.2f}"
-                        orig_price_info = f"<br>开盘点位: {row['open']:.2f}<br>最高点位: {row['high']:.2f}<br>最低点位: {row['low']:.2f}"
-                    
-                    hover_text_index.append(
-                        f"<b>{row['index_name']}</b><br>"
-                        f"日期: {date_str}<br>"
-                        f"{price_info}{orig_price_info}"
-                    )
+                # 指数hover信息
+                if normalize:
+                    hover_columns = ['close']
+                    price_info = "标准化点位: %{y:.2f}<br>原始点位: %{customdata[0]:.2f}"
+                else:
+                    hover_columns = ['close', 'open', 'high', 'low']
+                    price_info = ("收盘点位: %{customdata[0]:.2f}<br>开盘点位: %{customdata[1]:.2f}<br>"
+                                  "最高点位: %{customdata[2]:.2f}<br>最低点位: %{customdata[3]:.2f}")
                 
                 # 添加指数线（标准化模式使用左轴，非标准化模式使用右轴）
                 trace_config = {
-                    'x': plot_index['date'].tolist(),
-                    'y': y_data.tolist(),
+                    'x': self._trace_values(plot_index['date'], binary),
+                    'y': self._trace_values(y_data, binary),
                     'mode': 'lines',
                     'line': dict(color='red', width=3, dash='dash'),
                     'name': f"{plot_index.iloc[0]['index_name']}",
-                    'hovertemplate': '<extra></extra>%{text}',
-                    'text': hover_text_index,
+                    'hovertemplate': (f"<b>{plot_index['index_name'].iloc[0]}</b><br>"
+                                      f"日期: %{{x|%Y-%m-%d}}<br>{price_info}<extra></extra>"),
+                    'customdata': self._hover_customdata(plot_index, hover_columns, binary),
                     'showlegend': True
                 }
                 
@@ -517,6 +849,20 @@ class WebChartApp:
             )
         }
         
+        # 副图指标的Y轴
+        if panels:
+            layout_config['yaxis']['domain'] = [len(panels) * (panel_height + panel_gap), 1]
+            for k, name in enumerate(panels):
+                bottom = k * (panel_height + panel_gap)
+                layout_config[f'yaxis{3 + k}'] = dict(
+                    title=name.upper(),
+                    title_font=dict(size=12, family="Microsoft YaHei, Arial, sans-serif"),
+                    domain=[bottom, bottom + panel_height],
+                    anchor='x',
+                    showgrid=True,
+                    gridcolor='rgba(128,128,128,0.2)'
+                )
+        
         # 非标准化模式才添加第二个Y轴
         if not normalize:
             layout_config['yaxis2'] = dict(
@@ -550,23 +896,136 @@ class WebChartApp:
             ),
             plot_bgcolor='white',
             paper_bgcolor='white',
-            height=600,
+            height=600 + 150 * len(panels),
             margin=dict(l=80, r=150, t=80, b=60),  # 增加左右边距以容纳双Y轴
             font=dict(family="Microsoft YaHei, Arial, sans-serif")
         )
         
+        # 二进制模式的横坐标为毫秒时间戳，需显式声明日期轴
+        if binary:
+            fig.update_xaxes(type='date')
+            return encode_typed_arrays(fig.to_plotly_json())
+        
         # 返回JSON数据
         return fig.to_json()
     
+    @staticmethod
+    def _downsample(plot_df: pd.DataFrame, y_data: pd.Series, max_points: int = None):
+        """按显示值做LTTB降采样，返回 (plot_df, y_data)，点数不超过 max_points 时原样返回"""
+        if not max_points or len(plot_df) <= max_points:
+            return plot_df, y_data
+        
+        x = plot_df['date'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        keep = lttb_indices(x, y_data.to_numpy(dtype=np.float64, na_value=np.nan), max_points)
+        return plot_df.iloc[keep], y_data.iloc[keep]
+    
+    @staticmethod
+    def _trace_values(values: pd.Series, binary: bool = False):
+        """曲线数据：JSON模式转为Python列表；二进制模式保留numpy数组，日期转为毫秒时间戳"""
+        if not binary:
+            return values.tolist()
+        
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return datetime_to_ms(values.to_numpy())
+        dtype = np.float32 if values.dtype == np.float32 else np.float64
+        return values.to_numpy(dtype=dtype, na_value=np.nan)
+    
+    @staticmethod
+    def _hover_customdata(df: pd.DataFrame, columns: list, binary: bool = False):
+        """hover用的数值数组（每个点一行）
+        
+        价格hover只显示两位小数，先四舍五入可去掉 float32 转换带来的长尾数字，缩小JSON；
+        成交量/成交额按整数显示，保持原值避免二次舍入。二进制模式直接返回 float64 数组。
+        """
+        values = df[columns].to_numpy(dtype=np.float64, copy=True)
+        prices = [i for i, col in enumerate(columns) if col in ('open', 'high', 'low', 'close')]
+        values[:, prices] = np.round(values[:, prices], 2)
+        return values if binary else values.tolist()
+    
+    def _add_indicator_traces(self, fig, plot_df: pd.DataFrame, indicator_df: pd.DataFrame,
+                              indicators: list, panels: list, color: str, stock_name: str,
+                              scale: float = 1.0, binary: bool = False):
+        """为一只股票添加技术指标曲线：均线/布林带叠加在价格轴，MACD/RSI画在副图
+        
+        Args:
+            scale: 叠加线的缩放系数，标准化模式下为 标准化价格/收盘价，使叠加线与价格同一基期
+            binary: 数据保留为numpy数组（见 create_chart_json）
+        """
+        aligned = plot_df[['date']].merge(indicator_df, on='date', how='left')
+        x = self._trace_values(plot_df['date'], binary)
+        
+        for name in indicators:
+            spec = INDICATORS[name]
+            for column in spec['columns']:
+                values = aligned[column]
+                trace = dict(
+                    x=x,
+                    name=f"{stock_name} {column.upper()}",
+                    legendgroup=stock_name,
+                    hovertemplate=f'{stock_name} {column.upper()}: %{{y:.2f}}<extra></extra>',
+                )
+                
+                if spec['overlay']:
+                    fig.add_trace(go.Scatter(
+                        y=self._trace_values(values * scale, binary), mode='lines',
+                        line=dict(color=color, width=1, dash='dot'), **trace
+                    ))
+                elif column == 'macd_hist':
+                    fig.add_trace(go.Bar(
+                        y=self._trace_values(values, binary), marker_color=color, opacity=0.5,
+                        yaxis=f'y{3 + panels.index(name)}', **trace
+                    ))
+                else:
+                    fig.add_trace(go.Scatter(
+                        y=self._trace_values(values, binary), mode='lines',
+                        line=dict(color=color, width=1, dash='dash' if column == 'macd_dea' else 'solid'),
+                        yaxis=f'y{3 + panels.index(name)}', **trace
+                    ))
+    
     def run(self, host='127.0.0.1', port=5002, debug=True):
         """运行Flask应用"""
         print(f"🌐 启动Web图表应用...")
         print(f"🔗 访问地址: http://{host}:{port}")
         print(f"📊 支持交互式股票图表绘制")
         self.app.run(host=host, port=port, debug=debug)
+    
+    def create_asgi_app(self):
+        """包装为ASGI应用（需要 asgiref）
+        
+        WsgiToAsgi 默认让所有请求在同一个线程中串行执行，耗时的图表请求会阻塞搜索补全；
+        这里为每个请求建立独立的线程上下文，请求之间并发，数据库读取仍走有界线程池。
+        """
+        if not ASGI_AVAILABLE:
+            raise RuntimeError("ASGI模式需要安装 asgiref（pip install asgiref uvicorn）")
+        
+        wsgi_app = WsgiToAsgi(self.app)
+        
+        async def asgi_app(scope, receive, send):
+            async with ThreadSensitiveContext():
+                await wsgi_app(scope, receive, send)
+        
+        return asgi_app
+    
+    def run_asgi(self, host='127.0.0.1', port=5002):
+        """以ASGI方式运行（uvicorn），慢请求不阻塞其他请求"""
+        try:
+            import uvicorn
+        except ImportError:
+            print("❌ ASGI模式需要安装 uvicorn: pip install asgiref uvicorn")
+            return
+        
+        print("🌐 启动Web图表应用（ASGI）...")
+        print(f"🔗 访问地址: http://{host}:{port}")
+        uvicorn.run(self.create_asgi_app(), host=host, port=port, lifespan='off')
 
 # 创建应用实例
 app_instance = WebChartApp()
 
+# ASGI入口: uvicorn web_chart_app:asgi_app --port 5002
+asgi_app = app_instance.create_asgi_app() if ASGI_AVAILABLE else None
+
 if __name__ == '__main__':
-    app_instance.run()
+    if '--asgi' in sys.argv:
+        app_instance.run_asgi()
+    else:
+        app_instance.run()